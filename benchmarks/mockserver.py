@@ -0,0 +1,394 @@
+import asyncio
+import gzip
+import json
+import random
+import re
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from threading import Lock, Thread
+from typing import Dict, Optional, Tuple
+
+import httpx
+
+# A stand-in for Dune's GraphQL and auth endpoints, for benchmarking without network
+#   access. The query id is the number of rows its result has, so fetch_query(10_000)
+#   downloads 10k rows. Every query has a single parameter, as FindQuery on dune.com
+#   usually returns one
+#
+# Executions go through the queued and running states for queued_polls and
+#   running_polls GetExecution polls before succeeding. With either set, GetResult
+#   answers with a pending job instead of a finished result, like it does for a
+#   query that is being refreshed
+#
+# latency (plus up to jitter) seconds is waited before every GraphQL response, and
+#   error_rate of them are answered with error_status instead
+
+COLUMNS = ["block_time", "block_number", "address", "amount", "symbol", "success"]
+SYMBOLS = ["WETH", "USDC", "DAI", "WBTC"]
+TIMESTAMP = "2021-06-01T00:00:00+00:00"
+USER_ID = 1
+SQL_LIMIT = re.compile(r"\blimit (\d+)\s*$")
+SESSION = {
+    "token": "benchmark-token",
+    "accessToken": "benchmark-access-token",
+    "sub": "00000000-0000-0000-0000-000000000000",
+}
+
+
+def synthetic_rows(rows: int) -> str:
+    # JSON array of rows, built as text since encoding millions of dicts dominates
+    #   generation time otherwise
+    lines = [
+        f'{{"block_time":"2021-06-01T{i // 3600 % 24:02d}:{i // 60 % 60:02d}:'
+        f'{i % 60:02d}+00:00","block_number":{12_000_000 + i},'
+        f'"address":"\\\\x{i * 2654435761 % 2**160:040x}",'
+        f'"amount":{i * 0.37 % 10_000:.6f},"symbol":"{SYMBOLS[i % 4]}",'
+        f'"success":{"true" if i % 7 else "false"}}}'
+        for i in range(rows)
+    ]
+    return "[" + ",".join(lines) + "]"
+
+
+def execution_status(key: str, value: Optional[dict]) -> dict:
+    status = {
+        "execution_queued": None,
+        "execution_running": None,
+        "execution_succeeded": None,
+        "execution_failed": None,
+        "__typename": "response",
+    }
+    status[key] = value
+    return {"data": {"get_execution": status}}
+
+
+class MockDune:
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        error_status: int = 503,
+        queued_polls: int = 0,
+        running_polls: int = 0,
+        compress: bool = False,
+        seed: int = 0,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.queued_polls = queued_polls
+        self.running_polls = running_polls
+        # gzip result bodies when the client accepts it, as dune.com does
+        self.compress = compress
+        self.requests: Dict[str, int] = dict()
+        self._random = random.Random(seed)
+        self._jobs: Dict[str, Tuple[int, int]] = dict()  # job id -> (query id, polls)
+        self._job_ids = count(1)
+        self._hashes = set()
+        self._bodies: Dict[Tuple[int, bool, bool], bytes] = dict()
+        self._lock = Lock()
+
+    def transport(self) -> httpx.MockTransport:
+        return httpx.MockTransport(self.handle)
+
+    def async_transport(self) -> httpx.MockTransport:
+        # Latency is awaited rather than slept, so concurrent requests overlap
+        return httpx.MockTransport(self.ahandle)
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        delay, response = self.respond(request)
+        if delay:
+            time.sleep(delay)
+        return response
+
+    async def ahandle(self, request: httpx.Request) -> httpx.Response:
+        delay, response = self.respond(request)
+        if delay:
+            await asyncio.sleep(delay)
+        return response
+
+    def respond(self, request: httpx.Request) -> Tuple[float, httpx.Response]:
+        # The response and how long to wait before sending it
+        if request.url.path.startswith(("/api", "/auth")):
+            return 0.0, httpx.Response(200, json=SESSION)
+
+        body = json.loads(request.content)
+        operation = body.get("operationName")
+        with self._lock:
+            self.requests[operation] = self.requests.get(operation, 0) + 1
+            delay = self.latency + self._random.random() * self.jitter
+            failed = self._random.random() < self.error_rate
+        if failed:
+            return delay, httpx.Response(
+                self.error_status, headers={"retry-after": "0"}, text="unavailable"
+            )
+
+        persisted = body.get("extensions", dict()).get("persistedQuery")
+        if persisted is not None:
+            if "query" in body:
+                self._hashes.add(persisted["sha256Hash"])
+            elif persisted["sha256Hash"] not in self._hashes:
+                return delay, httpx.Response(
+                    200,
+                    json={
+                        "errors": [
+                            {
+                                "message": "PersistedQueryNotFound",
+                                "extensions": {"code": "PERSISTED_QUERY_NOT_FOUND"},
+                            }
+                        ]
+                    },
+                )
+
+        handler = getattr(self, f"on_{operation}", None)
+        if handler is None:
+            return delay, httpx.Response(
+                200, json={"errors": [{"message": f"Unknown operation {operation}"}]}
+            )
+        accepts_gzip = "gzip" in request.headers.get("accept-encoding", "")
+        return delay, handler(body.get("variables", dict()), accepts_gzip)
+
+    def new_job(self, query_id: int) -> str:
+        with self._lock:
+            job_id = f"job-{next(self._job_ids)}"
+            self._jobs[job_id] = (query_id, 0)
+        return job_id
+
+    def poll_job(self, job_id: str) -> int:
+        # How many times the job was polled before this poll
+        with self._lock:
+            query_id, polls = self._jobs[job_id]
+            self._jobs[job_id] = (query_id, polls + 1)
+        return polls
+
+    def on_FindSessionUser(self, variables: dict, accepts_gzip: bool) -> httpx.Response:
+        return httpx.Response(200, json={"data": {"users": [{"id": USER_ID}]}})
+
+    def on_FindQuery(self, variables: dict, accepts_gzip: bool) -> httpx.Response:
+        query_id = variables["id"]
+        query = {
+            "id": query_id,
+            "name": f"Synthetic {query_id} rows",
+            "description": "",
+            "query": f"select * from synthetic limit {query_id}",
+            "parameters": [
+                {
+                    "key": "Start Date",
+                    "type": "datetime",
+                    "value": "2021-06-01 00:00:00",
+                }
+            ],
+            "created_at": TIMESTAMP,
+            "updated_at": TIMESTAMP,
+            "user": {"id": USER_ID, "name": "benchmark", "profile_image_url": None},
+        }
+        return httpx.Response(200, json={"data": {"queries": [query]}})
+
+    def on_GetResult(self, variables: dict, accepts_gzip: bool) -> httpx.Response:
+        query_id = variables["query_id"]
+        if self.queued_polls or self.running_polls:
+            result = {"result_id": None, "job_id": self.new_job(query_id)}
+        else:
+            result = {"result_id": f"result-{query_id}", "job_id": None}
+        return httpx.Response(200, json={"data": {"get_result_v3": result}})
+
+    def on_UpsertQuery(self, variables: dict, accepts_gzip: bool) -> httpx.Response:
+        # New queries are numbered by the row count their SQL asks for, the SQL
+        #   FindQuery returns, so they can be fetched like any other
+        object = variables["object"]
+        match = SQL_LIMIT.search(object.get("query") or "")
+        query_id = int(object.get("id") or (match.group(1) if match else 1_000))
+        return httpx.Response(
+            200, json={"data": {"insert_queries_one": {"id": query_id}}}
+        )
+
+    def on_ExecuteQuery(self, variables: dict, accepts_gzip: bool) -> httpx.Response:
+        job_id = self.new_job(variables["query_id"])
+        return httpx.Response(200, json={"data": {"execute_query": {"job_id": job_id}}})
+
+    def on_GetExecution(self, variables: dict, accepts_gzip: bool) -> httpx.Response:
+        return self.execution(variables, accepts_gzip, rows=True)
+
+    def on_GetExecutionHead(
+        self, variables: dict, accepts_gzip: bool
+    ) -> httpx.Response:
+        return self.execution(variables, accepts_gzip, rows=False)
+
+    def execution(
+        self, variables: dict, accepts_gzip: bool, rows: bool
+    ) -> httpx.Response:
+        execution_id = variables["execution_id"]
+        query_id = variables["query_id"]
+        if execution_id in self._jobs:
+            polls = self.poll_job(execution_id)
+            if polls < self.queued_polls:
+                queued = {
+                    "execution_id": execution_id,
+                    "execution_user_id": USER_ID,
+                    "position": self.queued_polls - polls,
+                    "execution_type": "execution_type_interactive",
+                    "created_at": TIMESTAMP,
+                }
+                return httpx.Response(
+                    200, json=execution_status("execution_queued", queued)
+                )
+            if polls < self.queued_polls + self.running_polls:
+                running = {
+                    "execution_id": execution_id,
+                    "execution_user_id": USER_ID,
+                    "execution_type": "execution_type_interactive",
+                    "started_at": TIMESTAMP,
+                    "created_at": TIMESTAMP,
+                }
+                return httpx.Response(
+                    200, json=execution_status("execution_running", running)
+                )
+        elif execution_id != f"result-{query_id}":
+            failed = {
+                "execution_id": execution_id,
+                "type": "FAILED_TYPE_EXECUTION_FAILED",
+                "message": f"No execution {execution_id}",
+                "metadata": None,
+                "runtime_seconds": 0,
+                "generated_at": TIMESTAMP,
+            }
+            return httpx.Response(
+                200, json=execution_status("execution_failed", failed)
+            )
+
+        gzipped = self.compress and accepts_gzip
+        headers = {"content-type": "application/json"}
+        if gzipped:
+            headers["content-encoding"] = "gzip"
+        return httpx.Response(
+            200, headers=headers, content=self.result_body(query_id, rows, gzipped)
+        )
+
+    def result_body(self, query_id: int, rows: bool, gzipped: bool) -> bytes:
+        # Result bodies are generated once per size, large ones take a while
+        key = (query_id, rows, gzipped)
+        body = self._bodies.get(key)
+        if body is not None:
+            return body
+        succeeded = {
+            "execution_id": f"result-{query_id}",
+            "runtime_seconds": 1,
+            "generated_at": TIMESTAMP,
+            "columns": COLUMNS,
+            "__typename": "execution_succeeded",
+        }
+        text = json.dumps(execution_status("execution_succeeded", succeeded))
+        if rows:
+            # Rows go last, where the streaming parser expects them on dune.com
+            text = text.replace(
+                '"__typename": "execution_succeeded"',
+                '"__typename": "execution_succeeded", "data": '
+                + synthetic_rows(query_id),
+            )
+        body = text.encode()
+        if gzipped:
+            body = gzip.compress(body, compresslevel=1)
+        self._bodies[key] = body
+        return body
+
+
+class MockDuneServer:
+    # Serves a MockDune over HTTP on localhost, so benchmarks include sockets, chunked
+    #   reads and decompression. Use transport()/async_transport() as Dune's transport,
+    #   they send every request to this server whatever its host
+    def __init__(self, mock: MockDune, host: str = "127.0.0.1", port: int = 0):
+        self.mock = mock
+        self._server = ThreadingHTTPServer((host, port), self.request_handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[Thread] = None
+
+    @property
+    def url(self) -> httpx.URL:
+        host, port = self._server.server_address[:2]
+        return httpx.URL(f"http://{host}:{port}")
+
+    def __enter__(self) -> "MockDuneServer":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        self._thread = Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def transport(self, **kwargs) -> httpx.BaseTransport:
+        return LocalTransport(self.url, **kwargs)
+
+    def async_transport(self, **kwargs) -> httpx.AsyncBaseTransport:
+        return AsyncLocalTransport(self.url, **kwargs)
+
+    def request_handler(self):
+        mock = self.mock
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body are separate writes, without this they wait on delayed ACKs
+            disable_nagle_algorithm = True
+
+            def do_GET(self) -> None:
+                self.forward(b"")
+
+            def do_POST(self) -> None:
+                length = int(self.headers.get("content-length") or 0)
+                self.forward(self.rfile.read(length))
+
+            def forward(self, content: bytes) -> None:
+                request = httpx.Request(
+                    self.command,
+                    f"https://{self.headers.get('host')}{self.path}",
+                    headers=dict(self.headers),
+                    content=content,
+                )
+                response = mock.handle(request)
+                # Still compressed, the client does the decoding
+                body = b"".join(response.stream)
+                self.send_response(response.status_code)
+                for key, value in response.headers.items():
+                    if key not in ("content-length", "transfer-encoding"):
+                        self.send_header(key, value)
+                self.send_header("content-length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args) -> None:
+                pass
+
+        return Handler
+
+
+def redirect(request: httpx.Request, url: httpx.URL) -> None:
+    # The Host header still names the original host
+    request.url = request.url.copy_with(scheme=url.scheme, host=url.host, port=url.port)
+
+
+class LocalTransport(httpx.HTTPTransport):
+    def __init__(self, url: httpx.URL, **kwargs):
+        super().__init__(**kwargs)
+        self.url = url
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        redirect(request, self.url)
+        return super().handle_request(request)
+
+
+class AsyncLocalTransport(httpx.AsyncHTTPTransport):
+    def __init__(self, url: httpx.URL, **kwargs):
+        super().__init__(**kwargs)
+        self.url = url
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        redirect(request, self.url)
+        return await super().handle_async_request(request)
@@ -0,0 +1,251 @@
+import argparse
+import gc
+import json
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional
+
+from benchmarks.mockserver import MockDune, MockDuneServer
+from dunebuggy import Dune
+from dunebuggy.core.memo import MemoPolicy
+from dunebuggy.core.polling import PollPolicy
+from dunebuggy.core.retry import RetryPolicy
+
+# Runs the SDK against MockDune and compares the numbers with a stored baseline.
+#
+#   python -m benchmarks.run                     # compare with benchmarks/baseline.json
+#   python -m benchmarks.run --save-baseline     # record a new baseline
+#   python -m benchmarks.run --sizes 1000 10000000 --http
+#
+# Exits with 1 if any metric is more than --tolerance worse than its baseline. Timings
+#   depend on the machine, record a baseline on the machine that does the comparing
+
+BASELINE_PATH = Path(__file__).parent / "baseline.json"
+DEFAULT_SIZES = [1_000, 100_000, 1_000_000]
+DEFAULT_TOLERANCE = 0.25
+
+# Every lookup goes to the server, so repeated fetches measure full round trips
+NO_MEMO = MemoPolicy(metadata_ttl=0, user_ttl=0, result_id_ttl=0)
+FAST_POLLS = PollPolicy(initial_delay=0.005, max_delay=0.005, jitter=0, per_position=0)
+FAST_RETRIES = RetryPolicy(initial_delay=0.001, max_delay=0.001, jitter=0)
+
+
+class Metric(NamedTuple):
+    name: str
+    value: float
+    unit: str
+    higher_is_better: bool = False
+
+
+class Benchmarks:
+    def __init__(self, sizes: List[int], repeat: int = 3, http: bool = False):
+        self.sizes = sizes
+        self.repeat = repeat
+        self.http = http
+        self.metrics: List[Metric] = list()
+
+    @contextmanager
+    def dune(self, mock: MockDune, **kwargs) -> Iterator[Dune]:
+        kwargs = {"memo_policy": NO_MEMO, "poll_policy": FAST_POLLS, **kwargs}
+        if not self.http:
+            with Dune(transport=mock.transport(), **kwargs) as dune:
+                yield dune
+            return
+        with MockDuneServer(mock) as server:
+            with Dune(transport=server.transport(), **kwargs) as dune:
+                yield dune
+
+    def record(self, name: str, value: float, unit: str, higher_is_better=False):
+        metric = Metric(name, value, unit, higher_is_better)
+        self.metrics.append(metric)
+        print(f"  {name:<40} {value:>12.4f} {unit}", flush=True)
+
+    def best_of(self, fn: Callable[[], None]) -> float:
+        # Minimum over the repeats, the least noisy estimate of the cost itself
+        timings = list()
+        for _ in range(self.repeat):
+            start = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - start)
+        return min(timings)
+
+    def run(self) -> List[Metric]:
+        mock = MockDune(compress=self.http)
+        for size in self.sizes:
+            # The first request for a size generates its body, keep that out of timings
+            mock.result_body(size, rows=True, gzipped=mock.compress)
+            self.fetch_latency(mock, size)
+            self.df_memory(mock, size)
+            self.export_speed(mock, size)
+        self.polled_fetch_latency()
+        self.bulk_throughput()
+        self.retried_bulk_throughput()
+        return self.metrics
+
+    def fetch_latency(self, mock: MockDune, size: int) -> None:
+        with self.dune(mock) as dune:
+            dune.fetch_query(size)  # warm up
+            seconds = self.best_of(lambda: dune.fetch_query(size))
+        self.record(f"fetch_query[{size}]", seconds, "s")
+
+    def df_memory(self, mock: MockDune, size: int) -> None:
+        # Peak memory allocated fetching a result and building its DataFrame, for both
+        #   the row-wise and the columnar decoding. Columnar results are decoded while
+        #   they're fetched, so the fetch has to be traced too for the two to compare.
+        #   Response bodies are generated up front and aren't counted
+        for columnar in (False, True):
+            with self.dune(mock, columnar=columnar) as dune:
+                dune.fetch_query(size)  # warm up
+                gc.collect()
+                tracemalloc.start()
+                dune.fetch_query(size).df
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+            name = "df_peak_memory_columnar" if columnar else "df_peak_memory"
+            self.record(f"{name}[{size}]", peak / 2**20, "MiB")
+
+    def export_speed(self, mock: MockDune, size: int) -> None:
+        with self.dune(mock) as dune, tempfile.TemporaryDirectory() as directory:
+            query = dune.fetch_query(size)
+            path = Path(directory)
+            seconds = self.best_of(lambda: query.to_csv(path / "result.csv"))
+            self.record(f"to_csv[{size}]", seconds, "s")
+            if not has_pyarrow():
+                return
+            seconds = self.best_of(lambda: query.to_parquet(path / "result.parquet"))
+            self.record(f"to_parquet[{size}]", seconds, "s")
+
+    def polled_fetch_latency(self, size: int = 1_000) -> None:
+        # Two queued and two running polls at 5ms each before the result arrives
+        mock = MockDune(queued_polls=2, running_polls=2)
+        with self.dune(mock) as dune:
+            seconds = self.best_of(lambda: dune.fetch_query(size))
+        self.record(f"fetch_query_polled[{size}]", seconds, "s")
+
+    def bulk_throughput(self, queries: int = 64, latency: float = 0.02) -> None:
+        # fetch_queries over distinct queries with 20ms of server latency per request
+        mock = MockDune(latency=latency)
+        with self.dune(mock) as dune:
+            seconds = self.best_of(lambda: consume(dune, queries))
+        self.record("fetch_queries_throughput", queries / seconds, "q/s", True)
+
+    def retried_bulk_throughput(self, queries: int = 64, error_rate=0.1) -> None:
+        # As above without latency, with 10% of requests failing with 503 and retried
+        mock = MockDune(error_rate=error_rate, seed=1)
+        with self.dune(mock, retry_policy=FAST_RETRIES) as dune:
+            seconds = self.best_of(lambda: consume(dune, queries))
+        self.record("fetch_queries_throughput_errors", queries / seconds, "q/s", True)
+
+
+def consume(dune: Dune, queries: int) -> None:
+    failed = [
+        result
+        for result in dune.fetch_queries(range(1_000, 1_000 + queries))
+        if not result.ok
+    ]
+    if failed:
+        raise failed[0].error
+
+
+def has_pyarrow() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def load_baseline(path: Path, http: bool) -> Dict[str, dict]:
+    if not path.exists():
+        return dict()
+    baseline = json.loads(path.read_text())
+    if baseline.get("http", False) != http:
+        print("Baseline was recorded with a different --http setting, not comparing")
+        return dict()
+    return baseline["metrics"]
+
+
+def save_baseline(path: Path, metrics: List[Metric], http: bool) -> None:
+    baseline = {
+        "http": http,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "metrics": {
+            metric.name: {
+                "value": metric.value,
+                "unit": metric.unit,
+                "higher_is_better": metric.higher_is_better,
+            }
+            for metric in metrics
+        },
+    }
+    path.write_text(json.dumps(baseline, indent=2) + "\n")
+
+
+def change(metric: Metric, baseline: dict) -> Optional[float]:
+    # Relative change where positive is worse, None without a usable baseline
+    if not baseline.get("value"):
+        return None
+    ratio = metric.value / baseline["value"] - 1
+    return -ratio if metric.higher_is_better else ratio
+
+
+def compare(
+    metrics: List[Metric], baseline: Dict[str, dict], tolerance: float
+) -> List[Metric]:
+    regressions = list()
+    print(f"\n  {'metric':<40} {'baseline':>12} {'current':>12} {'change':>8}")
+    for metric in metrics:
+        previous = baseline.get(metric.name, dict())
+        worse = change(metric, previous)
+        if worse is None:
+            print(f"  {metric.name:<40} {'-':>12} {metric.value:>12.4f} {'new':>8}")
+            continue
+        flag = ""
+        if worse > tolerance:
+            regressions.append(metric)
+            flag = "  REGRESSION"
+        print(
+            f"  {metric.name:<40} {previous['value']:>12.4f} {metric.value:>12.4f} "
+            f"{-worse if metric.higher_is_better else worse:>+8.1%}{flag}"
+        )
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Offline dunebuggy benchmarks")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--http", action="store_true", help="serve the mock over localhost HTTP"
+    )
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    print(f"Running benchmarks for {args.sizes} rows", flush=True)
+    metrics = Benchmarks(args.sizes, args.repeat, args.http).run()
+    if args.save_baseline:
+        save_baseline(args.baseline, metrics, args.http)
+        print(f"\nSaved baseline to {args.baseline}")
+        return 0
+
+    regressions = compare(
+        metrics, load_baseline(args.baseline, args.http), args.tolerance
+    )
+    if regressions:
+        print(
+            f"\n{len(regressions)} metric(s) regressed by more than {args.tolerance:.0%}"
+        )
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
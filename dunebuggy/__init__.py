@@ -1 +1 @@
-from .core import Dune
+from .core import AsyncDune, Dune
@@ -1 +1,2 @@
+from .asyncdune import AsyncDune
 from .dune import Dune, DuneQuery
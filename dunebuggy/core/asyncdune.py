@@ -0,0 +1,491 @@
+import asyncio
+from functools import partial
+from typing import AsyncIterator, Iterable, List, Optional
+
+from httpx import AsyncBaseTransport, AsyncClient, Limits
+
+from dunebuggy.core.asyncgqlquerier import AsyncGraphQLQuerier
+from dunebuggy.core.bulk import (
+    DEFAULT_MAX_WORKERS,
+    BulkResult,
+    QueryRequest,
+    arun_bulk,
+    normalize_requests,
+)
+from dunebuggy.core.cache import ResultCache
+from dunebuggy.core.dune import Dune
+from dunebuggy.core.dunequery import DuneQuery
+from dunebuggy.core.exceptions import DuneError
+from dunebuggy.core.incremental import RefreshDelta, narrow_parameters
+from dunebuggy.core.instrumentation import Instrumentation
+from dunebuggy.core.memo import MemoPolicy
+from dunebuggy.core.operations import Operations
+from dunebuggy.core.polling import PollPolicy, check_cancelled
+from dunebuggy.core.provision import AsyncQueryHandle, CreatedQuery, QuerySpec
+from dunebuggy.core.ratelimit import RateLimiter
+from dunebuggy.core.retry import RetryPolicy
+from dunebuggy.core.session import (
+    SessionStore,
+    dump_cookies,
+    load_cookies,
+    refreshing,
+)
+from dunebuggy.core.sweep import (
+    Overrides,
+    SweepResult,
+    apply_overrides,
+    combine_results,
+    expand_overrides,
+)
+from dunebuggy.core.transport import (
+    DEFAULT_TIMEOUT,
+    TimeoutTypes,
+    build_async_client,
+    check_shared_client,
+    client_headers,
+    has_login,
+)
+from dunebuggy.models.constants import (
+    API_AUTH_URL,
+    CSRF_URL,
+    LOGIN_URL,
+    SESSION_URL,
+    DatasetId,
+)
+from dunebuggy.models.query import (
+    CreateQueryObject,
+    CreateQueryOnConflict,
+    ExecutionStatus,
+    Query,
+    QueryParameter,
+    QueryResultData,
+)
+from dunebuggy.models.session import Session
+
+
+class AsyncDune:
+    # Usage:
+    #   async with AsyncDune(username, password) as dune:
+    #       query = await dune.fetch_query(83579)
+    def __init__(
+        self,
+        username=None,
+        password=None,
+        poll_policy: Optional[PollPolicy] = None,
+        cache: Optional[ResultCache] = None,
+        columnar: bool = False,
+        memo_policy: Optional[MemoPolicy] = None,
+        session_store: Optional[SessionStore] = None,
+        client: Optional[AsyncClient] = None,
+        transport: Optional[AsyncBaseTransport] = None,
+        limits: Optional[Limits] = None,
+        timeout: TimeoutTypes = DEFAULT_TIMEOUT,
+        http2: bool = False,
+        rate_limiter: Optional[RateLimiter] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        operations: Optional[Operations] = None,
+        instrumentation: Optional[Instrumentation] = None,
+    ):
+        # A shared client is used as is (and not closed by this instance), along with
+        #   its login, otherwise one is built from the transport options
+        check_shared_client(client, username)
+        self._owns_client = client is None
+        self.client = client or build_async_client(limits, timeout, http2, transport)
+        self.gqlquerier = AsyncGraphQLQuerier(
+            self.client,
+            columnar=columnar,
+            memo_policy=memo_policy,
+            rate_limiter=rate_limiter,
+            retry_policy=retry_policy,
+            operations=operations,
+            instrumentation=instrumentation,
+        )
+        self.client.headers.update(client_headers())
+        self.instrumentation = self.gqlquerier.instrumentation
+        self.user_id = None
+        self.poll_policy = poll_policy or PollPolicy()
+        self.cache = cache
+        self.session: Optional[Session] = None
+        self.session_store = session_store
+        self._username = username
+        self._password = password
+        self._session_lock = asyncio.Lock()
+        self.gqlquerier.on_unauthorized = self.refresh_session
+
+    async def __aenter__(self) -> "AsyncDune":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+    async def start(self) -> None:
+        # A saved session needs no round trips at all, nor does a shared client that
+        #   is already logged in
+        if await self.restore_session() or has_login(self.client):
+            return
+        # Load in csrf token
+        await self.client.post(CSRF_URL)
+        if self._username is not None and self._password is not None:
+            await self.login(self._username, self._password)
+
+    async def aclose(self) -> None:
+        if self._owns_client:
+            await self.client.aclose()
+
+    async def login(self, username: str, password: str) -> None:
+        await self.client.get(LOGIN_URL)
+        csrf_token = self.client.cookies.get("csrf")
+
+        form_data = Dune.login_form(username, password, csrf_token)
+        await self.client.post(API_AUTH_URL, data=form_data)
+
+        # Fetch AUTH token
+        response = await self.client.post(SESSION_URL)
+        session = Dune.process_session(response)
+
+        self.client.headers.update(Dune.session_headers(session))
+        self.user_id = session.user_id = await self.gqlquerier.get_user_id(session.sub)
+        self._username, self._password = username, password
+        self.session = session
+        await self.save_session()
+
+    async def restore_session(self) -> bool:
+        if self.session_store is None or self._username is None:
+            return False
+        session = await asyncio.to_thread(self.session_store.load, self._username)
+        if session is None:
+            return False
+        load_cookies(self.client.cookies, session)
+        self.client.headers.update(Dune.session_headers(session))
+        self.user_id = session.user_id
+        self.session = session
+        if not session.expired():
+            return True
+        if await self.refresh_session(self.client.headers.get("authorization")):
+            return True
+        self.forget_session()
+        return False
+
+    def forget_session(self) -> None:
+        for header in Dune.session_headers(self.session):
+            self.client.headers.pop(header, None)
+        self.user_id = None
+        self.session = None
+
+    async def save_session(self) -> None:
+        if self.session_store is None or self.session is None:
+            return
+        self.session.cookies = dump_cookies(self.client.cookies)
+        await asyncio.to_thread(self.session_store.save, self._username, self.session)
+
+    async def refresh_session(self, stale_authorization: Optional[str]) -> bool:
+        # Called by the querier when a request is rejected with an expired token.
+        #   Returns whether the request should be retried
+        if self.session is None or refreshing.get():
+            return False
+        async with self._session_lock:
+            if self.client.headers.get("authorization") != stale_authorization:
+                # Another task already refreshed it
+                return True
+            token = refreshing.set(True)
+            try:
+                response = await self.client.post(SESSION_URL)
+                try:
+                    session = Dune.process_session(response)
+                except DuneError:
+                    # The session cookie expired too, log in from scratch
+                    if self._password is None:
+                        return False
+                    await self.client.post(CSRF_URL)
+                    await self.login(self._username, self._password)
+                    return True
+                session.user_id = self.user_id
+                self.client.headers.update(Dune.session_headers(session))
+                self.session = session
+                await self.save_session()
+                return True
+            finally:
+                refreshing.reset(token)
+
+    async def create_query(
+        self,
+        query_name: str,
+        sql: str,
+        dataset_id: DatasetId,
+        parameters: Optional[List[QueryParameter]] = list(),
+        is_temp=False,
+        cancel: Optional[asyncio.Event] = None,
+    ) -> DuneQuery:
+        spec = QuerySpec(query_name, sql, dataset_id, parameters, is_temp)
+        object, on_conflict = Dune.build_create_query(
+            self.user_id, query_name, sql, dataset_id, is_temp
+        )
+        created = await self.create_and_execute(object, on_conflict, parameters)
+        return await self.fetch_created(spec, created, cancel)
+
+    async def create_and_execute(
+        self,
+        object: CreateQueryObject,
+        on_conflict: CreateQueryOnConflict,
+        parameters: List[QueryParameter],
+    ) -> CreatedQuery:
+        upsert_response = await self.gqlquerier.upsert_query(
+            object, on_conflict, self.user_id
+        )
+        query_id = upsert_response["data"]["insert_queries_one"]["id"]
+        execution_id = await self.gqlquerier.execute_query(parameters, query_id)
+        return CreatedQuery(query_id, execution_id)
+
+    async def fetch_created(
+        self,
+        spec: QuerySpec,
+        created: CreatedQuery,
+        cancel: Optional[asyncio.Event] = None,
+    ) -> DuneQuery:
+        parameters = list(spec.parameters or ())
+        metadata, result_data = await asyncio.gather(
+            self.gqlquerier.get_query_metadata(created.query_id, self.user_id),
+            self.gqlquerier.wait_for_execution(
+                created.execution_id,
+                parameters,
+                created.query_id,
+                self.poll_policy,
+                cancel,
+            ),
+        )
+        return Dune.build_query(metadata, parameters, result_data, self)
+
+    async def created_head(
+        self, spec: QuerySpec, created: CreatedQuery
+    ) -> ExecutionStatus:
+        return await self.gqlquerier.get_execution_head(
+            created.execution_id, list(spec.parameters or ()), created.query_id
+        )
+
+    def create_queries(
+        self,
+        specs: Iterable[QuerySpec],
+        max_concurrency: int = DEFAULT_MAX_WORKERS,
+        fetch: bool = True,
+    ) -> List[AsyncQueryHandle]:
+        # Must be called with the event loop running. Only upserts and executions count
+        #   towards max_concurrency, downloads start as soon as their query is created
+        specs = list(specs)
+        creates = [
+            Dune.build_create_query(
+                self.user_id, spec.name, spec.sql, spec.dataset_id, spec.is_temp
+            )
+            for spec in specs
+        ]
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def create(handle: AsyncQueryHandle, object, on_conflict) -> None:
+            async with semaphore:
+                await handle.create(
+                    partial(
+                        self.create_and_execute, object, on_conflict, handle.parameters
+                    )
+                )
+            if fetch:
+                handle.fetch()
+
+        handles = list()
+        for spec, (object, on_conflict) in zip(specs, creates):
+            handle = AsyncQueryHandle(spec, self.fetch_created, self.created_head)
+            handle.start(create(handle, object, on_conflict))
+            handles.append(handle)
+        return handles
+
+    def wait_queries(
+        self,
+        handles: List[AsyncQueryHandle],
+        max_concurrency: int = DEFAULT_MAX_WORKERS,
+    ) -> AsyncIterator[BulkResult]:
+        items = [(index, handle.parameters) for index, handle in enumerate(handles)]
+        return arun_bulk(lambda index, _: handles[index].wait(), items, max_concurrency)
+
+    async def fetch_query(
+        self,
+        query_id: int,
+        parameters: Optional[List[QueryParameter]] = list(),
+        lazy: bool = False,
+        cancel: Optional[asyncio.Event] = None,
+    ) -> DuneQuery:
+        # Lazy queries have to be loaded with aload() (or aload_head() for columns)
+        #   before their result is used
+        requested_parameters = parameters
+        cached = None
+        if self.cache is not None:
+            # Cache reads and writes hit local disk, keep them off the event loop
+            cached = await asyncio.to_thread(
+                self.cache.get, query_id, requested_parameters
+            )
+            if cached is not None and cached.fresh:
+                self.instrumentation.count("cache.hit")
+                return DuneQuery(cached.query, dune=self)
+
+        if parameters:
+            # Custom parameters are known up front, so the metadata and result id
+            #   lookups don't depend on each other
+            metadata, (result_id, job_id) = await asyncio.gather(
+                self.gqlquerier.get_query_metadata(query_id, self.user_id),
+                self.gqlquerier.get_result_id(query_id, parameters),
+            )
+        else:
+            # Default parameters come from the metadata, so wait for it first
+            metadata = await self.gqlquerier.get_query_metadata(query_id, self.user_id)
+            parameters = metadata.parameters
+            result_id, job_id = await self.gqlquerier.get_result_id(
+                query_id, parameters
+            )
+
+        # A stale entry is still good if Dune hasn't produced a newer result since
+        if cached is not None and result_id == cached.execution_id:
+            self.instrumentation.count("cache.revalidated")
+            await asyncio.to_thread(self.cache.touch, query_id, requested_parameters)
+            return Dune.build_query(
+                metadata,
+                parameters,
+                cached.query.result_data,
+                self,
+                result_id=result_id,
+                job_id=job_id,
+            )
+
+        if self.cache is not None:
+            self.instrumentation.count("cache.miss")
+
+        async def load() -> QueryResultData:
+            result_data = await self.gqlquerier.wait_for_execution(
+                execution_id=result_id or job_id,
+                parameters=parameters,
+                query_id=query_id,
+                policy=self.poll_policy,
+                cancel=cancel,
+            )
+            if self.cache is not None:
+                query = Query.construct(metadata=metadata, result_data=result_data)
+                await asyncio.to_thread(
+                    self.cache.put, query_id, requested_parameters, query
+                )
+            return result_data
+
+        head = partial(
+            self.gqlquerier.wait_for_execution_head,
+            result_id or job_id,
+            parameters,
+            query_id,
+            policy=self.poll_policy,
+            cancel=cancel,
+        )
+        dune_query = Dune.build_query(
+            metadata,
+            parameters,
+            None,
+            self,
+            loader=load,
+            head=head,
+            result_id=result_id,
+            job_id=job_id,
+        )
+        return dune_query if lazy else await dune_query.aload()
+
+    async def stream_query(
+        self, query_id: int, parameters: Optional[List[QueryParameter]] = list()
+    ) -> DuneQuery:
+        # Rows are streamed from the returned DuneQuery with aiter_dfs
+        metadata = await self.gqlquerier.get_query_metadata(query_id, self.user_id)
+        if not parameters:
+            parameters = metadata.parameters
+        result_id, job_id = await self.gqlquerier.get_result_id(query_id, parameters)
+        if len(parameters):
+            metadata.parameters = parameters
+
+        stream = partial(
+            self.gqlquerier.stream_execution,
+            result_id or job_id,
+            parameters,
+            query_id,
+            policy=self.poll_policy,
+        )
+        head = partial(
+            self.gqlquerier.wait_for_execution_head,
+            result_id or job_id,
+            parameters,
+            query_id,
+            policy=self.poll_policy,
+        )
+        query = Query(metadata=metadata, result_data=None)
+        return DuneQuery(
+            query,
+            stream=stream,
+            columnar=self.gqlquerier.columnar,
+            dune=self,
+            head=head,
+            result_id=result_id,
+            job_id=job_id,
+        )
+
+    async def refresh_query(
+        self,
+        query: DuneQuery,
+        key: str,
+        since_parameter: Optional[str] = None,
+        time_column: Optional[str] = None,
+    ) -> RefreshDelta:
+        parameters = query.parameters
+        narrowed = narrow_parameters(
+            parameters, query.df, key, since_parameter, time_column
+        )
+        if narrowed is not None:
+            execution_id = await self.gqlquerier.execute_query(narrowed, query.query_id)
+            parameters = narrowed
+        else:
+            result_id, job_id = await self.gqlquerier.get_result_id(
+                query.query_id, parameters
+            )
+            if result_id is not None and result_id == query.result_data.execution_id:
+                return query.merge(query.result_data, key)
+            execution_id = result_id or job_id
+
+        result_data = await self.gqlquerier.wait_for_execution(
+            execution_id, parameters, query.query_id, self.poll_policy
+        )
+        return query.merge(result_data, key)
+
+    def fetch_queries(
+        self,
+        requests: Iterable[QueryRequest],
+        max_concurrency: int = DEFAULT_MAX_WORKERS,
+        cancel: Optional[asyncio.Event] = None,
+    ) -> AsyncIterator[BulkResult]:
+        async def fetch(query_id: int, parameters: List[QueryParameter]) -> DuneQuery:
+            check_cancelled(cancel)
+            return await self.fetch_query(query_id, parameters, cancel=cancel)
+
+        return arun_bulk(fetch, normalize_requests(requests), max_concurrency)
+
+    async def sweep_query(
+        self,
+        query_id: int,
+        overrides: Overrides,
+        max_concurrency: int = DEFAULT_MAX_WORKERS,
+        cancel: Optional[asyncio.Event] = None,
+    ) -> SweepResult:
+        metadata = await self.gqlquerier.get_query_metadata(query_id, self.user_id)
+        overrides = expand_overrides(overrides)
+        items = [
+            (index, apply_overrides(metadata.parameters, override))
+            for index, override in enumerate(overrides)
+        ]
+
+        async def run(index: int, parameters: List[QueryParameter]) -> QueryResultData:
+            check_cancelled(cancel)
+            execution_id = await self.gqlquerier.execute_query(parameters, query_id)
+            return await self.gqlquerier.wait_for_execution(
+                execution_id, parameters, query_id, self.poll_policy, cancel
+            )
+
+        results = [result async for result in arun_bulk(run, items, max_concurrency)]
+        return combine_results(overrides, results, self.gqlquerier.columnar)
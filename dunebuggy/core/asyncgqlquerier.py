@@ -0,0 +1,315 @@
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+from uuid import UUID
+
+from httpx import AsyncClient, Response, TransportError
+
+from dunebuggy.core.exceptions import DuneGraphQLError
+from dunebuggy.core.gqlquerier import GraphQLQuerier
+from dunebuggy.core.instrumentation import Instrumentation, received_bytes
+from dunebuggy.core.memo import (
+    MISSING,
+    AsyncSingleFlight,
+    MemoPolicy,
+    request_key,
+)
+from dunebuggy.core.operations import JSON_HEADERS, Operations
+from dunebuggy.core.polling import PollPolicy, await_for, bounded_delay, check_status
+from dunebuggy.core.ratelimit import RateLimiter
+from dunebuggy.core.retry import RetryPolicy
+from dunebuggy.core.streaming import DEFAULT_BATCH_SIZE, ExecutionStreamParser, RowBatch
+from dunebuggy.models.constants import APP_API_URL, GRAPH_QL_URL
+from dunebuggy.models.gqlqueries import QueryName
+from dunebuggy.models.query import (
+    CreateQueryObject,
+    CreateQueryOnConflict,
+    ExecutionStatus,
+    QueryMetadata,
+    QueryParameter,
+    QueryResultData,
+)
+
+
+class AsyncGraphQLQuerier(GraphQLQuerier):
+    # Same operations as GraphQLQuerier, awaited over an httpx.AsyncClient. Request
+    #   building and response parsing are inherited unchanged
+    def __init__(
+        self,
+        client: AsyncClient,
+        columnar: bool = False,
+        memo_policy: Optional[MemoPolicy] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        operations: Optional[Operations] = None,
+        instrumentation: Optional[Instrumentation] = None,
+    ):
+        super().__init__(
+            client,
+            columnar=columnar,
+            memo_policy=memo_policy,
+            rate_limiter=rate_limiter,
+            retry_policy=retry_policy,
+            operations=operations,
+            instrumentation=instrumentation,
+        )
+        self.single_flight = AsyncSingleFlight()
+        self.on_unauthorized: Optional[Callable[[Optional[str]], Awaitable[bool]]] = (
+            None
+        )
+
+    async def coalesce(
+        self,
+        query_name: QueryName,
+        variables: dict,
+        fn: Callable[[], Awaitable[Any]],
+    ) -> Any:
+        key = request_key(query_name, variables)
+        value = self.memo.get(key)
+        if value is MISSING:
+            value = await self.single_flight.do(key, fn)
+            ttl = self.memo_ttl(query_name, value)
+            if ttl > 0:
+                self.memo.set(key, value, ttl)
+        else:
+            self.instrumentation.count("memo.hit", operation=query_name.value)
+        return value
+
+    async def send(
+        self, query_name: QueryName, url: str, content: bytes, stream: bool = False
+    ) -> Response:
+        request = self.client.build_request(
+            "POST", url, content=content, headers=JSON_HEADERS
+        )
+        with self.instrumentation.span(
+            "graphql.request",
+            operation=query_name.value,
+            host=request.url.host,
+            bytes_sent=len(content),
+        ) as span:
+            attempt = 0
+            throttled = 0.0
+            while True:
+                if self.rate_limiter is not None:
+                    throttled += await self.rate_limiter.aacquire(url)
+                try:
+                    response = await self.client.send(request, stream=stream)
+                except TransportError as error:
+                    delay = self.retry_delay(query_name, attempt, error=error)
+                    if delay is None:
+                        raise
+                else:
+                    delay = self.retry_delay(query_name, attempt, response=response)
+                    if delay is None:
+                        break
+                    await response.aclose()
+                await asyncio.sleep(delay)
+                attempt += 1
+            span.set(
+                status_code=response.status_code,
+                bytes_received=None if stream else received_bytes(response),
+                retries=attempt,
+                throttled_seconds=throttled,
+            )
+        return response
+
+    async def send_stream(
+        self, query_name: QueryName, url: str, content: bytes
+    ) -> Response:
+        authorization = self.client.headers.get("authorization")
+        response = await self.send(query_name, url, content, stream=True)
+        if self.on_unauthorized is None or not self.may_be_unauthorized(response):
+            return response
+        await response.aread()
+        if self.is_unauthorized(response) and await self.on_unauthorized(authorization):
+            await response.aclose()
+            response = await self.send(query_name, url, content, stream=True)
+        return response
+
+    async def post_content(
+        self, query_name: QueryName, url: str, content: bytes
+    ) -> dict:
+        authorization = self.client.headers.get("authorization")
+        response = await self.send(query_name, url, content)
+        if self.is_unauthorized(response) and self.on_unauthorized is not None:
+            if await self.on_unauthorized(authorization):
+                response = await self.send(query_name, url, content)
+        with self.instrumentation.span("graphql.decode", operation=query_name.value):
+            return self.parse_response(response)
+
+    async def post_graph_ql(
+        self, query_name: QueryName, variables: dict, url: str = GRAPH_QL_URL
+    ) -> dict:
+        if self.operations.persisted:
+            content = self.build_request(query_name, variables, query=False, hash=True)
+            try:
+                return await self.post_content(query_name, url, content)
+            except DuneGraphQLError as error:
+                if not self.operations.handle_miss(error.errors):
+                    raise
+        content = self.build_request(
+            query_name, variables, hash=self.operations.persisted
+        )
+        return await self.post_content(query_name, url, content)
+
+    async def get_user_id(self, sub: UUID) -> int:
+        variables = {"sub": sub}
+
+        async def fetch() -> int:
+            user_info = await self.post_graph_ql(QueryName.FIND_SESSION_USER, variables)
+            return self.process_user_id(user_info)
+
+        return await self.coalesce(QueryName.FIND_SESSION_USER, variables, fetch)
+
+    async def get_query_metadata(self, query_id: int, user_id: int) -> QueryMetadata:
+        variables = self.metadata_variables(query_id, user_id)
+
+        async def fetch() -> QueryMetadata:
+            raw_metadata = await self.post_graph_ql(QueryName.FIND_QUERY, variables)
+            return self.process_metadata(raw_metadata)
+
+        metadata = await self.coalesce(QueryName.FIND_QUERY, variables, fetch)
+        return metadata.copy(deep=True)
+
+    async def get_result_id(
+        self, query_id: int, parameters: Optional[List[QueryParameter]] = None
+    ) -> Tuple[str, str]:
+        variables = self.result_id_variables(query_id, parameters)
+
+        async def fetch() -> Tuple[str, str]:
+            result_id_data = await self.post_graph_ql(QueryName.GET_RESULT, variables)
+            return self.process_result_id(result_id_data)
+
+        return await self.coalesce(QueryName.GET_RESULT, variables, fetch)
+
+    async def upsert_query(
+        self,
+        object: CreateQueryObject,
+        on_conflict: CreateQueryOnConflict,
+        user_id: int,
+    ) -> Dict:
+        return await self.post_graph_ql(
+            QueryName.UPSERT_QUERY,
+            self.upsert_variables(object, on_conflict, user_id),
+        )
+
+    async def execute_query(self, parameters: list, query_id: int) -> str:
+        execute_response = await self.post_graph_ql(
+            QueryName.EXECUTE_QUERY, self.execute_variables(parameters, query_id)
+        )
+        return self.process_execute(execute_response)
+
+    async def get_execution_status(
+        self, execution_id: str, parameters: list, query_id: int
+    ) -> ExecutionStatus:
+        variables = self.execution_variables(execution_id, parameters, query_id)
+
+        async def fetch() -> ExecutionStatus:
+            raw_result = await self.post_graph_ql(
+                QueryName.GET_EXECUTION, variables=variables, url=APP_API_URL
+            )
+            return self.instrumented_process_execution(raw_result)
+
+        return await self.coalesce(QueryName.GET_EXECUTION, variables, fetch)
+
+    async def get_execution(
+        self, execution_id: str, parameters: list, query_id: int
+    ) -> QueryResultData:
+        status = await self.get_execution_status(execution_id, parameters, query_id)
+        return self.require_result(status)
+
+    async def get_execution_head(
+        self, execution_id: str, parameters: list, query_id: int
+    ) -> ExecutionStatus:
+        variables = self.execution_variables(execution_id, parameters, query_id)
+
+        async def fetch() -> ExecutionStatus:
+            raw_result = await self.post_graph_ql(
+                QueryName.GET_EXECUTION_HEAD, variables=variables, url=APP_API_URL
+            )
+            return self.process_execution_head(raw_result)
+
+        return await self.coalesce(QueryName.GET_EXECUTION_HEAD, variables, fetch)
+
+    async def wait_for_execution_head(
+        self,
+        execution_id: str,
+        parameters: list,
+        query_id: int,
+        policy: Optional[PollPolicy] = None,
+        cancel: Optional[asyncio.Event] = None,
+    ) -> QueryResultData:
+        return await await_for(
+            lambda: self.get_execution_head(execution_id, parameters, query_id),
+            policy or PollPolicy(),
+            cancel,
+        )
+
+    async def wait_for_execution(
+        self,
+        execution_id: str,
+        parameters: list,
+        query_id: int,
+        policy: Optional[PollPolicy] = None,
+        cancel: Optional[asyncio.Event] = None,
+    ) -> QueryResultData:
+        return await await_for(
+            lambda: self.get_execution_status(execution_id, parameters, query_id),
+            policy or PollPolicy(),
+            cancel,
+        )
+
+    async def stream_execution(
+        self,
+        execution_id: str,
+        parameters: list,
+        query_id: int,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        policy: Optional[PollPolicy] = None,
+    ) -> AsyncIterator[RowBatch]:
+        policy = policy or PollPolicy()
+        deadline = policy.deadline()
+        variables = self.execution_variables(execution_id, parameters, query_id)
+        content = self.build_request(QueryName.GET_EXECUTION, variables)
+        attempt = 0
+        while True:
+            parser = ExecutionStreamParser()
+            rows = list()
+            received = 0
+            response = await self.send_stream(
+                QueryName.GET_EXECUTION, APP_API_URL, content
+            )
+            span = self.instrumentation.start(
+                "graphql.stream", operation=QueryName.GET_EXECUTION.value
+            )
+            error = None
+            try:
+                if response.is_error:
+                    await response.aread()
+                    self.parse_response(response)
+                async for text in response.aiter_text():
+                    new_rows = parser.feed(text)
+                    received += len(new_rows)
+                    rows.extend(new_rows)
+                    batches, rows = self.split_batches(parser.columns, rows, batch_size)
+                    for batch in batches:
+                        yield batch
+            except Exception as exception:
+                error = exception
+                raise
+            finally:
+                await response.aclose()
+                span.set(bytes_received=response.num_bytes_downloaded, rows=received)
+                self.instrumentation.finish(span, error)
+            parser.close()
+            if rows:
+                yield RowBatch(parser.columns, rows)
+
+            raw_result = self.check_errors(parser.raw_result())
+            status = self.process_execution(raw_result)
+            if check_status(status) is not None:
+                if not received:
+                    # Empty results still carry their columns, e.g. for CSV headers
+                    yield RowBatch(parser.columns or list(), list())
+                return
+            await asyncio.sleep(bounded_delay(policy, attempt, status, deadline))
+            attempt += 1
@@ -0,0 +1,94 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
+
+from dunebuggy.models.query import QueryParameter
+
+QueryRequest = Union[int, Tuple[int, Optional[List[QueryParameter]]]]
+
+DEFAULT_MAX_WORKERS = 8
+
+
+class BulkResult(NamedTuple):
+    # One entry per requested item, either a value or the error raised producing it
+    key: Any
+    parameters: List[QueryParameter]
+    value: Any = None
+    error: Optional[BaseException] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def normalize_requests(
+    requests: Iterable[QueryRequest],
+) -> List[Tuple[int, List[QueryParameter]]]:
+    normalized = list()
+    for request in requests:
+        if isinstance(request, int):
+            normalized.append((request, list()))
+        else:
+            query_id, parameters = request
+            normalized.append((query_id, list(parameters or list())))
+    return normalized
+
+
+def run_bulk(
+    fn: Callable[..., Any],
+    items: Iterable[Tuple[Any, List[QueryParameter]]],
+    max_workers: int = DEFAULT_MAX_WORKERS,
+) -> Iterator[BulkResult]:
+    # Runs fn(key, parameters) for each item on a thread pool, yielding results as
+    #   they complete. Errors are captured per item so one failure can't abort the batch
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(fn, key, parameters): (key, parameters)
+            for key, parameters in items
+        }
+        try:
+            for future in as_completed(futures):
+                key, parameters = futures[future]
+                try:
+                    yield BulkResult(key, parameters, value=future.result())
+                except Exception as error:
+                    yield BulkResult(key, parameters, error=error)
+        finally:
+            # Don't start queued work if the caller stops iterating early
+            for future in futures:
+                future.cancel()
+
+
+async def arun_bulk(
+    fn: Callable[..., Awaitable[Any]],
+    items: Iterable[Tuple[Any, List[QueryParameter]]],
+    max_concurrency: int = DEFAULT_MAX_WORKERS,
+) -> AsyncIterator[BulkResult]:
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run(key, parameters) -> BulkResult:
+        async with semaphore:
+            try:
+                return BulkResult(key, parameters, value=await fn(key, parameters))
+            except Exception as error:
+                return BulkResult(key, parameters, error=error)
+
+    tasks = [asyncio.ensure_future(run(key, parameters)) for key, parameters in items]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
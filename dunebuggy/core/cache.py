@@ -0,0 +1,226 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Iterator, List, Optional
+
+import pandas as pd
+
+from dunebuggy.core.decoding import decode_column
+from dunebuggy.core.gqlquerier import serialize_parameters
+from dunebuggy.models.query import Query, QueryMetadata, QueryParameter, QueryResultData
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "dunebuggy")
+DEFAULT_TTL = 15 * 60  # seconds
+DEFAULT_MAX_BYTES = 1024**3
+# Bumped whenever the payload layout changes, older entries are then refetched
+PAYLOAD_VERSION = 1
+
+
+def cache_key(query_id: int, parameters: Optional[List[QueryParameter]]) -> str:
+    # Parameter order and unset fields shouldn't change the key
+    canonical = sorted(
+        (param["key"], param.get("type"), param["value"])
+        for param in serialize_parameters(parameters)
+    )
+    blob = json.dumps([query_id, canonical], separators=(",", ":"))
+    return hashlib.sha256(blob.encode()).hexdigest()
+
+
+def json_value(value: Any) -> Any:
+    # Values of decoded column arrays as Dune sent them: numpy scalars as python ones,
+    #   timestamps as ISO strings and missing values as null
+    if isinstance(value, (str, bool, int, list, dict)) or value is None:
+        return value
+    if pd.isna(value):
+        return None
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if hasattr(value, "item"):
+        return value.item()
+    return value
+
+
+def encode_query(query: Query) -> bytes:
+    # Data only, so reading an entry written by another process can't run code.
+    #   Columnar results are kept as columns and decoded again when read
+    result_data = query.result_data
+    result = {
+        "execution_id": result_data.execution_id,
+        "runtime_seconds": result_data.runtime_seconds,
+        "generated_at": result_data.generated_at.isoformat(),
+        "columns": result_data.columns,
+    }
+    if result_data.arrays is not None:
+        result["arrays"] = {
+            column: [json_value(value) for value in array]
+            for column, array in result_data.arrays.items()
+        }
+    else:
+        result["data"] = result_data.data
+    payload = {
+        "version": PAYLOAD_VERSION,
+        "metadata": json.loads(query.metadata.json()),
+        "result_data": result,
+    }
+    return zlib.compress(json.dumps(payload, separators=(",", ":")).encode())
+
+
+def decode_query(payload: bytes) -> Query:
+    # Raises ValueError (or zlib.error, KeyError, TypeError) for anything unreadable
+    decoded = json.loads(zlib.decompress(payload))
+    if decoded.get("version") != PAYLOAD_VERSION:
+        raise ValueError(f"Unsupported cache payload version {decoded.get('version')}")
+    result = decoded["result_data"]
+    arrays = result.get("arrays")
+    if arrays is not None:
+        arrays = {column: decode_column(values) for column, values in arrays.items()}
+    result_data = QueryResultData.construct(
+        execution_id=result["execution_id"],
+        runtime_seconds=result["runtime_seconds"],
+        generated_at=datetime.fromisoformat(result["generated_at"]),
+        columns=result["columns"],
+        data=result.get("data"),
+        arrays=arrays,
+    )
+    metadata = QueryMetadata.parse_obj(decoded["metadata"])
+    return Query.construct(metadata=metadata, result_data=result_data)
+
+
+class CacheEntry:
+    def __init__(self, query: Query, stored_at: float, ttl: float):
+        self.query = query
+        self.stored_at = stored_at
+        self.ttl = ttl
+
+    @property
+    def fresh(self) -> bool:
+        return time.time() - self.stored_at < self.ttl
+
+    @property
+    def execution_id(self) -> str:
+        return self.query.result_data.execution_id
+
+
+class ResultCache:
+    # On-disk cache of fetched queries keyed by (query_id, parameters). Entries are
+    #   zlib-compressed JSON in a single SQLite file, which serializes writers across
+    #   processes. Entries past ttl are still kept so a fetch can revalidate them against
+    #   the latest execution id instead of downloading the result again. Least recently
+    #   used entries are evicted once the cache grows past max_bytes
+    def __init__(
+        self,
+        directory: str = DEFAULT_CACHE_DIR,
+        ttl: float = DEFAULT_TTL,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+    ):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, "results.sqlite")
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, query_id INTEGER, execution_id TEXT, "
+                "stored_at REAL, accessed_at REAL, size INTEGER, payload BLOB)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed_at)"
+            )
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # A connection per operation keeps the cache safe to share across threads
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def get(
+        self, query_id: int, parameters: Optional[List[QueryParameter]] = None
+    ) -> Optional[CacheEntry]:
+        key = cache_key(query_id, parameters)
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT stored_at, payload FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                "UPDATE results SET accessed_at = ? WHERE key = ?", (time.time(), key)
+            )
+        stored_at, payload = row
+        try:
+            query = decode_query(payload)
+        except (zlib.error, ValueError, KeyError, TypeError):
+            # Truncated, corrupt or written by an incompatible version, refetched as
+            #   if it had never been cached. Only that payload is dropped, a newer one
+            #   written meanwhile is kept
+            with self._connect() as connection:
+                connection.execute(
+                    "DELETE FROM results WHERE key = ? AND payload = ?", (key, payload)
+                )
+            return None
+        return CacheEntry(query, stored_at, self.ttl)
+
+    def put(
+        self,
+        query_id: int,
+        parameters: Optional[List[QueryParameter]],
+        query: Query,
+    ) -> None:
+        key = cache_key(query_id, parameters)
+        payload = encode_query(query)
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    query_id,
+                    query.result_data.execution_id,
+                    now,
+                    now,
+                    len(payload),
+                    payload,
+                ),
+            )
+            self._evict(connection)
+
+    def touch(self, query_id: int, parameters: Optional[List[QueryParameter]]) -> None:
+        # Marks a revalidated entry as fresh again without rewriting its payload
+        key = cache_key(query_id, parameters)
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE results SET stored_at = ?, accessed_at = ? WHERE key = ?",
+                (now, now, key),
+            )
+
+    def _evict(self, connection: sqlite3.Connection) -> None:
+        (total,) = connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM results"
+        ).fetchone()
+        if total <= self.max_bytes:
+            return
+        rows = connection.execute(
+            "SELECT key, size FROM results ORDER BY accessed_at ASC"
+        ).fetchall()
+        evicted = list()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        connection.executemany("DELETE FROM results WHERE key = ?", evicted)
+
+    def clear(self) -> None:
+        with self._connect() as connection:
+            connection.execute("DELETE FROM results")
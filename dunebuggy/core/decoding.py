@@ -0,0 +1,88 @@
+import re
+from typing import Any, Dict, List
+
+import numpy as np
+import pandas as pd
+
+from dunebuggy.models.query import QueryResultData
+
+TIMESTAMP_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}")
+# Integers beyond this can't round-trip through float64, so nullable columns holding
+#   them (e.g. wei amounts) stay as python ints
+MAX_SAFE_FLOAT_INT = 2**53
+
+
+def decode_column(values: List[Any]) -> Any:
+    # Picks the tightest array type that holds every value in the column. Anything
+    #   mixed or unrecognized falls back to an object array of the raw values
+    kinds = set(map(type, values))
+    has_null = type(None) in kinds
+    kinds.discard(type(None))
+
+    if not kinds:
+        return np.full(len(values), None, dtype=object)
+
+    if kinds == {bool} and not has_null:
+        return np.array(values, dtype=bool)
+
+    if kinds == {int}:
+        if not has_null:
+            try:
+                return np.array(values, dtype=np.int64)
+            except OverflowError:
+                return np.array(values, dtype=object)
+        if all(v is None or abs(v) < MAX_SAFE_FLOAT_INT for v in values):
+            return np.array(
+                [np.nan if v is None else v for v in values], dtype=np.float64
+            )
+        return np.array(values, dtype=object)
+
+    if kinds <= {int, float}:
+        if any(type(v) == int and abs(v) >= MAX_SAFE_FLOAT_INT for v in values):
+            return np.array(values, dtype=object)
+        return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+
+    if kinds == {str}:
+        sample = next(v for v in values if v is not None)
+        if TIMESTAMP_PATTERN.match(sample):
+            try:
+                return pd.to_datetime(values, utc=True).array
+            except (ValueError, TypeError, OverflowError):
+                pass
+        # Hex addresses/hashes ("\x..") and other text stay as strings
+        return np.array(values, dtype=object)
+
+    return np.array(values, dtype=object)
+
+
+def decode_columns(columns: List[str], rows: List[dict]) -> Dict[str, Any]:
+    arrays = dict()
+    for column in columns:
+        arrays[column] = decode_column([row.get(column) for row in rows])
+    return arrays
+
+
+def decode_result_data(succeeded_data: dict) -> QueryResultData:
+    # Fast path for large results: rows are decoded straight into per-column arrays
+    #   and pydantic validation of every row is skipped. The row list is popped off the
+    #   response so it can be freed as soon as the arrays are built
+    rows = succeeded_data.pop("data") or list()
+    columns = succeeded_data.get("columns") or list()
+    arrays = decode_columns(columns, rows)
+    del rows
+
+    generated_at = succeeded_data.get("generated_at")
+    if isinstance(generated_at, str):
+        generated_at = pd.Timestamp(generated_at).to_pydatetime()
+    return QueryResultData.construct(
+        execution_id=succeeded_data.get("execution_id"),
+        runtime_seconds=succeeded_data.get("runtime_seconds"),
+        generated_at=generated_at,
+        columns=columns,
+        data=None,
+        arrays=arrays,
+    )
+
+
+def arrays_to_df(columns: List[str], arrays: Dict[str, Any]) -> pd.DataFrame:
+    return pd.DataFrame(arrays, columns=columns, copy=False)
@@ -1,15 +1,60 @@
-from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from threading import Event, Lock
+from typing import Iterable, Iterator, List, Optional, Tuple
 
-from httpx import Client
+from httpx import BaseTransport, Client, Limits, Response
 
+from dunebuggy.core.bulk import (
+    DEFAULT_MAX_WORKERS,
+    BulkResult,
+    QueryRequest,
+    normalize_requests,
+    run_bulk,
+)
+from dunebuggy.core.cache import ResultCache
 from dunebuggy.core.dunequery import DuneQuery
 from dunebuggy.core.exceptions import DuneError
 from dunebuggy.core.gqlquerier import GraphQLQuerier
+from dunebuggy.core.incremental import RefreshDelta, narrow_parameters
+from dunebuggy.core.instrumentation import Instrumentation
+from dunebuggy.core.memo import MemoPolicy
+from dunebuggy.core.operations import Operations
+from dunebuggy.core.polling import PollPolicy, check_cancelled
+from dunebuggy.core.provision import (
+    ON_CONFLICT,
+    CreatedQuery,
+    QueryHandle,
+    QuerySpec,
+)
+from dunebuggy.core.ratelimit import RateLimiter
+from dunebuggy.core.retry import RetryPolicy
+from dunebuggy.core.session import (
+    SessionStore,
+    dump_cookies,
+    load_cookies,
+    refreshing,
+    token_expiry,
+)
+from dunebuggy.core.sweep import (
+    Overrides,
+    SweepResult,
+    apply_overrides,
+    combine_results,
+    expand_overrides,
+)
+from dunebuggy.core.transport import (
+    DEFAULT_TIMEOUT,
+    TimeoutTypes,
+    build_client,
+    check_shared_client,
+    client_headers,
+    has_login,
+)
 from dunebuggy.models.constants import (
     API_AUTH_URL,
     BASE_URL,
     CSRF_URL,
-    DEFAULT_HEADERS,
     LOGIN_URL,
     SESSION_URL,
     DatasetId,
@@ -17,34 +62,119 @@ from dunebuggy.models.constants import (
 from dunebuggy.models.query import (
     CreateQueryObject,
     CreateQueryOnConflict,
+    ExecutionStatus,
     Query,
+    QueryMetadata,
     QueryParameter,
+    QueryResultData,
 )
+from dunebuggy.models.session import Session
 
 
 class Dune:
-    def __init__(self, username=None, password=None):
-        self.client = Client()
-        self.gqlquerier = GraphQLQuerier(self.client)
-        self.client.headers.update(DEFAULT_HEADERS)
+    def __init__(
+        self,
+        username=None,
+        password=None,
+        poll_policy: Optional[PollPolicy] = None,
+        cache: Optional[ResultCache] = None,
+        columnar: bool = False,
+        memo_policy: Optional[MemoPolicy] = None,
+        session_store: Optional[SessionStore] = None,
+        client: Optional[Client] = None,
+        transport: Optional[BaseTransport] = None,
+        limits: Optional[Limits] = None,
+        timeout: TimeoutTypes = DEFAULT_TIMEOUT,
+        http2: bool = False,
+        rate_limiter: Optional[RateLimiter] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        operations: Optional[Operations] = None,
+        instrumentation: Optional[Instrumentation] = None,
+    ):
+        # A shared client is used as is (and not closed by this instance), along with
+        #   its login, otherwise one is built from the transport options
+        check_shared_client(client, username)
+        self._owns_client = client is None
+        self.client = client or build_client(limits, timeout, http2, transport)
+        self.gqlquerier = GraphQLQuerier(
+            self.client,
+            columnar=columnar,
+            memo_policy=memo_policy,
+            rate_limiter=rate_limiter,
+            retry_policy=retry_policy,
+            operations=operations,
+            instrumentation=instrumentation,
+        )
+        self.client.headers.update(client_headers())
+        self.instrumentation = self.gqlquerier.instrumentation
         self.user_id = None
+        self.poll_policy = poll_policy or PollPolicy()
+        self.cache = cache
+        self.session: Optional[Session] = None
+        self.session_store = session_store
+        self._username = username
+        self._password = password
+        self._session_lock = Lock()
+        self.gqlquerier.on_unauthorized = self.refresh_session
 
-        # Load in csrf token
-        self.client.post(CSRF_URL)
-        if username is not None and password is not None:
-            self.login(username, password)
+        # A saved session needs no round trips at all, nor does a shared client that
+        #   is already logged in
+        if not self.restore_session() and not has_login(self.client):
+            # Load in csrf token
+            self.client.post(CSRF_URL)
+            if username is not None and password is not None:
+                self.login(username, password)
 
-    def login(self, username: str, password: str) -> None:
-        self.client.get(LOGIN_URL)
-        csrf_token = self.client.cookies.get("csrf")
+    def __enter__(self) -> "Dune":
+        return self
 
-        form_data = {
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self._owns_client:
+            self.client.close()
+
+    @staticmethod
+    def login_form(username: str, password: str, csrf_token: str) -> dict:
+        return {
             "action": "login",
             "username": username,
             "password": password,
             "csrf": csrf_token,
             "next": BASE_URL,
         }
+
+    @staticmethod
+    def process_session(response: Response) -> Session:
+        if response.status_code >= 400:
+            raise DuneError("Dune Login Failed: Defaulting to No User/Pass")
+
+        session = response.json()
+        token = session.get("token")
+        accessToken = session.get("accessToken")
+        sub = session.get("sub")
+
+        return Session(
+            token=token,
+            access_token=accessToken,
+            sub=sub,
+            user_id=None,
+            expires_at=token_expiry(token),
+        )
+
+    @staticmethod
+    def session_headers(session: Session) -> dict:
+        return {
+            "authorization": f"Bearer {session.token}",
+            "x-dune-access-token": session.access_token,
+        }
+
+    def login(self, username: str, password: str) -> None:
+        self.client.get(LOGIN_URL)
+        csrf_token = self.client.cookies.get("csrf")
+
+        form_data = self.login_form(username, password, csrf_token)
         self.client.post(API_AUTH_URL, data=form_data)
         # self.client.get(
         #     "https://dune.com/_next/data/0xVONbryqumDMjHjna2sA/auth/login.json"
@@ -52,32 +182,88 @@ class Dune:
 
         # Fetch AUTH token
         response = self.client.post(SESSION_URL)
-        if response.status_code >= 400:
-            raise DuneError("Dune Login Failed: Defaulting to No User/Pass")
+        session = self.process_session(response)
 
-        token = response.json().get("token")
-        accessToken = response.json().get("accessToken")
-        sub = response.json().get("sub")
+        self.client.headers.update(self.session_headers(session))
+        self.user_id = session.user_id = self.gqlquerier.get_user_id(session.sub)
+        self._username, self._password = username, password
+        self.session = session
+        self.save_session()
 
-        self.client.headers.update(
-            {"authorization": f"Bearer {token}", "x-dune-access-token": accessToken}
-        )
-        self.user_id = self.gqlquerier.get_user_id(sub)
+    def restore_session(self) -> bool:
+        if self.session_store is None or self._username is None:
+            return False
+        session = self.session_store.load(self._username)
+        if session is None:
+            return False
+        load_cookies(self.client.cookies, session)
+        self.client.headers.update(self.session_headers(session))
+        self.user_id = session.user_id
+        self.session = session
+        # An expired token is refreshed with the saved cookies, a single request,
+        #   and only logged in again from scratch if that fails
+        if not session.expired():
+            return True
+        if self.refresh_session(self.client.headers.get("authorization")):
+            return True
+        self.forget_session()
+        return False
 
-    def create_query(
-        self,
+    def forget_session(self) -> None:
+        for header in self.session_headers(self.session):
+            self.client.headers.pop(header, None)
+        self.user_id = None
+        self.session = None
+
+    def save_session(self) -> None:
+        if self.session_store is None or self.session is None:
+            return
+        self.session.cookies = dump_cookies(self.client.cookies)
+        self.session_store.save(self._username, self.session)
+
+    def refresh_session(self, stale_authorization: Optional[str]) -> bool:
+        # Called by the querier when a request is rejected with an expired token.
+        #   Returns whether the request should be retried
+        if self.session is None or refreshing.get():
+            return False
+        with self._session_lock:
+            if self.client.headers.get("authorization") != stale_authorization:
+                # Another thread already refreshed it
+                return True
+            token = refreshing.set(True)
+            try:
+                response = self.client.post(SESSION_URL)
+                try:
+                    session = self.process_session(response)
+                except DuneError:
+                    # The session cookie expired too, log in from scratch
+                    if self._password is None:
+                        return False
+                    self.client.post(CSRF_URL)
+                    self.login(self._username, self._password)
+                    return True
+                session.user_id = self.user_id
+                self.client.headers.update(self.session_headers(session))
+                self.session = session
+                self.save_session()
+                return True
+            finally:
+                refreshing.reset(token)
+
+    @staticmethod
+    def build_create_query(
+        user_id: Optional[int],
         query_name: str,
         sql: str,
         dataset_id: DatasetId,
-        parameters: Optional[List[QueryParameter]] = list(),
-        is_temp=False,
-    ) -> DuneQuery:
+        is_temp: bool,
+    ) -> Tuple[CreateQueryObject, CreateQueryOnConflict]:
         # fail if not logged in
         # make this into its own empty query model class and populate it?
         # https://github.com/kayak/pypika
         # can cast from str -> sql
         # https://pypika.readthedocs.io/en/latest/_modules/pypika/queries.html#AliasedQuery.get_sql
-        if self.user_id is None:
+        if user_id is None:
             raise DuneError("Must login before creating a query!")
 
         object = CreateQueryObject(
@@ -85,43 +271,320 @@ class Dune:
             is_temp=is_temp,
             name=query_name,
             query=sql,
-            user_id=self.user_id,
+            user_id=user_id,
         )
-        on_conflict = CreateQueryOnConflict()
+        return object, ON_CONFLICT
 
+    def create_query(
+        self,
+        query_name: str,
+        sql: str,
+        dataset_id: DatasetId,
+        parameters: Optional[List[QueryParameter]] = list(),
+        is_temp=False,
+        cancel: Optional[Event] = None,
+    ) -> DuneQuery:
+        spec = QuerySpec(query_name, sql, dataset_id, parameters, is_temp)
+        object, on_conflict = self.build_create_query(
+            self.user_id, query_name, sql, dataset_id, is_temp
+        )
+        created = self.create_and_execute(object, on_conflict, parameters)
+        return self.fetch_created(spec, created, cancel)
+
+        # Should return a DuneQuery Object, that can be used to grab the table, charts etc
+        # Streaming Responses??
+
+    def create_and_execute(
+        self,
+        object: CreateQueryObject,
+        on_conflict: CreateQueryOnConflict,
+        parameters: List[QueryParameter],
+    ) -> CreatedQuery:
         upsert_response = self.gqlquerier.upsert_query(
             object, on_conflict, self.user_id
         )
         query_id = upsert_response["data"]["insert_queries_one"]["id"]
-        self.gqlquerier.execute_query(parameters, query_id)
+        execution_id = self.gqlquerier.execute_query(parameters, query_id)
+        return CreatedQuery(query_id, execution_id)
 
-        return self.fetch_query(query_id, parameters)
+    def fetch_created(
+        self,
+        spec: QuerySpec,
+        created: CreatedQuery,
+        cancel: Optional[Event] = None,
+    ) -> DuneQuery:
+        parameters = list(spec.parameters or ())
+        metadata = self.gqlquerier.get_query_metadata(created.query_id, self.user_id)
+        result_data = self.gqlquerier.wait_for_execution(
+            created.execution_id,
+            parameters,
+            created.query_id,
+            self.poll_policy,
+            cancel,
+        )
+        return self.build_query(metadata, parameters, result_data, self)
 
-        # Should return a DuneQuery Object, that can be used to grab the table, charts etc
-        # Streaming Responses??
+    def created_head(self, spec: QuerySpec, created: CreatedQuery) -> ExecutionStatus:
+        return self.gqlquerier.get_execution_head(
+            created.execution_id, list(spec.parameters or ()), created.query_id
+        )
+
+    def create_queries(
+        self,
+        specs: Iterable[QuerySpec],
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        fetch: bool = True,
+    ) -> List[QueryHandle]:
+        # Creates and executes many queries, e.g. temp queries from templated SQL, and
+        #   returns a handle per spec right away. Upserts and executions run max_workers
+        #   at a time, ahead of any result downloads, so with a rate limiter provisioning
+        #   is bound by the rate limit rather than by round trips. With fetch, results
+        #   are downloaded in the background too, otherwise by the handle's first wait()
+        specs = list(specs)
+        # Every object is validated before the first request goes out
+        creates = [
+            self.build_create_query(
+                self.user_id, spec.name, spec.sql, spec.dataset_id, spec.is_temp
+            )
+            for spec in specs
+        ]
+        handles = [
+            QueryHandle(spec, self.fetch_created, self.created_head) for spec in specs
+        ]
+        if not handles:
+            return handles
+
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        lock = Lock()
+        remaining = [len(handles)]
+
+        def create(handle: QueryHandle, object, on_conflict) -> None:
+            try:
+                handle.create(
+                    partial(
+                        self.create_and_execute, object, on_conflict, handle.parameters
+                    )
+                )
+                if fetch:
+                    executor.submit(handle.fetch)
+            finally:
+                with lock:
+                    remaining[0] -= 1
+                    last = remaining[0] == 0
+                # The pool's threads exit once the queued downloads are done
+                if last:
+                    executor.shutdown(wait=False)
+
+        for handle, (object, on_conflict) in zip(handles, creates):
+            executor.submit(create, handle, object, on_conflict)
+        return handles
+
+    def wait_queries(
+        self,
+        handles: List[QueryHandle],
+        max_workers: int = DEFAULT_MAX_WORKERS,
+    ) -> Iterator[BulkResult]:
+        # Waits on many handles at once, yielding results as they arrive. Keys are
+        #   positions in handles
+        items = [(index, handle.parameters) for index, handle in enumerate(handles)]
+        return run_bulk(lambda index, _: handles[index].wait(), items, max_workers)
+
+    @staticmethod
+    def build_query(
+        metadata: QueryMetadata,
+        parameters: List[QueryParameter],
+        result_data: Optional[QueryResultData],
+        dune=None,
+        **kwargs,
+    ) -> DuneQuery:
+        # For custom param queries, override default parameters returned by metadata.
+        #   kwargs are passed on to DuneQuery
+        if len(parameters):
+            metadata.parameters = parameters
+        query = Query(metadata=metadata, result_data=result_data)
+        columnar = dune is not None and dune.gqlquerier.columnar
+        return DuneQuery(query, columnar=columnar, dune=dune, **kwargs)
 
     def fetch_query(
-        self, query_id: int, parameters: Optional[List[QueryParameter]] = list()
+        self,
+        query_id: int,
+        parameters: Optional[List[QueryParameter]] = list(),
+        lazy: bool = False,
+        cancel: Optional[Event] = None,
     ) -> DuneQuery:
+        # Lazy queries download their result the first time it's used, columns and
+        #   info are answered without downloading the rows. Setting cancel stops
+        #   polling a pending execution with DuneCancelledError
+        requested_parameters = parameters
+        cached = None
+        if self.cache is not None:
+            cached = self.cache.get(query_id, requested_parameters)
+            if cached is not None and cached.fresh:
+                self.instrumentation.count("cache.hit")
+                return DuneQuery(cached.query, dune=self)
+
         metadata = self.gqlquerier.get_query_metadata(query_id, self.user_id)
-        if not parameters and len(metadata.parameters):
+        if not parameters:
             parameters = metadata.parameters
-        else:
-            parameters = list()
         result_id, job_id = self.gqlquerier.get_result_id(query_id, parameters)
 
-        # For custom param queries, override default parameters returned by metadata
+        # A stale entry is still good if Dune hasn't produced a newer result since
+        if cached is not None and result_id == cached.execution_id:
+            self.instrumentation.count("cache.revalidated")
+            self.cache.touch(query_id, requested_parameters)
+            return self.build_query(
+                metadata,
+                parameters,
+                cached.query.result_data,
+                self,
+                result_id=result_id,
+                job_id=job_id,
+            )
+
+        if self.cache is not None:
+            self.instrumentation.count("cache.miss")
+
+        def load() -> QueryResultData:
+            # Without a finished result yet, poll the pending job until it completes
+            result_data = self.gqlquerier.wait_for_execution(
+                execution_id=result_id or job_id,
+                parameters=parameters,
+                query_id=query_id,
+                policy=self.poll_policy,
+                cancel=cancel,
+            )
+            if self.cache is not None:
+                query = Query.construct(metadata=metadata, result_data=result_data)
+                self.cache.put(query_id, requested_parameters, query)
+            return result_data
+
+        head = partial(
+            self.gqlquerier.wait_for_execution_head,
+            result_id or job_id,
+            parameters,
+            query_id,
+            policy=self.poll_policy,
+            cancel=cancel,
+        )
+        dune_query = self.build_query(
+            metadata,
+            parameters,
+            None,
+            self,
+            loader=load,
+            head=head,
+            result_id=result_id,
+            job_id=job_id,
+        )
+        return dune_query if lazy else dune_query.load()
+
+    def stream_query(
+        self, query_id: int, parameters: Optional[List[QueryParameter]] = list()
+    ) -> DuneQuery:
+        # Resolves the query without downloading its result. Rows are streamed from
+        #   the returned DuneQuery with iter_dfs
+        metadata = self.gqlquerier.get_query_metadata(query_id, self.user_id)
+        if not parameters:
+            parameters = metadata.parameters
+        result_id, job_id = self.gqlquerier.get_result_id(query_id, parameters)
         if len(parameters):
             metadata.parameters = parameters
 
-        # # TODO raise if both None
-        # if result_id is None:
-        #     result_data = self.gqlquerier.get_result_data_by_job(job_id)
-        # else:
-        #     result_data = self.gqlquerier.get_result_data_by_result(result_id)
+        stream = partial(
+            self.gqlquerier.stream_execution,
+            result_id or job_id,
+            parameters,
+            query_id,
+            policy=self.poll_policy,
+        )
+        head = partial(
+            self.gqlquerier.wait_for_execution_head,
+            result_id or job_id,
+            parameters,
+            query_id,
+            policy=self.poll_policy,
+        )
+        query = Query(metadata=metadata, result_data=None)
+        return DuneQuery(
+            query,
+            stream=stream,
+            columnar=self.gqlquerier.columnar,
+            dune=self,
+            head=head,
+            result_id=result_id,
+            job_id=job_id,
+        )
 
-        result_data = self.gqlquerier.get_execution(
-            execution_id=result_id, parameters=parameters, query_id=query_id
+    def refresh_query(
+        self,
+        query: DuneQuery,
+        key: str,
+        since_parameter: Optional[str] = None,
+        time_column: Optional[str] = None,
+    ) -> RefreshDelta:
+        # Queries with a start date parameter (the first DATETIME one, or since_parameter)
+        #   are re-executed from the latest time held (in time_column, or in key if it
+        #   holds timestamps), so only the tail is downloaded. Others are only
+        #   re-downloaded if Dune has a newer result than the one held
+        parameters = query.parameters
+        narrowed = narrow_parameters(
+            parameters, query.df, key, since_parameter, time_column
         )
-        query = Query(metadata=metadata, result_data=result_data)
-        return DuneQuery(query)
+        if narrowed is not None:
+            execution_id = self.gqlquerier.execute_query(narrowed, query.query_id)
+            parameters = narrowed
+        else:
+            result_id, job_id = self.gqlquerier.get_result_id(
+                query.query_id, parameters
+            )
+            if result_id is not None and result_id == query.result_data.execution_id:
+                return query.merge(query.result_data, key)
+            execution_id = result_id or job_id
+
+        result_data = self.gqlquerier.wait_for_execution(
+            execution_id, parameters, query.query_id, self.poll_policy
+        )
+        return query.merge(result_data, key)
+
+    def fetch_queries(
+        self,
+        requests: Iterable[QueryRequest],
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        cancel: Optional[Event] = None,
+    ) -> Iterator[BulkResult]:
+        # requests are query ids or (query_id, parameters) pairs. Results are yielded
+        #   as they complete, each BulkResult holding either the DuneQuery or the error.
+        #   Once cancel is set, pending and unstarted fetches fail with
+        #   DuneCancelledError
+        def fetch(query_id: int, parameters: List[QueryParameter]) -> DuneQuery:
+            check_cancelled(cancel)
+            return self.fetch_query(query_id, parameters, cancel=cancel)
+
+        return run_bulk(fetch, normalize_requests(requests), max_workers)
+
+    def sweep_query(
+        self,
+        query_id: int,
+        overrides: Overrides,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        cancel: Optional[Event] = None,
+    ) -> SweepResult:
+        # Runs one parameterized query once per override. Metadata is fetched once and
+        #   every run is an ExecuteQuery plus its GetExecution polls, at most max_workers
+        #   at a time. Runs still pending when cancel is set end up in failures
+        metadata = self.gqlquerier.get_query_metadata(query_id, self.user_id)
+        overrides = expand_overrides(overrides)
+        items = [
+            (index, apply_overrides(metadata.parameters, override))
+            for index, override in enumerate(overrides)
+        ]
+
+        def run(index: int, parameters: List[QueryParameter]) -> QueryResultData:
+            check_cancelled(cancel)
+            execution_id = self.gqlquerier.execute_query(parameters, query_id)
+            return self.gqlquerier.wait_for_execution(
+                execution_id, parameters, query_id, self.poll_policy, cancel
+            )
+
+        results = list(run_bulk(run, items, max_workers))
+        return combine_results(overrides, results, self.gqlquerier.columnar)
@@ -1,30 +1,140 @@
-from typing import Dict, List
+import inspect
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional
 
 import pandas as pd
 
+from dunebuggy.core.decoding import arrays_to_df, decode_columns
+from dunebuggy.core.exceptions import DuneError
+from dunebuggy.core.export import (
+    import_pyarrow,
+    to_arrow_table,
+    unify_tables,
+    write_arrow,
+    write_csv,
+)
+from dunebuggy.core.incremental import RefreshDelta, merge_frames, refreshed_result_data
+from dunebuggy.core.instrumentation import (
+    NO_INSTRUMENTATION,
+    Instrumentation,
+    result_rows,
+)
+from dunebuggy.core.streaming import DEFAULT_BATCH_SIZE, RowBatch
 from dunebuggy.models.query import Query, QueryMetadata, QueryParameter, QueryResultData
 
 
 class DuneQuery:
-    def __init__(self, query: Query):
+    def __init__(
+        self,
+        query: Query,
+        stream: Optional[Callable[[int], Iterator[RowBatch]]] = None,
+        columnar: bool = False,
+        dune=None,
+        loader: Optional[Callable[[], Any]] = None,
+        head: Optional[Callable[[], Any]] = None,
+        result_id: Optional[str] = None,
+        job_id: Optional[str] = None,
+    ):
         self.metadata: QueryMetadata = query.metadata
-        self.result_data: QueryResultData = query.result_data
+        self._result_data: Optional[QueryResultData] = query.result_data
+        # Streamed queries are created without result data, stream(batch_size) yields
+        #   its rows instead. May also be an async generator function
+        self._stream = stream
+        # Lazy queries are created without result data too, loader() downloads it the
+        #   first time it's needed and head() gets everything but the rows. Either may
+        #   be async, then they have to be awaited through aload()/aload_head() first
+        self._loader = loader
+        self._head = head
+        self._head_data: Optional[QueryResultData] = None
+        self._result_id = result_id
+        self._job_id = job_id
+        self._columnar = columnar
+        # The Dune/AsyncDune this query was fetched with, used by refresh
+        self._dune = dune
         self._df = None
 
     def __repr__(self) -> str:
+        if self._stream is not None:
+            return f"<DuneQuery query_id={self.query_id} name={self.name} streamed>"
+        if not self.loaded:
+            return f"<DuneQuery query_id={self.query_id} name={self.name} lazy>"
         return f"<DuneQuery query_id={self.query_id} name={self.name} length={self.length} rows>"
 
+    @property
+    def loaded(self) -> bool:
+        return self._result_data is not None
+
+    @property
+    def result_data(self) -> QueryResultData:
+        if self._result_data is None:
+            if self._loader is None:
+                raise DuneError(
+                    "Results of a streamed query aren't downloaded, iterate them with iter_dfs"
+                )
+            self.load()
+        return self._result_data
+
+    @staticmethod
+    def _require_sync(fn: Callable, method: str) -> None:
+        if inspect.iscoroutinefunction(fn):
+            raise DuneError(f"Await query.{method}() before using the lazy result")
+
+    def load(self) -> "DuneQuery":
+        # Downloads a lazy query's result now instead of on first use
+        if self._result_data is None and self._loader is not None:
+            self._require_sync(self._loader, "aload")
+            self._result_data = self._loader()
+        return self
+
+    async def aload(self) -> "DuneQuery":
+        if self._result_data is None and self._loader is not None:
+            result_data = self._loader()
+            if inspect.isawaitable(result_data):
+                result_data = await result_data
+            self._result_data = result_data
+        return self
+
+    def load_head(self) -> "DuneQuery":
+        # Fetches the result's columns and timings without its rows
+        if self._head_data is None and self._head is not None:
+            self._require_sync(self._head, "aload_head")
+            self._head_data = self._head()
+        return self
+
+    async def aload_head(self) -> "DuneQuery":
+        if self._head_data is None and self._head is not None:
+            head_data = self._head()
+            if inspect.isawaitable(head_data):
+                head_data = await head_data
+            self._head_data = head_data
+        return self
+
+    @property
+    def head(self) -> QueryResultData:
+        # The downloaded result if there is one, otherwise the result fetched without
+        #   rows, so metadata-like accessors don't download the rows
+        if self._result_data is not None or self._head is None:
+            return self.result_data
+        return self.load_head()._head_data
+
+    @property
+    def query(self) -> Query:
+        return Query.construct(metadata=self.metadata, result_data=self.result_data)
+
     @property
     def query_id(self) -> int:
         return self.metadata.id
 
     @property
-    def result_id(self):
-        return self.result_data.id
+    def result_id(self) -> Optional[str]:
+        # Id of the latest finished result when the query was fetched, None if it
+        #   had to be executed
+        if self._result_id is None and self._result_data is not None:
+            return self._result_data.execution_id
+        return self._result_id
 
     @property
-    def job_id(self):
-        return self.result_data.job_id
+    def job_id(self) -> Optional[str]:
+        return self._job_id
 
     @property
     def name(self) -> str:
@@ -32,7 +142,8 @@ class DuneQuery:
 
     @property
     def length(self) -> int:
-        return len(self.result_data.data)
+        # Counted from the downloaded rows or column arrays, without building the df
+        return result_rows(self.result_data)
 
     @property
     def author(self) -> str:
@@ -40,10 +151,13 @@ class DuneQuery:
 
     @property
     def columns(self) -> List[str]:
-        return self.result_data.columns
+        return self.head.columns
 
     @property
     def raw(self) -> List[dict]:
+        # Columnar results only keep the arrays, rows are rebuilt on demand
+        if self.result_data.arrays is not None:
+            return self.df.to_dict("records")
         return self.result_data.data
 
     @property
@@ -58,15 +172,30 @@ class DuneQuery:
     def df(self) -> pd.DataFrame:
         # ad-hoc caching
         if self._df is None:
-            self._df = self._process_to_df(self.raw)
+            result_data = self.result_data
+            with self._instrumentation.span(
+                "dataframe.build", columnar=result_data.arrays is not None
+            ) as span:
+                if result_data.arrays is not None:
+                    self._df = arrays_to_df(self.columns, result_data.arrays)
+                else:
+                    self._df = self._process_to_df(self.raw)
+                span.set(rows=len(self._df), columns=len(self._df.columns))
         return self._df
 
+    @property
+    def _instrumentation(self) -> Instrumentation:
+        if self._dune is None:
+            return NO_INSTRUMENTATION
+        return self._dune.instrumentation
+
     @property
     def info(self) -> Dict:
         return {
             "name": self.name,
             "author": self.author,
-            "length": self.length,
+            # Not known until the rows are downloaded
+            "length": self.length if self.loaded else None,
             "query_id": self.query_id,
             "result_id": self.result_id,
             "job_id": self.job_id,
@@ -77,5 +206,154 @@ class DuneQuery:
         # processed = [r.data for r in results]
         return pd.DataFrame(results)
 
-    def to_csv(self, filename: str) -> None:
-        return self.df.to_csv(filename)
+    def refresh(
+        self,
+        key: str,
+        since_parameter: Optional[str] = None,
+        time_column: Optional[str] = None,
+    ) -> RefreshDelta:
+        # Fetches rows newer than the ones held and merges them in on the key column.
+        #   Returns an awaitable if the query was fetched with AsyncDune
+        if self._dune is None:
+            raise DuneError("Only queries fetched through Dune/AsyncDune can refresh")
+        return self._dune.refresh_query(self, key, since_parameter, time_column)
+
+    def merge(self, result_data: QueryResultData, key: str) -> RefreshDelta:
+        # Merges a newer result of this query into the held rows, matching rows on key
+        unchanged = (
+            result_data.execution_id == self.result_data.execution_id
+            and result_data.generated_at == self.result_data.generated_at
+        )
+        if unchanged:
+            return RefreshDelta(
+                self.df.iloc[0:0], self.df.iloc[0:0], result_data.generated_at
+            )
+
+        new_query = Query.construct(metadata=self.metadata, result_data=result_data)
+        new_df = DuneQuery(new_query, columnar=self._columnar).df
+        merged, added, changed = merge_frames(self.df, new_df, key)
+        self._result_data = refreshed_result_data(result_data, self.columns, merged)
+        self._df = merged
+        return RefreshDelta(added, changed, result_data.generated_at)
+
+    def _batch_to_df(self, batch: RowBatch) -> pd.DataFrame:
+        if self._columnar:
+            return arrays_to_df(
+                batch.columns, decode_columns(batch.columns, batch.rows)
+            )
+        return pd.DataFrame(batch.rows, columns=batch.columns)
+
+    def iter_dfs(self, batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[pd.DataFrame]:
+        # DataFrame chunks of at most batch_size rows. Streamed queries download them
+        #   as they are iterated, so memory stays bounded by the batch size. Downloaded
+        #   results are chunked without building the whole DataFrame first. An empty
+        #   result still yields one (empty) chunk with its columns
+        if self._stream is None:
+            result_data = self.result_data
+            for start in range(0, max(result_rows(result_data), 1), batch_size):
+                end = start + batch_size
+                if self._df is not None:
+                    yield self._df.iloc[start:end]
+                elif result_data.arrays is not None:
+                    arrays = {
+                        column: array[start:end]
+                        for column, array in result_data.arrays.items()
+                    }
+                    yield arrays_to_df(self.columns, arrays)
+                else:
+                    rows = result_data.data[start:end]
+                    yield self._batch_to_df(RowBatch(self.columns, rows))
+            return
+        for batch in self._stream(batch_size):
+            yield self._batch_to_df(batch)
+
+    async def aiter_dfs(
+        self, batch_size: int = DEFAULT_BATCH_SIZE
+    ) -> AsyncIterator[pd.DataFrame]:
+        if self._stream is None:
+            await self.aload()
+            for df in self.iter_dfs(batch_size):
+                yield df
+            return
+        async for batch in self._stream(batch_size):
+            yield self._batch_to_df(batch)
+
+    def _iter_typed_dfs(self, batch_size: int) -> Iterator[pd.DataFrame]:
+        # Like iter_dfs, but rows are always decoded into typed columns (see
+        #   decoding.decode_column) and ordered as in QueryResultData.columns
+        if self._stream is not None:
+            for batch in self._stream(batch_size):
+                yield arrays_to_df(
+                    batch.columns, decode_columns(batch.columns, batch.rows)
+                )
+            return
+        if self.result_data.arrays is not None:
+            yield from self.iter_dfs(batch_size)
+            return
+        rows = self.raw
+        for start in range(0, max(len(rows), 1), batch_size):
+            batch = rows[start : start + batch_size]
+            yield arrays_to_df(self.columns, decode_columns(self.columns, batch))
+
+    def _export_metadata(self) -> Dict[str, str]:
+        metadata = {"query_id": str(self.query_id), "name": self.name}
+        if self.loaded:
+            metadata["execution_id"] = str(self.result_data.execution_id)
+            metadata["generated_at"] = str(self.result_data.generated_at)
+        return metadata
+
+    def to_csv(
+        self,
+        filename: str,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        compression: Optional[str] = None,
+        index: bool = True,
+    ) -> None:
+        # compression is one of None, "gzip", "bz2" or "xz"
+        write_csv(self.iter_dfs(batch_size), filename, compression, index)
+
+    def to_parquet(
+        self,
+        filename: str,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        compression: Optional[str] = "snappy",
+    ) -> None:
+        # Each batch becomes one row group. Column types come from the first batch; if a
+        #   later batch needs wider ones (see export.write_arrow), everything written so
+        #   far is read back into memory and rewritten, so a late widening on a big
+        #   result costs a full re-read and rewrite of the file
+        write_arrow(
+            self._iter_typed_dfs(batch_size),
+            filename,
+            "parquet",
+            compression,
+            self._export_metadata(),
+        )
+
+    def to_feather(
+        self,
+        filename: str,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        compression: Optional[str] = "lz4",
+    ) -> None:
+        # Arrow IPC file, can be memory-mapped with pyarrow.ipc.open_file/pyarrow.memory_map.
+        #   compression is one of None, "lz4" or "zstd" (uncompressed maps without copying)
+        # Like to_parquet, the file is read back and rewritten if a later batch widens
+        #   the column types
+        write_arrow(
+            self._iter_typed_dfs(batch_size),
+            filename,
+            "feather",
+            compression,
+            self._export_metadata(),
+        )
+
+    def to_arrow(self, batch_size: int = DEFAULT_BATCH_SIZE):
+        pyarrow = import_pyarrow()
+        tables = [
+            to_arrow_table(pyarrow, df) for df in self._iter_typed_dfs(batch_size)
+        ]
+        if not tables:
+            raise DuneError("No data to convert to an Arrow table")
+        table = pyarrow.concat_tables(unify_tables(pyarrow, tables))
+        return table.replace_schema_metadata(self._export_metadata())
@@ -1,2 +1,46 @@
 class DuneError(Exception):
     pass
+
+
+class DuneExecutionError(DuneError):
+    def __init__(self, failure):
+        self.failure = failure
+        super().__init__(
+            f"Dune execution {failure.execution_id} failed with type: {failure.type} "
+            f"and message: {failure.message}"
+        )
+
+
+class DuneTimeoutError(DuneError):
+    def __init__(self, status):
+        # Last status seen before the deadline, queued or running
+        self.status = status
+        super().__init__(
+            f"Dune execution {status.execution_id} did not finish before the deadline"
+        )
+
+
+class DuneCancelledError(DuneError):
+    pass
+
+
+class DuneHTTPError(DuneError):
+    def __init__(self, response):
+        self.response = response
+        self.status_code = response.status_code
+        super().__init__(
+            f"Dune request to {response.request.url} failed with status: "
+            f"{response.status_code}"
+        )
+
+
+class DuneGraphQLError(DuneError):
+    def __init__(self, errors: list):
+        # Every error the server returned, as sent
+        self.errors = errors
+        messages = "; ".join(
+            f"code: {error.get('extensions', dict()).get('code', error.get('code'))} "
+            f"and message: {error.get('message')}"
+            for error in errors
+        )
+        super().__init__(f"Dune query failed with {len(errors)} error(s): {messages}")
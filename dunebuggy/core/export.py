@@ -0,0 +1,185 @@
+import bz2
+import gzip
+import lzma
+from decimal import Decimal
+from typing import IO, Dict, Iterable, List, Optional
+
+import pandas as pd
+
+from dunebuggy.core.exceptions import DuneError
+
+CSV_OPENERS = {"gzip": gzip.open, "bz2": bz2.open, "xz": lzma.open}
+INT64_MIN, INT64_MAX = -(2**63), 2**63 - 1
+# Integers wider than int64 (e.g. uint256 wei amounts) are stored as decimal256 while
+#   they fit its precision, and as strings beyond that
+MAX_DECIMAL_DIGITS = 76
+
+
+def import_pyarrow():
+    # pyarrow is an optional dependency, only needed for Parquet/Arrow exports
+    try:
+        import pyarrow
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        raise DuneError(
+            "Parquet/Arrow export requires pyarrow, install it with `pip install dunebuggy[arrow]`"
+        )
+    return pyarrow
+
+
+def open_csv(filename: str, compression: Optional[str]) -> IO:
+    if compression is None:
+        return open(filename, "w", newline="")
+    if compression not in CSV_OPENERS:
+        raise DuneError(
+            f"Unsupported CSV compression {compression}, use one of {list(CSV_OPENERS)}"
+        )
+    return CSV_OPENERS[compression](filename, "wt", newline="")
+
+
+def write_csv(
+    dfs: Iterable[pd.DataFrame],
+    filename: str,
+    compression: Optional[str] = None,
+    index: bool = True,
+) -> None:
+    # Chunks are appended to one open file, only the first one writes the header
+    offset = 0
+    with open_csv(filename, compression) as handle:
+        for df in dfs:
+            if index:
+                df = df.set_axis(pd.RangeIndex(offset, offset + len(df)), axis=0)
+            df.to_csv(handle, header=offset == 0, index=index)
+            offset += len(df)
+
+
+def object_to_arrow(pyarrow, series: pd.Series):
+    # Object columns hold whatever decode_column couldn't type: integers too wide for
+    #   int64, and mixed values, which are kept as their string representation
+    missing = series.isna().to_numpy()
+    values = [None if null else value for value, null in zip(series, missing)]
+    present = [value for value in values if value is not None]
+    if present and all(type(value) is int for value in present):
+        if all(INT64_MIN <= value <= INT64_MAX for value in present):
+            return pyarrow.array(values, type=pyarrow.int64())
+        if all(abs(value) < 10**MAX_DECIMAL_DIGITS for value in present):
+            return pyarrow.array(
+                [None if value is None else Decimal(value) for value in values],
+                type=pyarrow.decimal256(MAX_DECIMAL_DIGITS, 0),
+            )
+    else:
+        try:
+            return pyarrow.array(values, from_pandas=True)
+        except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError, OverflowError):
+            pass
+    return pyarrow.array(
+        [None if value is None else str(value) for value in values],
+        type=pyarrow.string(),
+    )
+
+
+def to_arrow_table(pyarrow, df: pd.DataFrame):
+    # Every chunk is typed on its own, widen_schema reconciles the chunks of a result
+    arrays = [
+        (
+            object_to_arrow(pyarrow, series)
+            if series.dtype == object
+            else pyarrow.Array.from_pandas(series)
+        )
+        for _, series in df.items()
+    ]
+    return pyarrow.Table.from_arrays(arrays, names=[str(name) for name in df.columns])
+
+
+def widen_type(pyarrow, left, right):
+    # The narrowest type both can be cast to without failing
+    types = pyarrow.types
+    if left.equals(right) or types.is_null(right):
+        return left
+    if types.is_null(left):
+        return right
+    for narrow, wide in ((left, right), (right, left)):
+        if types.is_integer(narrow) and (
+            types.is_floating(wide) or types.is_decimal(wide)
+        ):
+            return wide
+    return pyarrow.string()
+
+
+def widen_schema(pyarrow, schema, other):
+    if schema.names != other.names:
+        raise DuneError(
+            f"Result chunks have different columns: {schema.names} and {other.names}"
+        )
+    fields = [
+        field.with_type(widen_type(pyarrow, field.type, other.field(index).type))
+        for index, field in enumerate(schema)
+    ]
+    return pyarrow.schema(fields, metadata=schema.metadata)
+
+
+def unify_tables(pyarrow, tables: List) -> List:
+    # Casts every table to a schema wide enough for all of them
+    schema = tables[0].schema
+    for table in tables[1:]:
+        schema = widen_schema(pyarrow, schema, table.schema)
+    return [table.cast(schema, safe=False) for table in tables]
+
+
+def read_arrow(pyarrow, filename: str, format: str):
+    # Reads a whole file into memory (not memory-mapped, it is about to be rewritten)
+    if format == "parquet":
+        return pyarrow.parquet.read_table(filename, memory_map=False)
+    with pyarrow.OSFile(str(filename)) as source:
+        return pyarrow.ipc.open_file(source).read_all()
+
+
+def write_arrow(
+    dfs: Iterable[pd.DataFrame],
+    filename: str,
+    format: str,
+    compression: Optional[str],
+    metadata: Optional[Dict[str, str]] = None,
+) -> None:
+    # The schema is taken from the first chunk. A later chunk that needs wider types
+    #   (ints that turn out to be floats, columns that were all null, timestamps
+    #   followed by free text) widens it, and what was written so far is read back
+    #   into memory in full and rewritten with the wider types. Typically that happens
+    #   early, if at all. The schema can't be settled up front since chunks may come
+    #   straight off a streamed download, which can only be read once
+    pyarrow = import_pyarrow()
+    writer = None
+    schema = None
+    try:
+        for df in dfs:
+            table = to_arrow_table(pyarrow, df)
+            if writer is None:
+                schema = table.schema.with_metadata(metadata or dict())
+                writer = open_arrow_writer(
+                    pyarrow, filename, format, schema, compression
+                )
+            else:
+                widened = widen_schema(pyarrow, schema, table.schema)
+                if not widened.equals(schema):
+                    writer.close()
+                    written = read_arrow(pyarrow, filename, format)
+                    schema = widened
+                    writer = open_arrow_writer(
+                        pyarrow, filename, format, schema, compression
+                    )
+                    writer.write_table(written.cast(schema, safe=False))
+            writer.write_table(table.cast(schema, safe=False))
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        raise DuneError(f"No data to write to {filename}")
+
+
+def open_arrow_writer(pyarrow, filename: str, format: str, schema, compression):
+    if format == "parquet":
+        return pyarrow.parquet.ParquetWriter(
+            filename, schema, compression=compression or "none"
+        )
+    options = pyarrow.ipc.IpcWriteOptions(compression=compression)
+    return pyarrow.ipc.new_file(filename, schema, options=options)
@@ -1,74 +1,387 @@
-from typing import Dict, List, Optional
+import time
+from threading import Event
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 from uuid import UUID
 
-from httpx import Client
+from httpx import Client, Response, TransportError
 
-from dunebuggy.core.exceptions import DuneError
-from dunebuggy.models.constants import APP_API_URL, GRAPH_QL_URL
+from dunebuggy.core.decoding import decode_result_data
+from dunebuggy.core.exceptions import DuneError, DuneGraphQLError, DuneHTTPError
+from dunebuggy.core.instrumentation import (
+    Instrumentation,
+    received_bytes,
+    result_rows,
+)
+from dunebuggy.core.memo import MISSING, MemoPolicy, SingleFlight, TTLCache, request_key
+from dunebuggy.core.operations import JSON_HEADERS, Operations
+from dunebuggy.core.polling import PollPolicy, bounded_delay, check_status, wait_for
+from dunebuggy.core.ratelimit import RateLimiter
+from dunebuggy.core.retry import RetryPolicy
+from dunebuggy.core.streaming import DEFAULT_BATCH_SIZE, ExecutionStreamParser, RowBatch
+from dunebuggy.models.constants import APP_API_URL, GRAPH_QL_URL, ExecutionState
 from dunebuggy.models.gqlqueries import QueryName
 from dunebuggy.models.query import (
     CreateQueryObject,
     CreateQueryOnConflict,
+    ExecutionFailed,
+    ExecutionQueued,
+    ExecutionRunning,
+    ExecutionStatus,
     QueryMetadata,
     QueryParameter,
     QueryResultData,
 )
 
+# Error bodies are small, anything larger is a result and isn't searched for errors
+ERROR_BODY_LIMIT = 4096
+
+
+def serialize_parameters(
+    parameters: Optional[List[QueryParameter]], exclude_none: bool = True
+) -> List[dict]:
+    if not parameters:
+        return list()
+    return [
+        param.dict(exclude_none=exclude_none)
+        for param in parameters
+        if type(param) == QueryParameter
+    ]
+
 
 class GraphQLQuerier:
-    def __init__(self, client: Client):
+    def __init__(
+        self,
+        client: Client,
+        columnar: bool = False,
+        memo_policy: Optional[MemoPolicy] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        operations: Optional[Operations] = None,
+        instrumentation: Optional[Instrumentation] = None,
+    ):
         self.client = client
+        self.instrumentation = instrumentation or Instrumentation()
+        self.operations = operations or Operations()
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy or RetryPolicy()
+        # Decode results straight into column arrays, skipping row validation
+        self.columnar = columnar
+        # Identical lookups in flight at the same time share one request, and slow
+        #   changing ones are memoized for a while
+        self.memo_policy = memo_policy or MemoPolicy()
+        self.memo = TTLCache(self.memo_policy.maxsize)
+        self.single_flight = SingleFlight()
+        # Called with the rejected authorization header when a request fails with an
+        #   expired token, returns whether the session was refreshed
+        self.on_unauthorized: Optional[Callable[[Optional[str]], bool]] = None
+
+    def memo_ttl(self, query_name: QueryName, value: Any) -> float:
+        if query_name == QueryName.FIND_QUERY:
+            return self.memo_policy.metadata_ttl
+        if query_name == QueryName.FIND_SESSION_USER:
+            return self.memo_policy.user_ttl
+        if query_name == QueryName.GET_RESULT and value[0] is not None:
+            return self.memo_policy.result_id_ttl
+        return 0
+
+    def coalesce(
+        self, query_name: QueryName, variables: dict, fn: Callable[[], Any]
+    ) -> Any:
+        key = request_key(query_name, variables)
+        value = self.memo.get(key)
+        if value is MISSING:
+            value = self.single_flight.do(key, fn)
+            ttl = self.memo_ttl(query_name, value)
+            if ttl > 0:
+                self.memo.set(key, value, ttl)
+        else:
+            self.instrumentation.count("memo.hit", operation=query_name.value)
+        return value
+
+    # Request building and response parsing are kept free of any I/O so that the
+    #   sync and async queriers share them
+    def build_request(
+        self,
+        query_name: QueryName,
+        variables: dict,
+        query: bool = True,
+        hash: bool = False,
+    ) -> bytes:
+        return self.operations[query_name].encode(variables, query, hash)
+
+    @staticmethod
+    def check_errors(response_json: dict) -> dict:
+        if response_json.get("errors"):
+            raise DuneGraphQLError(response_json["errors"])
+        return response_json
+
+    @classmethod
+    def parse_response(cls, response: Response) -> dict:
+        # Error statuses usually still carry GraphQL errors, those are preferred since
+        #   they say more
+        try:
+            response_json = response.json()
+        except ValueError:
+            raise DuneHTTPError(response)
+        if response.is_error and not response_json.get("errors"):
+            raise DuneHTTPError(response)
+        return cls.check_errors(response_json)
+
+    def retry_delay(
+        self,
+        query_name: QueryName,
+        attempt: int,
+        response: Optional[Response] = None,
+        error: Optional[Exception] = None,
+    ) -> Optional[float]:
+        # None if the attempt shouldn't be retried
+        if not self.retry_policy.should_retry(query_name, attempt, response, error):
+            return None
+        return self.retry_policy.next_delay(attempt, response)
+
+    @staticmethod
+    def metadata_variables(query_id: int, user_id: Optional[int]) -> dict:
+        return {"id": query_id, "session_filter": {"_eq": user_id}}
+
+    @staticmethod
+    def result_id_variables(
+        query_id: int, parameters: Optional[List[QueryParameter]] = None
+    ) -> dict:
+        return {"query_id": query_id, "parameters": serialize_parameters(parameters)}
+
+    @staticmethod
+    def upsert_variables(
+        object: CreateQueryObject, on_conflict: CreateQueryOnConflict, user_id: int
+    ) -> dict:
+        return {
+            "object": object.dict(),
+            "on_conflict": on_conflict.dict(),
+            "session_id": user_id,
+        }
+
+    @staticmethod
+    def execute_variables(parameters: list, query_id: int) -> dict:
+        return {
+            "query_id": query_id,
+            "parameters": serialize_parameters(parameters, exclude_none=False),
+        }
+
+    @staticmethod
+    def execution_variables(execution_id: str, parameters: list, query_id: int) -> dict:
+        return {
+            "execution_id": execution_id,
+            "parameters": serialize_parameters(parameters),
+            "query_id": query_id,
+        }
+
+    @staticmethod
+    def process_user_id(user_info: dict) -> int:
+        return user_info["data"]["users"][0]["id"]
+
+    @staticmethod
+    def process_metadata(raw_metadata: dict) -> QueryMetadata:
+        metadata = raw_metadata["data"]["queries"][0]
+        # Fields the model doesn't have, e.g. extra fields selected on the operation
+        extra = {
+            key: value
+            for key, value in metadata.items()
+            if key not in QueryMetadata.__fields__ and key != "__typename"
+        }
+        return QueryMetadata(**metadata, extra=extra)
+
+    @staticmethod
+    def process_result_id(result_id_data: dict) -> Tuple[str, str]:
+        result = result_id_data.get("data").get("get_result_v3")
+        return result.get("result_id"), result.get("job_id")
+
+    @staticmethod
+    def process_execute(execute_response: dict) -> str:
+        return execute_response["data"]["execute_query"]["job_id"]
+
+    @staticmethod
+    def process_execution(raw_result: dict, columnar: bool = False) -> ExecutionStatus:
+        execution_status = raw_result["data"]["get_execution"]
+        succeeded_data = execution_status.get(ExecutionState.SUCCEEDED.value)
+        if columnar and succeeded_data is not None:
+            return decode_result_data(succeeded_data)
+
+        # Checked in order of precedence, exactly one should be populated
+        for state, model in (
+            (ExecutionState.SUCCEEDED, QueryResultData),
+            (ExecutionState.FAILED, ExecutionFailed),
+            (ExecutionState.RUNNING, ExecutionRunning),
+            (ExecutionState.QUEUED, ExecutionQueued),
+        ):
+            state_data = execution_status.get(state.value)
+            if state_data is not None:
+                return model(**state_data)
+        raise DuneError(f"Unrecognized execution status: {execution_status}")
+
+    @classmethod
+    def process_execution_head(cls, raw_result: dict) -> ExecutionStatus:
+        # Heads of finished executions have everything but the rows
+        execution_status = raw_result["data"]["get_execution"]
+        succeeded_data = execution_status.get(ExecutionState.SUCCEEDED.value)
+        if succeeded_data is not None:
+            return QueryResultData(**succeeded_data, data=list())
+        return cls.process_execution(raw_result)
+
+    @staticmethod
+    def require_result(status: ExecutionStatus) -> QueryResultData:
+        # Raises for failed executions as well as ones still queued/running
+        result = check_status(status)
+        if result is None:
+            raise DuneError(
+                f"Execution {status.execution_id} has not finished, poll it with wait_for_execution"
+            )
+        return result
+
+    @staticmethod
+    def split_batches(
+        columns: List[str], rows: List[dict], batch_size: int
+    ) -> Tuple[List[RowBatch], List[dict]]:
+        # Cuts full batches off the front of rows, returning them and the remainder
+        full = len(rows) - len(rows) % batch_size
+        batches = [
+            RowBatch(columns, rows[start : start + batch_size])
+            for start in range(0, full, batch_size)
+        ]
+        return batches, rows[full:]
+
+    @classmethod
+    def process_result_data(
+        cls, raw_result: dict, columnar: bool = False
+    ) -> QueryResultData:
+        return cls.require_result(cls.process_execution(raw_result, columnar))
+
+    @staticmethod
+    def is_unauthorized(response: Response) -> bool:
+        # Hasura rejects expired tokens with a 200 and an invalid-jwt error, the error
+        #   bodies are small so only those are searched
+        if response.status_code == 401:
+            return True
+        return (
+            len(response.content) < ERROR_BODY_LIMIT
+            and b"invalid-jwt" in response.content
+        )
+
+    @staticmethod
+    def may_be_unauthorized(response: Response) -> bool:
+        # For streamed responses, whose bodies haven't been read yet. Only those small
+        #   enough to be an error rather than rows are worth reading to find out
+        if response.status_code == 401:
+            return True
+        length = response.headers.get("content-length")
+        return length is not None and int(length) < ERROR_BODY_LIMIT
+
+    def send(
+        self, query_name: QueryName, url: str, content: bytes, stream: bool = False
+    ) -> Response:
+        # Rate limited and retried per the retry policy. Streamed responses must be
+        #   closed by the caller
+        request = self.client.build_request(
+            "POST", url, content=content, headers=JSON_HEADERS
+        )
+        with self.instrumentation.span(
+            "graphql.request",
+            operation=query_name.value,
+            host=request.url.host,
+            bytes_sent=len(content),
+        ) as span:
+            attempt = 0
+            throttled = 0.0
+            while True:
+                if self.rate_limiter is not None:
+                    throttled += self.rate_limiter.acquire(url)
+                try:
+                    response = self.client.send(request, stream=stream)
+                except TransportError as error:
+                    delay = self.retry_delay(query_name, attempt, error=error)
+                    if delay is None:
+                        raise
+                else:
+                    delay = self.retry_delay(query_name, attempt, response=response)
+                    if delay is None:
+                        break
+                    response.close()
+                time.sleep(delay)
+                attempt += 1
+            # Streamed bodies haven't been downloaded yet, see graphql.stream
+            span.set(
+                status_code=response.status_code,
+                bytes_received=None if stream else received_bytes(response),
+                retries=attempt,
+                throttled_seconds=throttled,
+            )
+        return response
+
+    def post_content(self, query_name: QueryName, url: str, content: bytes) -> dict:
+        authorization = self.client.headers.get("authorization")
+        response = self.send(query_name, url, content)
+        if self.is_unauthorized(response) and self.on_unauthorized is not None:
+            if self.on_unauthorized(authorization):
+                response = self.send(query_name, url, content)
+        with self.instrumentation.span("graphql.decode", operation=query_name.value):
+            return self.parse_response(response)
+
+    def send_stream(self, query_name: QueryName, url: str, content: bytes) -> Response:
+        # send(stream=True), refreshing an expired session once like post_content
+        authorization = self.client.headers.get("authorization")
+        response = self.send(query_name, url, content, stream=True)
+        if self.on_unauthorized is None or not self.may_be_unauthorized(response):
+            return response
+        response.read()
+        if self.is_unauthorized(response) and self.on_unauthorized(authorization):
+            response.close()
+            response = self.send(query_name, url, content, stream=True)
+        return response
 
     def post_graph_ql(
         self, query_name: QueryName, variables: dict, url: str = GRAPH_QL_URL
     ) -> dict:
-        # Change this to pydantic data type with enum? I.e. mapping between operation name and query?
-        data = {
-            "operationName": query_name.value,
-            "query": query_name.get_query_string(),
-            "variables": variables,
-        }
-        response = self.client.post(url, json=data)
-        response_json = response.json()
-
-        # TODO make this a more general handling pattern for all gql calls
-        #   Could make this 'errors' response its own object
-        if "errors" in response_json:
-            for error in response_json["errors"]:
-                # This is hacky and raising on teh first error only, improve this to
-                #   return ALL errors from server in one DuneError (DuneMultiError?)
-                raise DuneError(
-                    f"Dune query failed with code: {error.get('code')} and message: {error.get('message')}"
-                )
-        return response_json
+        if self.operations.persisted:
+            content = self.build_request(query_name, variables, query=False, hash=True)
+            try:
+                return self.post_content(query_name, url, content)
+            except DuneGraphQLError as error:
+                if not self.operations.handle_miss(error.errors):
+                    raise
+        # Sent with its hash as well so servers that support it remember the query
+        content = self.build_request(
+            query_name, variables, hash=self.operations.persisted
+        )
+        return self.post_content(query_name, url, content)
 
     def get_user_id(self, sub: UUID) -> int:
-        user_info = self.post_graph_ql(QueryName.FIND_SESSION_USER, {"sub": sub})
-        return user_info["data"]["users"][0]["id"]
+        variables = {"sub": sub}
+
+        def fetch() -> int:
+            user_info = self.post_graph_ql(QueryName.FIND_SESSION_USER, variables)
+            return self.process_user_id(user_info)
+
+        return self.coalesce(QueryName.FIND_SESSION_USER, variables, fetch)
 
     def get_query_metadata(self, query_id: int, user_id: int) -> QueryMetadata:
-        variables = {"id": query_id, "session_filter": {"_eq": user_id}}
-        raw_metadata = self.post_graph_ql(QueryName.FIND_QUERY, variables)
-        metadata = raw_metadata["data"]["queries"][0]
-        return QueryMetadata(**metadata)
+        variables = self.metadata_variables(query_id, user_id)
+
+        def fetch() -> QueryMetadata:
+            raw_metadata = self.post_graph_ql(QueryName.FIND_QUERY, variables)
+            return self.process_metadata(raw_metadata)
+
+        # Callers get their own copy, they are free to modify its parameters
+        metadata = self.coalesce(QueryName.FIND_QUERY, variables, fetch)
+        return metadata.copy(deep=True)
 
-    # TODO clean up this bulky handling of parmeters!!
     def get_result_id(
         self, query_id: int, parameters: Optional[List[QueryParameter]] = None
-    ) -> str:
-        variables = {"query_id": query_id}
-        if len(parameters):
-            parameters = [
-                param.dict(exclude_none=True)
-                for param in parameters
-                if type(param) == QueryParameter
-            ]
-        else:
-            parameters = list()
-        variables["parameters"] = parameters
-        result_id_data = self.post_graph_ql(QueryName.GET_RESULT, variables)
-        result = result_id_data.get("data").get("get_result_v3")
-        return result.get("result_id"), result.get("job_id")
+    ) -> Tuple[str, str]:
+        variables = self.result_id_variables(query_id, parameters)
+
+        def fetch() -> Tuple[str, str]:
+            result_id_data = self.post_graph_ql(QueryName.GET_RESULT, variables)
+            return self.process_result_id(result_id_data)
+
+        return self.coalesce(QueryName.GET_RESULT, variables, fetch)
 
     def upsert_query(
         self,
@@ -78,43 +391,140 @@ class GraphQLQuerier:
     ) -> Dict:
         upsert_response = self.post_graph_ql(
             QueryName.UPSERT_QUERY,
-            {
-                "object": object.dict(),
-                "on_conflict": on_conflict.dict(),
-                "session_id": user_id,
-            },
+            self.upsert_variables(object, on_conflict, user_id),
         )
         return upsert_response
 
-    def execute_query(self, parameters: list, query_id: int) -> None:
+    def execute_query(self, parameters: list, query_id: int) -> str:
         # TODO maybe retry/raise on this? might not need to
-        # TODO clean up gross parameters handling
-        parameters = [
-            param.dict() for param in parameters if type(param) == QueryParameter
-        ]
-        self.post_graph_ql(
-            QueryName.EXECUTE_QUERY, {"query_id": query_id, "parameters": parameters}
+        execute_response = self.post_graph_ql(
+            QueryName.EXECUTE_QUERY, self.execute_variables(parameters, query_id)
         )
+        return self.process_execute(execute_response)
+
+    def get_execution_status(
+        self, execution_id: str, parameters: list, query_id: int
+    ) -> ExecutionStatus:
+        variables = self.execution_variables(execution_id, parameters, query_id)
+
+        def fetch() -> ExecutionStatus:
+            raw_result = self.post_graph_ql(
+                QueryName.GET_EXECUTION, variables=variables, url=APP_API_URL
+            )
+            return self.instrumented_process_execution(raw_result)
+
+        return self.coalesce(QueryName.GET_EXECUTION, variables, fetch)
+
+    def instrumented_process_execution(self, raw_result: dict) -> ExecutionStatus:
+        with self.instrumentation.span(
+            "graphql.process",
+            operation=QueryName.GET_EXECUTION.value,
+            columnar=self.columnar,
+        ) as span:
+            status = self.process_execution(raw_result, self.columnar)
+            span.set(rows=result_rows(status))
+        return status
 
     def get_execution(
         self, execution_id: str, parameters: list, query_id: int
     ) -> QueryResultData:
-        variables = {
-            "execution_id": execution_id,
-            "parameters": parameters,
-            "query_id": query_id,
-        }
-        raw_result = self.post_graph_ql(
-            QueryName.GET_EXECUTION, variables=variables, url=APP_API_URL
+        status = self.get_execution_status(execution_id, parameters, query_id)
+        return self.require_result(status)
+
+    def get_execution_head(
+        self, execution_id: str, parameters: list, query_id: int
+    ) -> ExecutionStatus:
+        variables = self.execution_variables(execution_id, parameters, query_id)
+
+        def fetch() -> ExecutionStatus:
+            raw_result = self.post_graph_ql(
+                QueryName.GET_EXECUTION_HEAD, variables=variables, url=APP_API_URL
+            )
+            return self.process_execution_head(raw_result)
+
+        return self.coalesce(QueryName.GET_EXECUTION_HEAD, variables, fetch)
+
+    def wait_for_execution_head(
+        self,
+        execution_id: str,
+        parameters: list,
+        query_id: int,
+        policy: Optional[PollPolicy] = None,
+        cancel: Optional[Event] = None,
+    ) -> QueryResultData:
+        # The finished result's columns and timings, without downloading its rows
+        return wait_for(
+            lambda: self.get_execution_head(execution_id, parameters, query_id),
+            policy or PollPolicy(),
+            cancel,
         )
-        return self.process_result_data(raw_result)
 
-    def process_result_data(self, raw_result: dict) -> QueryResultData:
-        # TODO error raise on other execution failures
-        # execution_failed, execution_queued, execution_running, execution_succeeded
-        execution_status = raw_result["data"]["get_execution"]
-        succeeded_data = execution_status.get("execution_succeeded")
-        if succeeded_data is None:
-            raise Error("Execution failed!")
+    def wait_for_execution(
+        self,
+        execution_id: str,
+        parameters: list,
+        query_id: int,
+        policy: Optional[PollPolicy] = None,
+        cancel: Optional[Event] = None,
+    ) -> QueryResultData:
+        return wait_for(
+            lambda: self.get_execution_status(execution_id, parameters, query_id),
+            policy or PollPolicy(),
+            cancel,
+        )
+
+    def stream_execution(
+        self,
+        execution_id: str,
+        parameters: list,
+        query_id: int,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        policy: Optional[PollPolicy] = None,
+    ) -> Iterator[RowBatch]:
+        # Yields the rows of a finished execution in batches of batch_size while the
+        #   response is still downloading. Queued/running executions are polled like
+        #   wait_for_execution does, their responses carry no rows
+        policy = policy or PollPolicy()
+        deadline = policy.deadline()
+        variables = self.execution_variables(execution_id, parameters, query_id)
+        content = self.build_request(QueryName.GET_EXECUTION, variables)
+        attempt = 0
+        while True:
+            parser = ExecutionStreamParser()
+            rows = list()
+            received = 0
+            response = self.send_stream(QueryName.GET_EXECUTION, APP_API_URL, content)
+            span = self.instrumentation.start(
+                "graphql.stream", operation=QueryName.GET_EXECUTION.value
+            )
+            error = None
+            try:
+                if response.is_error:
+                    response.read()
+                    self.parse_response(response)
+                for text in response.iter_text():
+                    new_rows = parser.feed(text)
+                    received += len(new_rows)
+                    rows.extend(new_rows)
+                    batches, rows = self.split_batches(parser.columns, rows, batch_size)
+                    yield from batches
+            except Exception as exception:
+                error = exception
+                raise
+            finally:
+                response.close()
+                span.set(bytes_received=response.num_bytes_downloaded, rows=received)
+                self.instrumentation.finish(span, error)
+            parser.close()
+            if rows:
+                yield RowBatch(parser.columns, rows)
 
-        return QueryResultData(**succeeded_data)
+            raw_result = self.check_errors(parser.raw_result())
+            status = self.process_execution(raw_result)
+            if check_status(status) is not None:
+                if not received:
+                    # Empty results still carry their columns, e.g. for CSV headers
+                    yield RowBatch(parser.columns or list(), list())
+                return
+            time.sleep(bounded_delay(policy, attempt, status, deadline))
+            attempt += 1
@@ -0,0 +1,133 @@
+from datetime import datetime
+from typing import List, NamedTuple, Optional
+
+import pandas as pd
+
+from dunebuggy.core.decoding import TIMESTAMP_PATTERN
+from dunebuggy.core.exceptions import DuneError
+from dunebuggy.models.constants import ParameterEnum
+from dunebuggy.models.query import QueryParameter, QueryResultData
+
+DATETIME_PARAMETER_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class RefreshDelta(NamedTuple):
+    # Rows whose key wasn't in the previous result, and rows whose key was but whose
+    #   values changed (with their new values)
+    added: pd.DataFrame
+    changed: pd.DataFrame
+    generated_at: Optional[datetime]
+
+    @property
+    def empty(self) -> bool:
+        return self.added.empty and self.changed.empty
+
+
+def find_datetime_parameter(
+    parameters: List[QueryParameter], name: Optional[str] = None
+) -> Optional[QueryParameter]:
+    for param in parameters:
+        if name is not None and param.key == name:
+            return param
+        if name is None and param.type == ParameterEnum.DATETIME:
+            return param
+    if name is not None:
+        raise DuneError(f"Query has no parameter named {name}")
+    return None
+
+
+def latest_timestamp(values: pd.Series) -> Optional[pd.Timestamp]:
+    # Latest value of a datetime column, or of a text column holding timestamps as
+    #   Dune returns them. None for anything else, e.g. block numbers or hashes
+    if not pd.api.types.is_datetime64_any_dtype(values):
+        present = values.dropna()
+        if present.empty or not all(
+            isinstance(value, str) and TIMESTAMP_PATTERN.match(value)
+            for value in present
+        ):
+            return None
+        try:
+            values = pd.to_datetime(present, utc=True)
+        except (ValueError, TypeError, OverflowError):
+            return None
+    latest = values.max()
+    return None if pd.isna(latest) else pd.Timestamp(latest)
+
+
+def narrow_parameters(
+    parameters: List[QueryParameter],
+    df: pd.DataFrame,
+    key: str,
+    since_parameter: Optional[str] = None,
+    time_column: Optional[str] = None,
+) -> Optional[List[QueryParameter]]:
+    # Moves the query's start date parameter up to the latest time already held, so
+    #   only the tail is fetched. The latest row is fetched again since it may have
+    #   been partial. The time is read from time_column, or from the key column if it
+    #   holds timestamps. Returns None if there is no start date or time to narrow on
+    param = find_datetime_parameter(parameters, since_parameter)
+    if param is None or df.empty:
+        return None
+    column = time_column if time_column is not None else key
+    if column not in df.columns:
+        raise DuneError(f"Time column {column} not in the previous result")
+    latest = latest_timestamp(df[column])
+    if latest is None:
+        if time_column is not None:
+            raise DuneError(f"Time column {time_column} doesn't hold timestamps")
+        return None
+    if latest.tzinfo is not None:
+        latest = latest.tz_convert("UTC")
+    narrowed = param.copy(update={"value": latest.strftime(DATETIME_PARAMETER_FORMAT)})
+    return [narrowed if p.key == param.key else p for p in parameters]
+
+
+def merge_frames(old: pd.DataFrame, new: pd.DataFrame, key: str) -> tuple:
+    # Returns (merged, added, changed). Rows keep their previous position when updated,
+    #   added rows go at the end
+    for name, df in (("previous", old), ("new", new)):
+        if key not in df.columns:
+            raise DuneError(f"Key column {key} not in the {name} result")
+        if df[key].duplicated().any():
+            raise DuneError(
+                f"Key column {key} has duplicate values in the {name} result"
+            )
+
+    missing = [column for column in old.columns if column not in new.columns]
+    if missing:
+        raise DuneError(f"Columns {missing} of the previous result not in the new one")
+
+    old_indexed = old.set_index(key)
+    new_indexed = new.set_index(key)[old_indexed.columns]
+    common = new_indexed.index.intersection(old_indexed.index)
+
+    before = old_indexed.loc[common]
+    after = new_indexed.loc[common]
+    differs = (before != after) & ~(before.isna() & after.isna())
+    changed = after[differs.any(axis=1)]
+
+    added = new_indexed.loc[new_indexed.index.difference(old_indexed.index, sort=False)]
+    merged = old_indexed.copy()
+    merged.loc[changed.index] = changed
+    merged = pd.concat([merged, added])
+
+    columns = list(old.columns)
+    return (
+        merged.reset_index()[columns],
+        added.reset_index()[columns],
+        changed.reset_index()[columns],
+    )
+
+
+def refreshed_result_data(
+    result_data: QueryResultData, columns: List[str], merged: pd.DataFrame
+) -> QueryResultData:
+    # The merged rows are kept in columnar form, the DataFrame is the source of truth
+    return QueryResultData.construct(
+        execution_id=result_data.execution_id,
+        runtime_seconds=result_data.runtime_seconds,
+        generated_at=result_data.generated_at,
+        columns=columns,
+        data=None,
+        arrays={column: merged[column].array for column in columns},
+    )
@@ -0,0 +1,209 @@
+import time
+from contextlib import contextmanager
+from threading import Lock
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+import pandas as pd
+
+from dunebuggy.core.exceptions import DuneError
+from dunebuggy.models.query import QueryResultData
+
+# Spans recorded, their attributes are listed next to them
+#   graphql.request: operation, host, bytes_sent, bytes_received, status_code,
+#       retries, throttled_seconds. Covers rate limiting, retries and the download
+#   graphql.decode: operation. JSON decoding and error checking of a response
+#   graphql.process: operation, columnar, rows. Validation/decoding of a result
+#   graphql.stream: operation, bytes_received, rows. A streamed download, including
+#       the time the consumer spends between batches
+#   dataframe.build: columnar, rows, columns
+#   refresher.refresh: query_id, key, execution_id. One Refresher run of a query
+# Counters recorded: memo.hit (operation), cache.hit, cache.revalidated, cache.miss
+
+# Attributes MetricsCollector totals up
+SUMMED_ATTRIBUTES = (
+    "bytes_sent",
+    "bytes_received",
+    "retries",
+    "throttled_seconds",
+    "rows",
+)
+
+
+class Span:
+    def __init__(self, name: str, attributes: Dict[str, Any]):
+        self.name = name
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self._start = time.perf_counter()
+        self.duration: Optional[float] = None  # seconds, set once finished
+        self.error: Optional[BaseException] = None
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        self.duration = time.perf_counter() - self._start
+        self.error = error
+
+    @property
+    def end_ns(self) -> int:
+        return self.start_ns + int(self.duration * 1e9)
+
+
+class NoopSpan:
+    def set(self, **attributes) -> None:
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class Instrument:
+    # Receives finished spans and counter increments, override the hooks needed.
+    #   Hooks are called from whichever thread/task did the work
+    def on_span(self, span: Span) -> None:
+        pass
+
+    def on_count(self, name: str, value: float, attributes: Dict[str, Any]) -> None:
+        pass
+
+
+class Instrumentation:
+    # Hands spans and counters to instruments. Without any instruments nothing is
+    #   measured, so the hot paths only pay for a check
+    def __init__(self, instruments: Iterable[Instrument] = ()):
+        self.instruments = list(instruments)
+
+    def start(self, name: str, **attributes):
+        if not self.instruments:
+            return NOOP_SPAN
+        return Span(name, attributes)
+
+    def finish(self, span, error: Optional[BaseException] = None) -> None:
+        # For spans that can't be a with block, e.g. ones spanning generator yields
+        if span is NOOP_SPAN:
+            return
+        span.finish(error)
+        for instrument in self.instruments:
+            instrument.on_span(span)
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Span]:
+        span = self.start(name, **attributes)
+        try:
+            yield span
+        except BaseException as error:
+            self.finish(span, error)
+            raise
+        self.finish(span)
+
+    def count(self, name: str, value: float = 1, **attributes) -> None:
+        for instrument in self.instruments:
+            instrument.on_count(name, value, attributes)
+
+
+NO_INSTRUMENTATION = Instrumentation()
+
+
+def received_bytes(response) -> int:
+    # Bytes on the wire, i.e. before decompression. Responses that never went over
+    #   the network (e.g. from a mock transport) fall back to their content length
+    return response.num_bytes_downloaded or len(response.content)
+
+
+def result_rows(status: Any) -> int:
+    if not isinstance(status, QueryResultData):
+        return 0
+    if status.arrays is not None:
+        return len(next(iter(status.arrays.values()), ()))
+    return len(status.data or ())
+
+
+class SpanStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.totals: Dict[str, float] = dict()
+
+    def add(self, span: Span) -> None:
+        self.count += 1
+        self.errors += span.error is not None
+        self.total_seconds += span.duration
+        self.max_seconds = max(self.max_seconds, span.duration)
+        for key in SUMMED_ATTRIBUTES:
+            value = span.attributes.get(key)
+            if value is not None:
+                self.totals[key] = self.totals.get(key, 0) + value
+
+
+class MetricsCollector(Instrument):
+    # Aggregates spans and counters in memory, per span/counter name and operation
+    def __init__(self):
+        self._lock = Lock()
+        self.spans: Dict[Tuple[str, Optional[str]], SpanStats] = dict()
+        self.counters: Dict[Tuple[str, Optional[str]], float] = dict()
+
+    def on_span(self, span: Span) -> None:
+        key = (span.name, span.attributes.get("operation"))
+        with self._lock:
+            self.spans.setdefault(key, SpanStats()).add(span)
+
+    def on_count(self, name: str, value: float, attributes: Dict[str, Any]) -> None:
+        key = (name, attributes.get("operation"))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def summary(self) -> pd.DataFrame:
+        # One row per span name and operation
+        with self._lock:
+            rows = [
+                {
+                    "span": name,
+                    "operation": operation,
+                    "count": stats.count,
+                    "errors": stats.errors,
+                    "total_seconds": stats.total_seconds,
+                    "mean_seconds": stats.total_seconds / stats.count,
+                    "max_seconds": stats.max_seconds,
+                    **stats.totals,
+                }
+                for (name, operation), stats in self.spans.items()
+            ]
+        return pd.DataFrame(rows)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.spans.clear()
+            self.counters.clear()
+
+
+class OpenTelemetryInstrument(Instrument):
+    # Exports spans through an OpenTelemetry tracer, as children of whatever span is
+    #   current when they finish. Counters are left to MetricsCollector
+    def __init__(self, tracer=None):
+        try:
+            from opentelemetry import trace
+        except ImportError:
+            raise DuneError(
+                "OpenTelemetry spans require opentelemetry-api, install it with "
+                "`pip install dunebuggy[otel]`"
+            )
+        self._trace = trace
+        self.tracer = tracer or trace.get_tracer("dunebuggy")
+
+    def on_span(self, span: Span) -> None:
+        otel_span = self.tracer.start_span(
+            span.name,
+            attributes={
+                f"dunebuggy.{key}": value
+                for key, value in span.attributes.items()
+                if value is not None
+            },
+            start_time=span.start_ns,
+        )
+        if span.error is not None:
+            otel_span.record_exception(span.error)
+            otel_span.set_status(self._trace.Status(self._trace.StatusCode.ERROR))
+        otel_span.end(end_time=span.end_ns)
@@ -0,0 +1,103 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from threading import Lock
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+from dunebuggy.models.gqlqueries import QueryName
+
+MISSING = object()
+
+
+def request_key(query_name: QueryName, variables: dict) -> Tuple[str, str]:
+    return query_name.value, json.dumps(variables, sort_keys=True, default=str)
+
+
+class MemoPolicy:
+    # Seconds to memoize slow-changing lookups for, 0 disables memoization of that
+    #   lookup. Result ids are only memoized once they point at a finished result
+    def __init__(
+        self,
+        metadata_ttl: float = 60.0,
+        user_ttl: float = 3600.0,
+        result_id_ttl: float = 10.0,
+        maxsize: int = 1024,
+    ):
+        self.metadata_ttl = metadata_ttl
+        self.user_ttl = user_ttl
+        self.result_id_ttl = result_id_ttl
+        self.maxsize = maxsize
+
+
+class TTLCache:
+    # Thread-safe LRU cache whose entries also expire after their ttl
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: Hashable) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return MISSING
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return MISSING
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: float) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class SingleFlight:
+    # Concurrent calls with the same key share the first caller's call and result
+    def __init__(self):
+        self._calls: Dict[Hashable, Future] = dict()
+        self._lock = Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+class AsyncSingleFlight:
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Future] = dict()
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            task = self._calls[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        # One caller being cancelled shouldn't cancel the call for the others
+        return await asyncio.shield(task)
@@ -0,0 +1,129 @@
+import hashlib
+import json
+import re
+from typing import Dict, List, Optional, Sequence
+
+from dunebuggy.core.exceptions import DuneError
+from dunebuggy.models.gqlqueries import EXTRA_FIELDS_MARKER, QueryName
+
+# Variables declared in an operation's header, e.g. `query FindQuery($id: Int!)`
+DECLARED_VARIABLE = re.compile(r"\$(\w+)\s*:")
+JSON_HEADERS = {"content-type": "application/json"}
+
+
+def with_extra_fields(query_name: QueryName, query: str, fields: Sequence[str]) -> str:
+    if not fields:
+        return query
+    if EXTRA_FIELDS_MARKER not in query:
+        raise DuneError(
+            f"Extra fields can't be selected on the {query_name.value} operation"
+        )
+    selection = "".join(f"    {field}\n" for field in fields)
+    return query.replace(EXTRA_FIELDS_MARKER, selection)
+
+
+def encode_json(value) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def persisted_query_miss(errors: List[dict]) -> Optional[str]:
+    # "not_found" if the server supports persisted queries but hasn't seen this hash,
+    #   "unsupported" if it doesn't support them at all (Hasura complains the query key
+    #   is missing), None if the errors are about something else
+    for error in errors:
+        code = error.get("extensions", dict()).get("code", error.get("code")) or ""
+        message = error.get("message") or ""
+        if "PersistedQueryNotFound" in (code, message) or (
+            code == "PERSISTED_QUERY_NOT_FOUND"
+        ):
+            return "not_found"
+        if "PersistedQueryNotSupported" in (code, message) or (
+            code == "PERSISTED_QUERY_NOT_SUPPORTED"
+        ):
+            return "unsupported"
+        if code == "parse-failed" and "query" in message:
+            return "unsupported"
+    return None
+
+
+class Operation:
+    # One GraphQL operation with the parts of its request body that never change
+    #   encoded up front. Per request only the variables are serialized and spliced in
+    def __init__(self, query_name: QueryName, query: str):
+        self.query_name = query_name
+        self.query = query
+        header = query.split("{", 1)[0]
+        self.variables = frozenset(DECLARED_VARIABLE.findall(header))
+        self.sha256 = hashlib.sha256(query.encode()).hexdigest()
+
+        extensions = {"persistedQuery": {"version": 1, "sha256Hash": self.sha256}}
+        name = {"operationName": query_name.value}
+        # Keyed by (send the query string, send the hash)
+        self._prefixes = {
+            (True, False): self.body_prefix({**name, "query": query}),
+            (False, True): self.body_prefix({**name, "extensions": extensions}),
+            (True, True): self.body_prefix(
+                {**name, "query": query, "extensions": extensions}
+            ),
+        }
+
+    @staticmethod
+    def body_prefix(fields: dict) -> bytes:
+        # The body up to where the variables go
+        return (encode_json(fields)[:-1] + ',"variables":').encode()
+
+    def encode(self, variables: dict, query: bool = True, hash: bool = False) -> bytes:
+        # Variables the operation doesn't declare are dropped, servers reject them
+        variables = {
+            key: value for key, value in variables.items() if key in self.variables
+        }
+        return self._prefixes[(query, hash)] + encode_json(variables).encode() + b"}"
+
+
+class Operations:
+    # The GraphQL operations a querier sends. Lean operations select only the fields
+    #   the models read. UpsertQuery's response is handed to callers of upsert_query
+    #   as is, so it keeps the full selection unless lean_upsert, which selects only
+    #   the new query's id. extra_fields adds selections to FindQuery and (lean)
+    #   UpsertQuery, FindQuery's end up in QueryMetadata.extra. With persisted, only
+    #   the sha256 of the query string is sent, and the full query only when the
+    #   server asks for it
+    def __init__(
+        self,
+        lean: bool = True,
+        extra_fields: Optional[Dict[QueryName, Sequence[str]]] = None,
+        persisted: bool = False,
+        lean_upsert: bool = False,
+    ):
+        extra_fields = extra_fields or dict()
+        if not lean and extra_fields:
+            raise DuneError("Extra fields can only be selected on lean operations")
+        self.lean = lean
+        self.lean_upsert = lean and lean_upsert
+        self.persisted = persisted
+        self._operations = dict()
+        for query_name in QueryName:
+            if query_name == QueryName.UPSERT_QUERY:
+                is_lean = self.lean_upsert
+            else:
+                is_lean = lean
+            query = (
+                query_name.get_lean_query_string()
+                if is_lean
+                else query_name.get_query_string()
+            )
+            query = with_extra_fields(
+                query_name, query, extra_fields.get(query_name, ())
+            )
+            self._operations[query_name] = Operation(query_name, query)
+
+    def __getitem__(self, query_name: QueryName) -> Operation:
+        return self._operations[query_name]
+
+    def handle_miss(self, errors: List[dict]) -> bool:
+        # Whether a hash-only request failed because the server lacks the query string,
+        #   in which case it should be sent again in full
+        miss = persisted_query_miss(errors)
+        if miss == "unsupported":
+            self.persisted = False
+        return miss is not None
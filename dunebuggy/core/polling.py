@@ -0,0 +1,132 @@
+import asyncio
+import random
+import time
+from threading import Event
+from typing import Awaitable, Callable, Optional, Union
+
+from dunebuggy.core.exceptions import (
+    DuneCancelledError,
+    DuneExecutionError,
+    DuneTimeoutError,
+)
+from dunebuggy.models.query import (
+    ExecutionFailed,
+    ExecutionQueued,
+    ExecutionStatus,
+    QueryResultData,
+)
+
+
+class PollPolicy:
+    # Backoff for polling GetExecution. Running executions back off exponentially from
+    #   initial_delay, queued ones additionally wait roughly per_position seconds for
+    #   every execution ahead of them. timeout is the overall deadline in seconds
+    def __init__(
+        self,
+        initial_delay: float = 0.5,
+        max_delay: float = 15.0,
+        multiplier: float = 1.5,
+        jitter: float = 0.2,
+        per_position: float = 0.5,
+        timeout: Optional[float] = 300.0,
+    ):
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.per_position = per_position
+        self.timeout = timeout
+
+    def next_delay(self, attempt: int, status: ExecutionStatus) -> float:
+        delay = self.initial_delay * self.multiplier**attempt
+        if isinstance(status, ExecutionQueued) and status.position:
+            delay = max(delay, self.per_position * status.position)
+        delay = min(delay, self.max_delay)
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def deadline(self) -> Optional[float]:
+        if self.timeout is None:
+            return None
+        return time.monotonic() + self.timeout
+
+
+def check_status(status: ExecutionStatus) -> Optional[QueryResultData]:
+    if isinstance(status, ExecutionFailed):
+        raise DuneExecutionError(status)
+    if isinstance(status, QueryResultData):
+        return status
+    return None
+
+
+def bounded_delay(
+    policy: PollPolicy, attempt: int, status: ExecutionStatus, deadline: Optional[float]
+) -> float:
+    delay = policy.next_delay(attempt, status)
+    if deadline is not None:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise DuneTimeoutError(status)
+        delay = min(delay, remaining)
+    return delay
+
+
+def check_cancelled(cancel: Optional[Union[Event, asyncio.Event]]) -> None:
+    # For work that would only end up polled, so it isn't started once cancelled
+    if cancel is not None and cancel.is_set():
+        raise DuneCancelledError("Cancelled before it started")
+
+
+def wait_for(
+    poll: Callable[[], ExecutionStatus],
+    policy: PollPolicy,
+    cancel: Optional[Event] = None,
+) -> QueryResultData:
+    deadline = policy.deadline()
+    attempt = 0
+    while True:
+        status = poll()
+        result = check_status(status)
+        if result is not None:
+            return result
+
+        delay = bounded_delay(policy, attempt, status, deadline)
+        if cancel is None:
+            time.sleep(delay)
+        elif cancel.wait(delay):
+            raise DuneCancelledError(
+                f"Polling of execution {status.execution_id} cancelled"
+            )
+        attempt += 1
+
+
+async def await_for(
+    poll: Callable[[], Awaitable[ExecutionStatus]],
+    policy: PollPolicy,
+    cancel: Optional[asyncio.Event] = None,
+) -> QueryResultData:
+    # Cancel by setting cancel, or by cancelling the awaiting task
+    deadline = policy.deadline()
+    attempt = 0
+    while True:
+        status = await poll()
+        result = check_status(status)
+        if result is not None:
+            return result
+
+        delay = bounded_delay(policy, attempt, status, deadline)
+        if cancel is None:
+            await asyncio.sleep(delay)
+        elif await cancelled(cancel, delay):
+            raise DuneCancelledError(
+                f"Polling of execution {status.execution_id} cancelled"
+            )
+        attempt += 1
+
+
+async def cancelled(cancel: asyncio.Event, timeout: float) -> bool:
+    # Event.wait(timeout) for asyncio, whether cancel was set within timeout
+    try:
+        await asyncio.wait_for(cancel.wait(), timeout)
+    except asyncio.TimeoutError:
+        return False
+    return True
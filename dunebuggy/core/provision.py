@@ -0,0 +1,143 @@
+import asyncio
+from concurrent.futures import Future
+from threading import Lock
+from typing import Awaitable, Callable, List, NamedTuple, Optional
+
+from dunebuggy.core.dunequery import DuneQuery
+from dunebuggy.models.constants import DatasetId
+from dunebuggy.models.query import (
+    CreateQueryOnConflict,
+    ExecutionStatus,
+    QueryParameter,
+)
+
+# Every upsert resolves conflicts the same way, so one instance serves them all
+ON_CONFLICT = CreateQueryOnConflict()
+
+
+class QuerySpec(NamedTuple):
+    # One query for create_queries, the arguments create_query takes
+    name: str
+    sql: str
+    dataset_id: DatasetId
+    parameters: Optional[List[QueryParameter]] = None
+    is_temp: bool = False
+
+
+class CreatedQuery(NamedTuple):
+    query_id: int
+    execution_id: str  # of the execution started right after the upsert
+
+
+class QueryHandle:
+    # A query being created by Dune.create_queries. created() blocks until it has been
+    #   upserted and executed, wait() until its result has been downloaded. Results
+    #   are fetched in the background if create_queries was asked to, otherwise by the
+    #   first wait() call
+    def __init__(
+        self,
+        spec: QuerySpec,
+        fetch: Callable[[QuerySpec, CreatedQuery], DuneQuery],
+        head: Callable[[QuerySpec, CreatedQuery], ExecutionStatus],
+    ):
+        self.spec = spec
+        self._fetch = fetch
+        self._head = head
+        self._created: Future = Future()
+        self._result: Future = Future()
+        self._lock = Lock()
+
+    @property
+    def parameters(self) -> List[QueryParameter]:
+        return list(self.spec.parameters or ())
+
+    def created(self) -> CreatedQuery:
+        return self._created.result()
+
+    @property
+    def query_id(self) -> int:
+        return self.created().query_id
+
+    def done(self) -> bool:
+        # Whether wait() would return without waiting on Dune
+        return self._result.done()
+
+    def status(self) -> ExecutionStatus:
+        # One poll of the execution, without its rows
+        return self._head(self.spec, self.created())
+
+    def create(self, create: Callable[[], CreatedQuery]) -> None:
+        # Runs the upsert and execution, called once by create_queries
+        try:
+            self._created.set_result(create())
+        except Exception as error:
+            self._created.set_exception(error)
+
+    def fetch(self) -> None:
+        with self._lock:
+            if self._result.done():
+                return
+            try:
+                self._result.set_result(self._fetch(self.spec, self.created()))
+            except Exception as error:
+                self._result.set_exception(error)
+
+    def wait(self) -> DuneQuery:
+        self.fetch()
+        return self._result.result()
+
+
+class AsyncQueryHandle:
+    # As QueryHandle, for AsyncDune.create_queries. Handles can be awaited directly,
+    #   e.g. with asyncio.gather(*handles)
+    def __init__(
+        self,
+        spec: QuerySpec,
+        fetch: Callable[[QuerySpec, CreatedQuery], Awaitable[DuneQuery]],
+        head: Callable[[QuerySpec, CreatedQuery], Awaitable[ExecutionStatus]],
+    ):
+        loop = asyncio.get_running_loop()
+        self.spec = spec
+        self._fetch = fetch
+        self._head = head
+        self._created: asyncio.Future = loop.create_future()
+        self._result: Optional[asyncio.Task] = None
+        self._task: Optional[asyncio.Task] = None  # the upsert and execution
+
+    @property
+    def parameters(self) -> List[QueryParameter]:
+        return list(self.spec.parameters or ())
+
+    async def created(self) -> CreatedQuery:
+        return await asyncio.shield(self._created)
+
+    def done(self) -> bool:
+        return self._result is not None and self._result.done()
+
+    async def status(self) -> ExecutionStatus:
+        return await self._head(self.spec, await self.created())
+
+    async def create(self, create: Callable[[], Awaitable[CreatedQuery]]) -> None:
+        try:
+            self._created.set_result(await create())
+        except Exception as error:
+            self._created.set_exception(error)
+
+    def start(self, work: Awaitable[None]) -> None:
+        # Keeps a reference to the task running create(), so it isn't collected early
+        self._task = asyncio.ensure_future(work)
+
+    async def _fetch_created(self) -> DuneQuery:
+        return await self._fetch(self.spec, await self.created())
+
+    def fetch(self) -> asyncio.Task:
+        if self._result is None:
+            self._result = asyncio.ensure_future(self._fetch_created())
+        return self._result
+
+    async def wait(self) -> DuneQuery:
+        # Waiters share one fetch, cancelling one of them doesn't cancel it
+        return await asyncio.shield(self.fetch())
+
+    def __await__(self):
+        return self.wait().__await__()
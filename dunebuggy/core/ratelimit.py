@@ -0,0 +1,71 @@
+import asyncio
+import time
+from threading import Lock
+from typing import Dict, Optional
+
+from httpx import URL
+
+from dunebuggy.models.constants import APP_API_URL, GRAPH_QL_URL
+
+
+class TokenBucket:
+    # Allows rate requests per second on average, and bursts of up to burst requests.
+    #   Callers reserve a token up front and wait for it outside the lock, so the same
+    #   bucket serves threads and event loops
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.capacity = burst or max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = Lock()
+
+    def reserve(self) -> float:
+        # Takes a token, returns the seconds to wait before it may be used
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._updated
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return max(0.0, -self._tokens / self.rate)
+
+
+class RateLimiter:
+    # One bucket per host, hosts without a bucket aren't limited. Pass the same limiter
+    #   to several clients to share the budget between them
+    def __init__(self, buckets: Dict[str, TokenBucket]):
+        self.buckets = buckets
+
+    @classmethod
+    def for_dune(
+        cls,
+        graph_ql_rate: float,
+        app_api_rate: float,
+        burst: Optional[float] = None,
+    ) -> "RateLimiter":
+        # core-hsr serves metadata and mutations, app-api serves GetExecution
+        return cls(
+            {
+                URL(GRAPH_QL_URL).host: TokenBucket(graph_ql_rate, burst),
+                URL(APP_API_URL).host: TokenBucket(app_api_rate, burst),
+            }
+        )
+
+    def reserve(self, url: str) -> float:
+        bucket = self.buckets.get(URL(url).host)
+        if bucket is None:
+            return 0.0
+        return bucket.reserve()
+
+    def acquire(self, url: str) -> float:
+        # Returns the seconds waited
+        delay = self.reserve(url)
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    async def aacquire(self, url: str) -> float:
+        delay = self.reserve(url)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return delay
@@ -0,0 +1,228 @@
+import hashlib
+import heapq
+import json
+import random
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import count
+from threading import Event, Lock, Thread
+from typing import Dict, List, NamedTuple, Optional
+
+from dunebuggy.core.exceptions import DuneError
+from dunebuggy.core.ratelimit import TokenBucket
+from dunebuggy.core.store import ResultStore
+from dunebuggy.core.sweep import apply_overrides
+
+DEFAULT_MAX_CONCURRENCY = 4
+DEFAULT_STAGGER = 60.0  # seconds
+
+
+class RefreshJob(NamedTuple):
+    # One manifest entry. parameters are {parameter key: value} overrides of the
+    #   query's defaults, as in sweep_query. When several jobs are due, lower priority
+    #   values run first
+    query_id: int
+    interval: float  # seconds between refreshes
+    parameters: Optional[Dict[str, str]] = None
+    priority: int = 0
+    name: Optional[str] = None
+
+    @property
+    def key(self) -> str:
+        # Name the result is published under in the store
+        if self.name is not None:
+            return self.name
+        if not self.parameters:
+            return str(self.query_id)
+        blob = json.dumps(self.parameters, sort_keys=True, separators=(",", ":"))
+        return f"{self.query_id}-{hashlib.sha256(blob.encode()).hexdigest()[:12]}"
+
+
+class RefreshStatus(NamedTuple):
+    refreshed_at: Optional[float]  # unix time of the last successful refresh
+    execution_id: Optional[str]
+    failures: int  # consecutive failed refreshes
+    error: Optional[BaseException] = None  # the last failure's error
+
+
+def load_manifest(path: str) -> List[RefreshJob]:
+    # A JSON list of objects with the RefreshJob fields
+    with open(path) as handle:
+        entries = json.load(handle)
+    try:
+        return [RefreshJob(**entry) for entry in entries]
+    except TypeError as error:
+        raise DuneError(f"Invalid refresh manifest {path}: {error}")
+
+
+class Refresher:
+    # Keeps a fixed set of saved queries refreshed into a ResultStore. Each refresh is
+    #   an ExecuteQuery plus its GetExecution polls, after which the result replaces the
+    #   previous one in the store; readers only ever touch the store.
+    #
+    # Due jobs wait in a priority queue and are started at most max_concurrency at a
+    #   time, and at most rate per second (with bursts of burst) if rate is set. Load
+    #   is smoothed out: first refreshes are spread over up to stagger seconds unless
+    #   the store already holds a result, and every interval is jittered by up to
+    #   jitter of its length so jobs don't stay in lockstep. Failed refreshes are
+    #   retried after retry_delay, doubling up to the job's interval
+    def __init__(
+        self,
+        dune,
+        jobs: List[RefreshJob],
+        store: ResultStore,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        rate: Optional[float] = None,
+        burst: Optional[float] = None,
+        stagger: float = DEFAULT_STAGGER,
+        jitter: float = 0.1,
+        retry_delay: float = 30.0,
+    ):
+        keys = [job.key for job in jobs]
+        if len(set(keys)) != len(keys):
+            raise DuneError("Refresh jobs must publish under distinct names")
+        self.dune = dune
+        self.jobs = list(jobs)
+        self.store = store
+        self.max_concurrency = max_concurrency
+        self.bucket = None if rate is None else TokenBucket(rate, burst)
+        self.stagger = stagger
+        self.jitter = jitter
+        self.retry_delay = retry_delay
+        self.status: Dict[str, RefreshStatus] = {
+            key: RefreshStatus(store.published_at(key), None, 0) for key in keys
+        }
+        self._random = random.Random()
+        self._sequence = count()
+        self._scheduled: list = list()  # (due, sequence, job), due is time.time()
+        self._ready: list = list()  # (priority, due, sequence, job)
+        self._running = 0
+        self._lock = Lock()
+        self._wake = Event()
+        self._stopped = Event()
+        self._thread: Optional[Thread] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+        now = time.time()
+        for job in self.jobs:
+            published_at = self.status[job.key].refreshed_at
+            if published_at is None:
+                due = now + self._random.random() * min(job.interval, stagger)
+            else:
+                due = max(now, published_at + self.jittered(job.interval))
+            self.schedule(job, due)
+
+    def __enter__(self) -> "Refresher":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def jittered(self, interval: float) -> float:
+        return interval * (1 + self._random.uniform(-self.jitter, self.jitter))
+
+    def schedule(self, job: RefreshJob, due: float) -> None:
+        with self._lock:
+            heapq.heappush(self._scheduled, (due, next(self._sequence), job))
+        self._wake.set()
+
+    def start(self) -> None:
+        # Runs the scheduler on a background thread
+        if self._thread is not None:
+            raise DuneError("Refresher is already running")
+        self._stopped.clear()
+        self._thread = Thread(target=self.run, name="dunebuggy-refresher", daemon=True)
+        self._thread.start()
+
+    def stop(self, wait: bool = True) -> None:
+        # Refreshes already started are finished (or abandoned with wait=False), no new
+        #   ones are started
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None and wait:
+            self._thread.join()
+        self._thread = None
+
+    def run(self) -> None:
+        # Blocks until stop() is called
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_concurrency, thread_name_prefix="dunebuggy-refresh"
+        )
+        try:
+            while not self._stopped.is_set():
+                self._wake.clear()
+                timeout = self.dispatch()
+                self._wake.wait(timeout)
+        finally:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def dispatch(self) -> Optional[float]:
+        # Starts as many due jobs as the budgets allow. Returns the seconds until the
+        #   next job is due, None if only a finishing refresh can make progress
+        now = time.time()
+        with self._lock:
+            while self._scheduled and self._scheduled[0][0] <= now:
+                due, sequence, job = heapq.heappop(self._scheduled)
+                heapq.heappush(self._ready, (job.priority, due, sequence, job))
+
+        while not self._stopped.is_set():
+            with self._lock:
+                if not self._ready or self._running >= self.max_concurrency:
+                    break
+                entry = heapq.heappop(self._ready)
+                job = entry[-1]
+                self._running += 1
+            # Waiting for the rate budget holds back every other job too, which is
+            #   the point of a global budget
+            delay = self.bucket.reserve() if self.bucket is not None else 0.0
+            if delay > 0 and self._stopped.wait(delay):
+                # Stopped while waiting, the job goes first again on restart
+                with self._lock:
+                    self._running -= 1
+                    heapq.heappush(self._ready, entry)
+                break
+            future = self._executor.submit(self.refresh, job)
+            future.add_done_callback(lambda future, job=job: self.finished(job, future))
+
+        with self._lock:
+            if not self._scheduled:
+                return None
+            return max(0.0, self._scheduled[0][0] - time.time())
+
+    def refresh(self, job: RefreshJob) -> str:
+        dune = self.dune
+        gqlquerier = dune.gqlquerier
+        with dune.instrumentation.span(
+            "refresher.refresh", query_id=job.query_id, key=job.key
+        ) as span:
+            metadata = gqlquerier.get_query_metadata(job.query_id, dune.user_id)
+            parameters = apply_overrides(metadata.parameters, job.parameters or dict())
+            execution_id = gqlquerier.execute_query(parameters, job.query_id)
+            result_data = gqlquerier.wait_for_execution(
+                execution_id, parameters, job.query_id, dune.poll_policy
+            )
+            query = dune.build_query(metadata, parameters, result_data, dune)
+            self.store.publish(job.key, query)
+            span.set(execution_id=result_data.execution_id)
+        return result_data.execution_id
+
+    def finished(self, job: RefreshJob, future: Future) -> None:
+        now = time.time()
+        previous = self.status[job.key]
+        if future.cancelled():
+            # Dropped by stop() before it started, it's due again on restart
+            due = now
+        elif future.exception() is None:
+            self.status[job.key] = RefreshStatus(now, future.result(), 0)
+            due = now + self.jittered(job.interval)
+        else:
+            failures = previous.failures + 1
+            self.status[job.key] = previous._replace(
+                failures=failures, error=future.exception()
+            )
+            backoff = min(job.interval, self.retry_delay * 2 ** (failures - 1))
+            due = now + self.jittered(backoff)
+        with self._lock:
+            self._running -= 1
+        self.schedule(job, due)
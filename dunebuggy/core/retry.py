@@ -0,0 +1,81 @@
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import FrozenSet, Optional
+
+from httpx import ConnectError, ConnectTimeout, PoolTimeout, Response, TransportError
+
+from dunebuggy.models.gqlqueries import QueryName
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+# Errors raised before the request reached the server, safe to retry for anything
+NOT_SENT_ERRORS = (ConnectError, ConnectTimeout, PoolTimeout)
+
+
+def retry_after(response: Response) -> Optional[float]:
+    # Retry-After is either a number of seconds or an HTTP date
+    value = response.headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    # Retries transient failures with exponential backoff, waiting at least as long as
+    #   the server's Retry-After (up to max_retry_after). Mutations are only retried
+    #   when the server can't have acted on them: the connection was never made, or the
+    #   request was rate limited
+    def __init__(
+        self,
+        max_retries: int = 4,
+        initial_delay: float = 0.5,
+        max_delay: float = 30.0,
+        multiplier: float = 2.0,
+        jitter: float = 0.2,
+        max_retry_after: float = 120.0,
+        statuses: FrozenSet[int] = RETRY_STATUSES,
+    ):
+        self.max_retries = max_retries
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.max_retry_after = max_retry_after
+        self.statuses = statuses
+
+    def should_retry(
+        self,
+        query_name: QueryName,
+        attempt: int,
+        response: Optional[Response] = None,
+        error: Optional[Exception] = None,
+    ) -> bool:
+        if attempt >= self.max_retries:
+            return False
+        if error is not None:
+            if isinstance(error, NOT_SENT_ERRORS):
+                return True
+            return isinstance(error, TransportError) and not query_name.is_mutation
+        if response.status_code == 429:
+            return True
+        return response.status_code in self.statuses and not query_name.is_mutation
+
+    def next_delay(self, attempt: int, response: Optional[Response] = None) -> float:
+        delay = min(self.initial_delay * self.multiplier**attempt, self.max_delay)
+        delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        if response is not None:
+            server_delay = retry_after(response)
+            if server_delay is not None:
+                delay = max(delay, min(server_delay, self.max_retry_after))
+        return delay
+
+
+# Never retries, for callers that handle failures themselves
+NO_RETRY = RetryPolicy(max_retries=0)
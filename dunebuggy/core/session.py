@@ -0,0 +1,93 @@
+import base64
+import json
+import os
+import tempfile
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from threading import Lock
+from typing import Dict, Optional
+
+from httpx import Cookies
+
+from dunebuggy.models.session import Session, SessionCookie
+
+DEFAULT_SESSION_PATH = os.path.join(
+    os.path.expanduser("~"), ".cache", "dunebuggy", "sessions.json"
+)
+# Set while a session refresh runs, so requests made by the refresh itself (e.g. the
+#   user lookup after logging in again) don't try to refresh again
+refreshing: ContextVar[bool] = ContextVar("refreshing", default=False)
+
+
+def token_expiry(token: str) -> Optional[datetime]:
+    # Reads the exp claim of a JWT without verifying it, None if it can't be read
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(payload))
+        return datetime.fromtimestamp(claims["exp"], tz=timezone.utc)
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+def dump_cookies(cookies: Cookies) -> list:
+    return [
+        SessionCookie(
+            name=cookie.name, value=cookie.value, domain=cookie.domain, path=cookie.path
+        )
+        for cookie in cookies.jar
+    ]
+
+
+def load_cookies(cookies: Cookies, session: Session) -> None:
+    for cookie in session.cookies:
+        cookies.set(cookie.name, cookie.value, domain=cookie.domain, path=cookie.path)
+
+
+class SessionStore:
+    # Saves logged in sessions (tokens, cookies and user id) per username in a JSON
+    #   file readable only by the current user, so new Dune clients can skip logging in
+    def __init__(self, path: str = DEFAULT_SESSION_PATH):
+        self.path = path
+        self._lock = Lock()
+
+    def _read(self) -> Dict[str, dict]:
+        try:
+            with open(self.path) as handle:
+                return json.load(handle)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return dict()
+
+    def _write(self, sessions: Dict[str, dict]) -> None:
+        # Written to a temporary file first so readers never see a partial file
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(dir=directory)
+        try:
+            os.chmod(temporary, 0o600)
+            with os.fdopen(descriptor, "w") as handle:
+                json.dump(sessions, handle)
+            os.replace(temporary, self.path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+    def load(self, username: str) -> Optional[Session]:
+        # Expired sessions are returned too, their cookies can usually still refresh
+        #   the token without logging in again
+        session = self._read().get(username)
+        if session is None:
+            return None
+        return Session(**session)
+
+    def save(self, username: str, session: Session) -> None:
+        with self._lock:
+            sessions = self._read()
+            sessions[username] = json.loads(session.json())
+            self._write(sessions)
+
+    def clear(self, username: str) -> None:
+        with self._lock:
+            sessions = self._read()
+            if sessions.pop(username, None) is not None:
+                self._write(sessions)
@@ -0,0 +1,90 @@
+import os
+import re
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+from dunebuggy.core.exceptions import DuneError
+from dunebuggy.core.export import import_pyarrow
+
+DEFAULT_STORE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "dunebuggy", "store"
+)
+STORE_NAME = re.compile(r"^[A-Za-z0-9_.-]+$")
+SUFFIX = ".arrow"
+
+
+class ResultStore:
+    # Latest result per name as uncompressed Arrow IPC files in one directory. Results
+    #   are written to a temporary file and renamed over the old one, so readers in
+    #   other processes see either the previous or the new result, never a partial
+    #   one, and never wait on a writer. Reads memory-map the file, so the table's
+    #   buffers are shared with the page cache rather than copied
+    def __init__(self, directory: str = DEFAULT_STORE_DIR):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+
+    def path(self, name: str) -> str:
+        if not STORE_NAME.match(name):
+            raise DuneError(
+                f"Invalid store name {name!r}, use letters, digits, '_', '-' and '.'"
+            )
+        return os.path.join(self.directory, name + SUFFIX)
+
+    def publish(self, name: str, query) -> None:
+        # query is a DuneQuery with a downloaded result
+        path = self.path(name)
+        handle, temporary = tempfile.mkstemp(
+            dir=self.directory, prefix=f".{name}.", suffix=".tmp"
+        )
+        os.close(handle)
+        try:
+            query.to_feather(temporary, compression=None)
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+    def names(self) -> List[str]:
+        return sorted(
+            filename[: -len(SUFFIX)]
+            for filename in os.listdir(self.directory)
+            if filename.endswith(SUFFIX) and not filename.startswith(".")
+        )
+
+    def published_at(self, name: str) -> Optional[float]:
+        # Unix time the current result was published, None if there is none yet
+        try:
+            return os.stat(self.path(name)).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def age(self, name: str) -> Optional[float]:
+        published_at = self.published_at(name)
+        return None if published_at is None else time.time() - published_at
+
+    def read(self, name: str):
+        # pyarrow.Table backed by the memory-mapped file, None if nothing was published
+        #   under name yet. It stays valid after a newer result replaces the file
+        pyarrow = import_pyarrow()
+        try:
+            source = pyarrow.memory_map(self.path(name))
+        except FileNotFoundError:
+            return None
+        return pyarrow.ipc.open_file(source).read_all()
+
+    def read_df(self, name: str):
+        # Converting to pandas copies the data, prefer read() for large results
+        table = self.read(name)
+        return None if table is None else table.to_pandas()
+
+    def metadata(self, name: str) -> Optional[Dict[str, str]]:
+        # query_id, name, execution_id and generated_at of the published result
+        table = self.read(name)
+        if table is None:
+            return None
+        return {
+            key.decode(): value.decode()
+            for key, value in (table.schema.metadata or dict()).items()
+            if not key.startswith(b"pandas")
+        }
@@ -0,0 +1,163 @@
+import json
+import re
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from dunebuggy.core.exceptions import DuneError
+from dunebuggy.models.constants import ExecutionState
+
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+ROWS_PATH = ("data", "get_execution", ExecutionState.SUCCEEDED.value, "data")
+DEFAULT_BATCH_SIZE = 50_000
+
+
+class RowBatch(NamedTuple):
+    columns: List[str]
+    rows: List[dict]
+
+
+class ExecutionStreamParser:
+    # Incremental parser for GetExecution response bodies. Text is fed in chunks as it
+    #   arrives; rows under data.get_execution.execution_succeeded.data are returned
+    #   one by one as soon as they are complete, so the full body never has to be held
+    #   in memory. Every other value met on the way down is kept in `values`, keyed by
+    #   its path, so the columns and the execution status are known as well
+    def __init__(self, rows_path: Tuple[str, ...] = ROWS_PATH):
+        self.rows_path = rows_path
+        self.values: Dict[Tuple[str, ...], Any] = dict()
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0
+        # Path of the object currently being read, None before the root is opened
+        self._path: Optional[Tuple[str, ...]] = None
+        self._in_rows = False
+        self._done = False
+
+    def feed(self, text: str) -> List[dict]:
+        self._buffer = self._buffer[self._pos :] + text
+        self._pos = 0
+        rows = list()
+        while not self._done and self._step(rows):
+            pass
+        return rows
+
+    def close(self) -> None:
+        if not self._done:
+            raise DuneError("GetExecution response ended before it was complete")
+
+    def level(self, path: Tuple[str, ...]) -> Dict[str, Any]:
+        # All scalar/skipped values read directly under the object at path
+        depth = len(path) + 1
+        return {
+            key[-1]: value
+            for key, value in self.values.items()
+            if len(key) == depth and key[:-1] == path
+        }
+
+    @property
+    def columns(self) -> Optional[List[str]]:
+        return self.values.get(self.rows_path[:-1] + ("columns",))
+
+    def raw_result(self) -> dict:
+        # The response as response.json() would have returned it, minus the rows
+        succeeded_path = self.rows_path[:-1]
+        raw_result = self.level(tuple())
+        level = raw_result
+        for depth, key in enumerate(succeeded_path, start=1):
+            nested = self.level(succeeded_path[:depth])
+            if key in level:
+                break
+            level[key] = nested
+            level = nested
+        else:
+            level[self.rows_path[-1]] = list()
+        return raw_result
+
+    def _skip_whitespace(self) -> Optional[str]:
+        self._pos = WHITESPACE.match(self._buffer, self._pos).end()
+        if self._pos >= len(self._buffer):
+            return None
+        return self._buffer[self._pos]
+
+    def _decode(self) -> Tuple[bool, Any]:
+        # Decodes one complete value at the cursor. Scalars also need the delimiter
+        #   after them to be buffered, otherwise a number split across chunks could be
+        #   read short
+        try:
+            value, end = self._decoder.raw_decode(self._buffer, self._pos)
+        except json.JSONDecodeError:
+            return False, None
+        after = WHITESPACE.match(self._buffer, end).end()
+        if after >= len(self._buffer):
+            return False, None
+        self._pos = end
+        return True, value
+
+    def _step(self, rows: List[dict]) -> bool:
+        char = self._skip_whitespace()
+        if char is None:
+            return False
+
+        if self._path is None:
+            if char != "{":
+                raise DuneError(f"Unexpected GetExecution response start: {char!r}")
+            self._path = tuple()
+            self._pos += 1
+            return True
+
+        if self._in_rows:
+            if char == ",":
+                self._pos += 1
+                return True
+            if char == "]":
+                self._in_rows = False
+                self._pos += 1
+                return True
+            complete, row = self._decode()
+            if complete:
+                rows.append(row)
+            return complete
+
+        if char == ",":
+            self._pos += 1
+            return True
+        if char == "}":
+            self._pos += 1
+            if not self._path:
+                self._done = True
+            else:
+                self._path = self._path[:-1]
+            return True
+
+        # "key": value
+        try:
+            key, key_end = self._decoder.raw_decode(self._buffer, self._pos)
+        except json.JSONDecodeError:
+            return False
+        colon = WHITESPACE.match(self._buffer, key_end).end()
+        if colon >= len(self._buffer):
+            return False
+        if self._buffer[colon] != ":":
+            raise DuneError(f"Malformed GetExecution response near key {key!r}")
+        start = self._pos
+        self._pos = colon + 1
+        value_char = self._skip_whitespace()
+        if value_char is None:
+            self._pos = start
+            return False
+
+        path = self._path + (key,)
+        if path == self.rows_path and value_char == "[":
+            self._in_rows = True
+            self._pos += 1
+            return True
+        if path == self.rows_path[: len(path)] and value_char == "{":
+            self._path = path
+            self._pos += 1
+            return True
+
+        complete, value = self._decode()
+        if not complete:
+            self._pos = start
+            return False
+        self.values[path] = value
+        return True
@@ -0,0 +1,74 @@
+from itertools import product
+from typing import Dict, List, NamedTuple, Union
+
+import pandas as pd
+
+from dunebuggy.core.bulk import BulkResult
+from dunebuggy.core.decoding import arrays_to_df, decode_columns
+from dunebuggy.core.exceptions import DuneError
+from dunebuggy.models.query import QueryParameter, QueryResultData
+
+# Either a list of {parameter key: value} overrides, or a grid of
+#   {parameter key: [values]} expanded to every combination
+Overrides = Union[List[Dict[str, str]], Dict[str, List[str]]]
+
+
+class SweepResult(NamedTuple):
+    # Rows of every successful run, tagged with the parameter values they ran with,
+    #   and the runs that failed
+    df: pd.DataFrame
+    failures: List[BulkResult]
+
+
+def expand_overrides(overrides: Overrides) -> List[Dict[str, str]]:
+    if isinstance(overrides, dict):
+        keys = list(overrides)
+        return [dict(zip(keys, values)) for values in product(*overrides.values())]
+    return list(overrides)
+
+
+def apply_overrides(
+    parameters: List[QueryParameter], override: Dict[str, str]
+) -> List[QueryParameter]:
+    known = {param.key for param in parameters}
+    unknown = set(override) - known
+    if unknown:
+        raise DuneError(f"Query has no parameters named {sorted(unknown)}")
+    return [
+        (
+            param.copy(update={"value": str(override[param.key])})
+            if param.key in override
+            else param
+        )
+        for param in parameters
+    ]
+
+
+def result_to_df(result_data: QueryResultData, columnar: bool) -> pd.DataFrame:
+    if result_data.arrays is not None:
+        return arrays_to_df(result_data.columns, result_data.arrays)
+    if columnar:
+        arrays = decode_columns(result_data.columns, result_data.data)
+        return arrays_to_df(result_data.columns, arrays)
+    return pd.DataFrame(result_data.data, columns=result_data.columns)
+
+
+def combine_results(
+    overrides: List[Dict[str, str]], results: List[BulkResult], columnar: bool
+) -> SweepResult:
+    # results are keyed by the override's position, so rows come out in the order the
+    #   overrides were given regardless of which run finished first
+    frames = list()
+    failures = list()
+    for result in sorted(results, key=lambda result: result.key):
+        if not result.ok:
+            failures.append(result)
+            continue
+        df = result_to_df(result.value, columnar)
+        for key, value in overrides[result.key].items():
+            column = key if key not in df.columns else f"parameter_{key}"
+            df[column] = value
+        frames.append(df)
+
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    return SweepResult(df, failures)
@@ -0,0 +1,98 @@
+from typing import Optional, Union
+
+from httpx import (
+    AsyncBaseTransport,
+    AsyncClient,
+    BaseTransport,
+    Client,
+    Limits,
+    Timeout,
+)
+
+from dunebuggy.core.exceptions import DuneError
+from dunebuggy.models.constants import DEFAULT_HEADERS
+
+# Most traffic goes to the two GraphQL hosts, so a handful of kept-alive connections
+#   (or one multiplexed HTTP/2 connection per host) covers a lot of concurrency
+DEFAULT_LIMITS = Limits(
+    max_connections=20, max_keepalive_connections=10, keepalive_expiry=30.0
+)
+# GetExecution responses for large results can take a while to download, so reads get
+#   a longer budget than connecting. pool is how long a request waits for a connection
+DEFAULT_TIMEOUT = Timeout(connect=10.0, read=60.0, write=30.0, pool=30.0)
+
+TimeoutTypes = Union[Timeout, float, None]
+
+
+def accept_encoding() -> str:
+    # httpx only decodes brotli if one of the brotli packages is installed
+    for module in ("brotli", "brotlicffi"):
+        try:
+            __import__(module)
+        except ImportError:
+            continue
+        return "gzip, deflate, br"
+    return "gzip, deflate"
+
+
+def client_headers() -> dict:
+    return {**DEFAULT_HEADERS, "accept-encoding": accept_encoding()}
+
+
+def has_login(client: Union[Client, AsyncClient]) -> bool:
+    return "authorization" in client.headers
+
+
+def check_shared_client(
+    client: Union[Client, AsyncClient, None], username: Optional[str]
+) -> None:
+    # Session headers and cookies live on the client, so a client carries one login.
+    #   Clients for different logins can still share a transport and its connections
+    if client is not None and username is not None and has_login(client):
+        raise DuneError(
+            "The client is already logged in, share its transport instead to log in "
+            "as another user"
+        )
+
+
+def check_http2(http2: bool) -> None:
+    if not http2:
+        return
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        raise DuneError(
+            "HTTP/2 requires h2, install it with `pip install dunebuggy[http2]`"
+        )
+
+
+def build_client(
+    limits: Optional[Limits] = None,
+    timeout: TimeoutTypes = DEFAULT_TIMEOUT,
+    http2: bool = False,
+    transport: Optional[BaseTransport] = None,
+) -> Client:
+    # limits and http2 configure the default transport, they're ignored if a transport
+    #   is given
+    check_http2(http2)
+    return Client(
+        limits=limits or DEFAULT_LIMITS,
+        timeout=timeout,
+        http2=http2,
+        transport=transport,
+    )
+
+
+def build_async_client(
+    limits: Optional[Limits] = None,
+    timeout: TimeoutTypes = DEFAULT_TIMEOUT,
+    http2: bool = False,
+    transport: Optional[AsyncBaseTransport] = None,
+) -> AsyncClient:
+    check_http2(http2)
+    return AsyncClient(
+        limits=limits or DEFAULT_LIMITS,
+        timeout=timeout,
+        http2=http2,
+        transport=transport,
+    )
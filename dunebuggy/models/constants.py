@@ -39,3 +39,10 @@ class ParameterEnum(str, Enum):
     TEXT = "text"
     ENUM = "enum"
     DATETIME = "datetime"
+
+
+class ExecutionState(str, Enum):
+    QUEUED = "execution_queued"
+    RUNNING = "execution_running"
+    SUCCEEDED = "execution_succeeded"
+    FAILED = "execution_failed"
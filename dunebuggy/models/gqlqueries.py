@@ -16,6 +16,19 @@ class QueryString(str, Enum):
     FIND_SESSION_USER_QUERY = "query FindSessionUser($sub: uuid!) {\n  users(where: {private_info: {cognito_id: {_eq: $sub}}}) {\n    ...SessionUser\n    __typename\n  }\n}\n\nfragment SessionUser on users {\n  id\n  name\n  profile_image_url\n  private_info {\n    stripeCustomerId: stripe_customer_id\n    is_pro\n    permissions\n    __typename\n  }\n  __typename\n}\n"
     FIND_RESULT_DATA_BY_JOB_QUERY = "query FindResultDataByJob($job_id: uuid!) {\n  query_results(where: {job_id: {_eq: $job_id}, error: {_is_null: true}}) {\n    id\n    job_id\n    runtime\n    generated_at\n    columns\n    __typename\n  }\n  query_errors(where: {job_id: {_eq: $job_id}}) {\n    id\n    job_id\n    runtime\n    message\n    metadata\n    type\n    generated_at\n    __typename\n  }\n  get_result_by_job_id(args: {want_job_id: $job_id}) {\n    data\n    __typename\n  }\n}\n"
     GET_EXECUTION_QUERY = "query GetExecution($execution_id: String!, $query_id: Int!, $parameters: [Parameter!]!) {\n  get_execution(\n    execution_id: $execution_id\n    query_id: $query_id\n    parameters: $parameters\n  ) {\n    execution_queued {\n      execution_id\n      execution_user_id\n      position\n      execution_type\n      created_at\n      __typename\n    }\n    execution_running {\n      execution_id\n      execution_user_id\n      execution_type\n      started_at\n      created_at\n      __typename\n    }\n    execution_succeeded {\n      execution_id\n      runtime_seconds\n      generated_at\n      columns\n      data\n      __typename\n    }\n    execution_failed {\n      execution_id\n      type\n      message\n      metadata {\n        line\n        column\n        hint\n        __typename\n      }\n      runtime_seconds\n      generated_at\n      __typename\n    }\n    __typename\n  }\n}\n"
+    # GetExecution without the rows
+    GET_EXECUTION_HEAD_QUERY = "query GetExecutionHead($execution_id: String!, $query_id: Int!, $parameters: [Parameter!]!) {\n  get_execution(\n    execution_id: $execution_id\n    query_id: $query_id\n    parameters: $parameters\n  ) {\n    execution_queued {\n      execution_id\n      execution_user_id\n      position\n      execution_type\n      created_at\n      __typename\n    }\n    execution_running {\n      execution_id\n      execution_user_id\n      execution_type\n      started_at\n      created_at\n      __typename\n    }\n    execution_succeeded {\n      execution_id\n      runtime_seconds\n      generated_at\n      columns\n      __typename\n    }\n    execution_failed {\n      execution_id\n      type\n      message\n      metadata {\n        line\n        column\n        hint\n        __typename\n      }\n      runtime_seconds\n      generated_at\n      __typename\n    }\n    __typename\n  }\n}\n"
+
+
+# Selected fields are inserted in place of this comment
+EXTRA_FIELDS_MARKER = "    # extra fields\n"
+
+
+class LeanQueryString(str, Enum):
+    # Only the fields the models read, and only the variables those need
+    FIND_QUERY_QUERY = "query FindQuery($id: Int!) {\n  queries(where: {id: {_eq: $id}}) {\n    id\n    name\n    description\n    query\n    parameters\n    created_at\n    updated_at\n    user {\n      id\n      name\n      profile_image_url\n    }\n    # extra fields\n  }\n}\n"
+    UPSERT_QUERY_QUERY = "mutation UpsertQuery($object: queries_insert_input!, $on_conflict: queries_on_conflict!) {\n  insert_queries_one(object: $object, on_conflict: $on_conflict) {\n    id\n    # extra fields\n  }\n}\n"
+    FIND_SESSION_USER_QUERY = "query FindSessionUser($sub: uuid!) {\n  users(where: {private_info: {cognito_id: {_eq: $sub}}}) {\n    id\n  }\n}\n"
 
 
 class QueryName(str, Enum):
@@ -27,10 +40,21 @@ class QueryName(str, Enum):
     UPSERT_QUERY = "UpsertQuery"
     EXECUTE_QUERY = "ExecuteQuery"
     GET_EXECUTION = "GetExecution"
+    GET_EXECUTION_HEAD = "GetExecutionHead"
 
     def get_query_string(self) -> str:
         return getattr(QueryString, f"{self.name}_QUERY").value
 
+    def get_lean_query_string(self) -> str:
+        # Operations without a lean variant are already lean
+        lean = getattr(LeanQueryString, f"{self.name}_QUERY", None)
+        return self.get_query_string() if lean is None else lean.value
+
+    @property
+    def is_mutation(self) -> bool:
+        # Not safe to send twice
+        return self in (QueryName.UPSERT_QUERY, QueryName.EXECUTE_QUERY)
+
 
 class GQLPostBlob(BaseModel):
     operationName: QueryName
@@ -1,6 +1,6 @@
 from datetime import datetime
 from enum import Enum
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional, Union
 from uuid import UUID
 
 from pydantic import AnyHttpUrl, BaseModel
@@ -38,6 +38,7 @@ class QueryMetadata(BaseModel):
     parameters: List[QueryParameter]
     created_at: datetime
     updated_at: datetime
+    extra: Dict[str, Any] = dict()  # fields selected beyond the above
 
 
 class QueryResultData(BaseModel):
@@ -46,11 +47,49 @@ class QueryResultData(BaseModel):
     generated_at: datetime
     columns: List[str]
     data: List[dict]
+    # Per-column arrays, set instead of data when decoded with the columnar fast path
+    arrays: Optional[Dict[str, Any]] = None
+
+
+class ExecutionQueued(BaseModel):
+    execution_id: str
+    execution_user_id: Optional[int]
+    position: Optional[int]  # place in the execution queue, 1 is next
+    execution_type: Optional[str]
+    created_at: Optional[datetime]
+
+
+class ExecutionRunning(BaseModel):
+    execution_id: str
+    execution_user_id: Optional[int]
+    execution_type: Optional[str]
+    started_at: Optional[datetime]
+    created_at: Optional[datetime]
+
+
+class ExecutionFailedMetadata(BaseModel):
+    line: Optional[int]
+    column: Optional[int]
+    hint: Optional[str]
+
+
+class ExecutionFailed(BaseModel):
+    execution_id: str
+    type: Optional[str]
+    message: Optional[str]
+    metadata: Optional[ExecutionFailedMetadata]
+    runtime_seconds: Optional[int]
+    generated_at: Optional[datetime]
+
+
+ExecutionStatus = Union[
+    ExecutionQueued, ExecutionRunning, ExecutionFailed, QueryResultData
+]
 
 
 class Query(BaseModel):
     metadata: QueryMetadata
-    result_data: QueryResultData
+    result_data: Optional[QueryResultData]  # None until a streamed result is read
 
 
 class CreateQueryObject(BaseModel):
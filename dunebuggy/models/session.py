@@ -0,0 +1,26 @@
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+
+class SessionCookie(BaseModel):
+    name: str
+    value: str
+    domain: str = ""
+    path: str = "/"
+
+
+class Session(BaseModel):
+    token: str
+    access_token: str
+    sub: Optional[str]
+    user_id: Optional[int]
+    cookies: List[SessionCookie] = list()
+    expires_at: Optional[datetime]  # from the token's exp claim, if it has one
+
+    def expired(self, margin: float = 60.0) -> bool:
+        if self.expires_at is None:
+            return False
+        remaining = self.expires_at - datetime.now(timezone.utc)
+        return remaining.total_seconds() < margin
@@ -0,0 +1,67 @@
+import pytest
+
+from benchmarks.mockserver import MockDune
+from dunebuggy import AsyncDune, Dune
+from dunebuggy.core.instrumentation import Instrumentation, MetricsCollector
+from dunebuggy.core.memo import MemoPolicy
+from dunebuggy.core.polling import PollPolicy
+from dunebuggy.core.retry import RetryPolicy
+
+# Every lookup goes to the mock, so request counts show exactly what was sent
+NO_MEMO = MemoPolicy(metadata_ttl=0, user_ttl=0, result_id_ttl=0)
+FAST_POLLS = PollPolicy(initial_delay=0.001, max_delay=0.001, jitter=0, per_position=0)
+FAST_RETRIES = RetryPolicy(initial_delay=0.001, max_delay=0.001, jitter=0)
+
+
+@pytest.fixture
+def metrics() -> MetricsCollector:
+    return MetricsCollector()
+
+
+@pytest.fixture
+def make_dune(metrics):
+    # Builds Dune clients against a MockDune, closed when the test ends
+    opened = list()
+
+    def make(mock: MockDune, **kwargs) -> Dune:
+        kwargs = {
+            "transport": mock.transport(),
+            "poll_policy": FAST_POLLS,
+            "memo_policy": NO_MEMO,
+            "retry_policy": FAST_RETRIES,
+            "instrumentation": Instrumentation([metrics]),
+            **kwargs,
+        }
+        dune = Dune(**kwargs)
+        opened.append(dune)
+        return dune
+
+    yield make
+    for dune in opened:
+        dune.close()
+
+
+@pytest.fixture
+def mock() -> MockDune:
+    return MockDune()
+
+
+@pytest.fixture
+def dune(make_dune, mock) -> Dune:
+    return make_dune(mock)
+
+
+@pytest.fixture
+def make_async_dune(metrics):
+    def make(mock: MockDune, **kwargs) -> AsyncDune:
+        kwargs = {
+            "transport": mock.async_transport(),
+            "poll_policy": FAST_POLLS,
+            "memo_policy": NO_MEMO,
+            "retry_policy": FAST_RETRIES,
+            "instrumentation": Instrumentation([metrics]),
+            **kwargs,
+        }
+        return AsyncDune(**kwargs)
+
+    return make
@@ -0,0 +1,79 @@
+import asyncio
+import json
+from typing import Optional
+
+import httpx
+import pytest
+
+from dunebuggy.core.exceptions import DuneGraphQLError, DuneHTTPError
+from dunebuggy.models.query import QueryParameter
+
+MISSING = 13
+BROKEN = 17
+REQUESTS = [3, MISSING, (1, None), BROKEN, 5]
+
+START_DATE = QueryParameter(
+    key="Start Date", type="datetime", value="2021-06-01 00:00:00"
+)
+
+
+def fail(request: httpx.Request) -> Optional[httpx.Response]:
+    # FindQuery for MISSING answers with a GraphQL error, for BROKEN with a 500 on
+    #   every attempt
+    if request.url.path.startswith(("/api", "/auth")):
+        return None
+    body = json.loads(request.content)
+    if body.get("operationName") != "FindQuery":
+        return None
+    query_id = body["variables"]["id"]
+    if query_id == MISSING:
+        return httpx.Response(200, json={"errors": [{"message": "not found"}]})
+    if query_id == BROKEN:
+        return httpx.Response(500, text="internal error")
+    return None
+
+
+@pytest.fixture
+def failing_dune(make_dune, mock):
+    transport = httpx.MockTransport(
+        lambda request: fail(request) or mock.handle(request)
+    )
+    return make_dune(mock, transport=transport)
+
+
+@pytest.fixture
+def failing_async_dune(make_async_dune, mock):
+    async def handle(request: httpx.Request) -> httpx.Response:
+        return fail(request) or await mock.ahandle(request)
+
+    return make_async_dune(mock, transport=httpx.MockTransport(handle))
+
+
+def check(results) -> None:
+    results = {result.key: result for result in results}
+    assert sorted(results) == [1, 3, 5, MISSING, BROKEN]
+    assert [len(results[key].value.df) for key in (1, 3, 5)] == [1, 3, 5]
+    assert all(results[key].ok for key in (1, 3, 5))
+    assert isinstance(results[MISSING].error, DuneGraphQLError)
+    assert isinstance(results[BROKEN].error, DuneHTTPError)
+    assert results[BROKEN].error.status_code == 500
+    assert results[MISSING].value is None and results[BROKEN].value is None
+
+
+def test_fetch_queries_isolates_errors(failing_dune):
+    check(failing_dune.fetch_queries(REQUESTS, max_workers=2))
+
+
+def test_fetch_queries_passes_parameters(dune, mock):
+    results = list(dune.fetch_queries([(2, [START_DATE])]))
+    assert results[0].parameters == [START_DATE]
+    assert results[0].value.parameters == [START_DATE]
+    assert mock.requests["FindQuery"] == 1
+
+
+def test_async_fetch_queries_isolates_errors(failing_async_dune):
+    async def run():
+        async with failing_async_dune as dune:
+            return [result async for result in dune.fetch_queries(REQUESTS, 2)]
+
+    check(asyncio.run(run()))
@@ -0,0 +1,60 @@
+import pickle
+import sqlite3
+import zlib
+
+import pandas as pd
+import pytest
+
+from dunebuggy.core.cache import ResultCache, cache_key
+
+
+def corrupt(cache: ResultCache, payload: bytes) -> None:
+    with sqlite3.connect(cache.path) as connection:
+        connection.execute("UPDATE results SET payload = ?", (payload,))
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+def test_entries_round_trip(make_dune, mock, tmp_path, columnar):
+    cache = ResultCache(str(tmp_path))
+    dune = make_dune(mock, cache=cache, columnar=columnar)
+    fetched = dune.fetch_query(5)
+    entry = cache.get(5, [])
+    assert entry.execution_id == "result-5"
+    assert entry.query.metadata == fetched.metadata
+    pd.testing.assert_frame_equal(dune.fetch_query(5).df, fetched.df)
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [
+        b"not zlib",
+        zlib.compress(b'{"version": 1, "metadata"'),
+        zlib.compress(b'{"version": 0}'),
+        zlib.compress(pickle.dumps({"written by": "an older version"})),
+    ],
+)
+def test_unreadable_entries_are_refetched(make_dune, mock, tmp_path, payload):
+    cache = ResultCache(str(tmp_path))
+    dune = make_dune(mock, cache=cache)
+    dune.fetch_query(5)
+    corrupt(cache, payload)
+    assert cache.get(5, []) is None
+    # The bad entry was dropped, the refetched result replaces it
+    assert len(dune.fetch_query(5).df) == 5
+    assert mock.requests["GetExecution"] == 2
+    assert cache.get(5, []).execution_id == "result-5"
+
+
+def test_entries_are_not_unpickled(tmp_path):
+    class Exploit:
+        def __reduce__(self):
+            return (pytest.fail, ("unpickled a cache entry",))
+
+    cache = ResultCache(str(tmp_path))
+    payload = zlib.compress(pickle.dumps(Exploit()))
+    with sqlite3.connect(cache.path) as connection:
+        connection.execute(
+            "INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (cache_key(1, None), 1, "e", 0, 0, len(payload), payload),
+        )
+    assert cache.get(1) is None
@@ -0,0 +1,105 @@
+import asyncio
+from threading import Event, Timer
+
+import pytest
+
+from benchmarks.mockserver import MockDune
+from dunebuggy.core.exceptions import DuneCancelledError
+from dunebuggy.models.constants import DatasetId
+
+# Executions that stay queued for longer than any test runs
+STUCK = dict(queued_polls=10**6)
+
+
+def cancel_after(seconds: float) -> Event:
+    cancel = Event()
+    timer = Timer(seconds, cancel.set)
+    timer.daemon = True
+    timer.start()
+    return cancel
+
+
+def set_event() -> Event:
+    cancel = Event()
+    cancel.set()
+    return cancel
+
+
+def test_fetch_query_stops_polling_when_cancelled(make_dune):
+    mock = MockDune(**STUCK)
+    with pytest.raises(DuneCancelledError):
+        make_dune(mock).fetch_query(3, cancel=cancel_after(0.05))
+    assert mock.requests["GetExecution"] > 1
+
+
+def test_lazy_fetch_query_is_cancelled_when_loaded(make_dune):
+    query = make_dune(MockDune(**STUCK)).fetch_query(3, lazy=True, cancel=set_event())
+    with pytest.raises(DuneCancelledError):
+        query.load()
+
+
+def test_create_query_stops_polling_when_cancelled(make_dune):
+    dune = make_dune(MockDune(**STUCK))
+    dune.user_id = 1
+    with pytest.raises(DuneCancelledError):
+        dune.create_query("temp", "select 1", DatasetId.ETHEREUM, cancel=set_event())
+
+
+def test_cancelled_fetch_queries_start_nothing(dune, mock):
+    results = list(dune.fetch_queries([1, 2, 3], cancel=set_event()))
+    assert all(isinstance(result.error, DuneCancelledError) for result in results)
+    assert mock.requests == {}
+
+
+def test_fetch_queries_cancels_pending_fetches(make_dune):
+    mock = MockDune(**STUCK)
+    cancel = cancel_after(0.05)
+    results = list(make_dune(mock).fetch_queries([1, 2, 3], cancel=cancel))
+    assert len(results) == 3
+    assert all(isinstance(result.error, DuneCancelledError) for result in results)
+
+
+def test_sweep_query_reports_cancelled_runs(make_dune):
+    mock = MockDune(**STUCK)
+    dates = ["2021-01-01 00:00:00", "2021-02-01 00:00:00"]
+    result = make_dune(mock).sweep_query(
+        3, {"Start Date": dates}, cancel=cancel_after(0.05)
+    )
+    assert result.df.empty
+    assert [failure.key for failure in result.failures] == [0, 1]
+    assert all(isinstance(f.error, DuneCancelledError) for f in result.failures)
+
+
+def test_async_fetch_query_stops_polling_when_cancelled(make_async_dune):
+    mock = MockDune(**STUCK)
+
+    async def run():
+        cancel = asyncio.Event()
+        asyncio.get_running_loop().call_later(0.05, cancel.set)
+        async with make_async_dune(mock) as dune:
+            await dune.fetch_query(3, cancel=cancel)
+
+    with pytest.raises(DuneCancelledError):
+        asyncio.run(run())
+    assert mock.requests["GetExecution"] > 1
+
+
+def test_async_bulk_methods_take_cancel(make_async_dune):
+    mock = MockDune(**STUCK)
+
+    async def run():
+        cancel = asyncio.Event()
+        cancel.set()
+        async with make_async_dune(mock) as dune:
+            fetched = [
+                result async for result in dune.fetch_queries([1, 2], cancel=cancel)
+            ]
+            swept = await dune.sweep_query(
+                3, [{"Start Date": "2021-01-01 00:00:00"}], cancel=cancel
+            )
+            return fetched + swept.failures
+
+    results = asyncio.run(run())
+    assert len(results) == 3
+    assert all(isinstance(result.error, DuneCancelledError) for result in results)
+    assert "ExecuteQuery" not in mock.requests
@@ -0,0 +1,255 @@
+import asyncio
+from typing import Optional
+
+import httpx
+import pandas as pd
+import pytest
+
+from benchmarks.mockserver import COLUMNS, MockDune
+from dunebuggy import Dune
+from dunebuggy.core.asyncgqlquerier import AsyncGraphQLQuerier
+from dunebuggy.core.cache import ResultCache
+from dunebuggy.core.exceptions import DuneError, DuneExecutionError, DuneHTTPError
+from dunebuggy.core.gqlquerier import GraphQLQuerier
+from dunebuggy.core.memo import AsyncSingleFlight
+from dunebuggy.core.operations import Operations
+from dunebuggy.core.retry import RetryPolicy
+from dunebuggy.models.query import ExecutionQueued, ExecutionRunning, QueryResultData
+
+
+def counter(metrics, name: str) -> float:
+    return metrics.counters.get((name, None), 0)
+
+
+def span_total(metrics, name: str, operation: str, attribute: str) -> float:
+    stats = metrics.spans.get((name, operation))
+    return 0 if stats is None else stats.totals.get(attribute, 0)
+
+
+def test_fetch_query(dune, mock):
+    query = dune.fetch_query(5)
+    assert query.columns == COLUMNS
+    assert len(query.df) == 5
+    assert mock.requests == {"FindQuery": 1, "GetResult": 1, "GetExecution": 1}
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+def test_fetch_polls_queued_and_running_executions(make_dune, columnar):
+    mock = MockDune(queued_polls=2, running_polls=3)
+    dune = make_dune(mock, columnar=columnar)
+    query = dune.fetch_query(7)
+    assert len(query.df) == 7
+    assert mock.requests["GetExecution"] == 6
+
+
+def test_execution_head_reports_queued_then_running(make_dune):
+    mock = MockDune(queued_polls=1, running_polls=1)
+    gqlquerier = make_dune(mock).gqlquerier
+    execution_id = gqlquerier.execute_query([], 3)
+    statuses = [gqlquerier.get_execution_head(execution_id, [], 3) for _ in range(3)]
+    assert isinstance(statuses[0], ExecutionQueued)
+    assert isinstance(statuses[1], ExecutionRunning)
+    assert isinstance(statuses[2], QueryResultData)
+    assert statuses[2].columns == COLUMNS and statuses[2].data == []
+
+
+def test_failed_execution_raises(dune):
+    with pytest.raises(DuneExecutionError):
+        dune.gqlquerier.wait_for_execution("no-such-execution", [], 3)
+    with pytest.raises(DuneExecutionError):
+        list(dune.gqlquerier.stream_execution("no-such-execution", [], 3))
+
+
+def test_failed_requests_are_retried(make_dune, metrics):
+    mock = MockDune(error_rate=0.3, seed=1)
+    dune = make_dune(mock)
+    for query_id in range(1, 11):
+        assert len(dune.fetch_query(query_id).df) == query_id
+    assert span_total(metrics, "graphql.request", "GetExecution", "retries") > 0
+
+
+def test_retries_give_up_after_max_retries(make_dune):
+    mock = MockDune()
+    dune = make_dune(mock, retry_policy=RetryPolicy(max_retries=2, initial_delay=0))
+    mock.error_rate = 1.0
+    with pytest.raises(DuneHTTPError) as error:
+        dune.fetch_query(5)
+    assert error.value.response.status_code == 503
+    assert mock.requests["FindQuery"] == 3
+
+
+def test_persisted_query_misses_are_resent_in_full(make_dune):
+    mock = MockDune()
+    dune = make_dune(mock, operations=Operations(persisted=True))
+    dune.fetch_query(5)
+    # Each operation is sent as a hash, missed, then sent in full
+    assert mock.requests == {"FindQuery": 2, "GetResult": 2, "GetExecution": 2}
+    dune.fetch_query(5)
+    assert mock.requests == {"FindQuery": 3, "GetResult": 3, "GetExecution": 3}
+
+
+def test_cache_hit(make_dune, mock, metrics, tmp_path):
+    dune = make_dune(mock, cache=ResultCache(str(tmp_path)))
+    first = dune.fetch_query(5)
+    requests = dict(mock.requests)
+    second = dune.fetch_query(5)
+    assert mock.requests == requests
+    assert counter(metrics, "cache.miss") == 1
+    assert counter(metrics, "cache.hit") == 1
+    pd.testing.assert_frame_equal(first.df, second.df)
+
+
+def test_stale_cache_entry_is_revalidated(make_dune, mock, metrics, tmp_path):
+    dune = make_dune(mock, cache=ResultCache(str(tmp_path), ttl=0))
+    dune.fetch_query(5)
+    query = dune.fetch_query(5)
+    assert len(query.df) == 5
+    assert counter(metrics, "cache.revalidated") == 1
+    # The result id matched the cached one, so the rows weren't downloaded again
+    assert mock.requests["GetExecution"] == 1
+
+
+def test_stale_cache_entry_with_a_newer_result_is_downloaded(
+    make_dune, metrics, tmp_path
+):
+    mock = MockDune()
+    dune = make_dune(mock, cache=ResultCache(str(tmp_path), ttl=0))
+    dune.fetch_query(5)
+    mock.running_polls = 1  # GetResult now answers with a new job
+    assert len(dune.fetch_query(5).df) == 5
+    assert counter(metrics, "cache.miss") == 2
+    assert counter(metrics, "cache.revalidated") == 0
+
+
+@pytest.mark.parametrize("rows, sizes", [(5, [2, 2, 1]), (4, [2, 2]), (0, [0])])
+def test_stream_query_batches(dune, rows, sizes):
+    query = dune.stream_query(rows)
+    dfs = list(query.iter_dfs(batch_size=2))
+    assert [len(df) for df in dfs] == sizes
+    assert all(list(df.columns) == COLUMNS for df in dfs)
+
+
+def test_stream_query_polls_queued_and_running_executions(make_dune):
+    mock = MockDune(queued_polls=1, running_polls=1)
+    query = make_dune(mock).stream_query(5)
+    assert sum(len(df) for df in query.iter_dfs(batch_size=2)) == 5
+
+
+@pytest.mark.parametrize("rows", [0, 1, 5])
+@pytest.mark.parametrize("stream", [False, True])
+def test_csv_export_across_batches(dune, tmp_path, rows, stream):
+    query = dune.stream_query(rows) if stream else dune.fetch_query(rows)
+    path = tmp_path / "result.csv"
+    query.to_csv(path, index=False, batch_size=2)
+    df = pd.read_csv(path)
+    assert list(df.columns) == COLUMNS
+    assert list(df["block_number"]) == [12_000_000 + i for i in range(rows)]
+
+
+@pytest.mark.parametrize("rows", [0, 5])
+@pytest.mark.parametrize("stream", [False, True])
+def test_parquet_export_across_batches(dune, tmp_path, rows, stream):
+    pyarrow = pytest.importorskip("pyarrow")
+    import pyarrow.parquet
+
+    query = dune.stream_query(rows) if stream else dune.fetch_query(rows)
+    path = tmp_path / "result.parquet"
+    query.to_parquet(path, batch_size=2)
+    table = pyarrow.parquet.read_table(path)
+    assert table.column_names == COLUMNS
+    assert table.column("block_number").to_pylist() == [
+        12_000_000 + i for i in range(rows)
+    ]
+
+
+def test_async_fetch_and_stream(make_async_dune):
+    mock = MockDune(queued_polls=1, running_polls=1)
+
+    async def run():
+        async with make_async_dune(mock) as dune:
+            query = await dune.fetch_query(5)
+            streamed = await dune.stream_query(5)
+            sizes = [len(df) async for df in streamed.aiter_dfs(batch_size=2)]
+            return len(query.df), sizes
+
+    assert asyncio.run(run()) == (5, [2, 2, 1])
+
+
+def test_async_querier_is_set_up_like_the_sync_one():
+    # Anything GraphQLQuerier.__init__ sets up, AsyncGraphQLQuerier has too
+    querier = AsyncGraphQLQuerier(None, columnar=True)
+    assert set(vars(querier)) == set(vars(GraphQLQuerier(None)))
+    assert querier.columnar
+    assert isinstance(querier.single_flight, AsyncSingleFlight)
+
+
+def test_shared_client_keeps_its_login(make_dune, mock):
+    dune = make_dune(mock, username="alice", password="secret")
+    assert dune.user_id == 1
+    shared = Dune(client=dune.client)
+    assert shared.client.headers["authorization"] == "Bearer benchmark-token"
+    with pytest.raises(DuneError):
+        Dune("bob", "secret", client=dune.client)
+
+
+def test_shared_transport_keeps_logins_apart(mock):
+    transport = mock.transport()
+    alice = Dune("alice", "secret", transport=transport)
+    anonymous = Dune(transport=transport)
+    assert alice.client.headers["authorization"] == "Bearer benchmark-token"
+    assert "authorization" not in anonymous.client.headers
+
+
+EXPIRED = {"errors": [{"message": "Could not verify JWT", "code": "invalid-jwt"}]}
+
+
+class Expiring:
+    # Rejects the first GetExecution as if the session token had expired
+    def __init__(self, mock: MockDune):
+        self.mock = mock
+        self.rejected = 0
+
+    def reject(self, request: httpx.Request) -> Optional[httpx.Response]:
+        if self.rejected or b'"GetExecution"' not in request.content:
+            return None
+        self.rejected += 1
+        return httpx.Response(200, json=EXPIRED)
+
+    def transport(self) -> httpx.MockTransport:
+        return httpx.MockTransport(
+            lambda request: self.reject(request) or self.mock.handle(request)
+        )
+
+    def async_transport(self) -> httpx.MockTransport:
+        async def handle(request: httpx.Request) -> httpx.Response:
+            return self.reject(request) or await self.mock.ahandle(request)
+
+        return httpx.MockTransport(handle)
+
+
+def test_stream_refreshes_an_expired_session(make_dune, mock):
+    expiring = Expiring(mock)
+    dune = make_dune(mock, transport=expiring.transport())
+    refreshed = list()
+    dune.gqlquerier.on_unauthorized = lambda authorization: not refreshed.append(1)
+    sizes = [len(df) for df in dune.stream_query(5).iter_dfs(batch_size=2)]
+    assert sizes == [2, 2, 1]
+    assert expiring.rejected == len(refreshed) == 1
+
+
+def test_async_stream_refreshes_an_expired_session(make_async_dune, mock):
+    expiring = Expiring(mock)
+    refreshed = list()
+
+    async def on_unauthorized(authorization):
+        refreshed.append(1)
+        return True
+
+    async def run():
+        async with make_async_dune(mock, transport=expiring.async_transport()) as dune:
+            dune.gqlquerier.on_unauthorized = on_unauthorized
+            query = await dune.stream_query(5)
+            return [len(df) async for df in query.aiter_dfs(batch_size=2)]
+
+    assert asyncio.run(run()) == [2, 2, 1]
+    assert expiring.rejected == len(refreshed) == 1
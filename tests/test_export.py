@@ -0,0 +1,136 @@
+from datetime import datetime, timezone
+from decimal import Decimal
+
+import pandas as pd
+import pytest
+
+from dunebuggy.core.decoding import decode_columns
+from dunebuggy.core.dunequery import DuneQuery
+from dunebuggy.models.query import Query, QueryMetadata, QueryResultData, User
+
+pyarrow = pytest.importorskip("pyarrow")
+import pyarrow.parquet  # noqa: E402
+
+GENERATED_AT = datetime(2021, 6, 1, tzinfo=timezone.utc)
+UINT256_MAX = 2**256 - 1
+
+
+def make_query(rows, columns=None, columnar=False) -> DuneQuery:
+    columns = columns if columns is not None else list(rows[0])
+    metadata = QueryMetadata(
+        id=1,
+        name="export",
+        description="",
+        user=User(id=1, name="tester", profile_image_url=None),
+        query="select 1",
+        parameters=[],
+        created_at=GENERATED_AT,
+        updated_at=GENERATED_AT,
+    )
+    arrays = decode_columns(columns, rows) if columnar else None
+    result_data = QueryResultData.construct(
+        execution_id="r1",
+        runtime_seconds=1,
+        generated_at=GENERATED_AT,
+        columns=columns,
+        data=None if columnar else rows,
+        arrays=arrays,
+    )
+    query = Query.construct(metadata=metadata, result_data=result_data)
+    return DuneQuery(query, columnar=columnar)
+
+
+def read_back(query: DuneQuery, format: str, tmp_path):
+    if format == "arrow":
+        return query.to_arrow(batch_size=2)
+    if format == "parquet":
+        path = tmp_path / "result.parquet"
+        query.to_parquet(path, batch_size=2)
+        return pyarrow.parquet.read_table(path)
+    path = tmp_path / "result.arrow"
+    query.to_feather(path, batch_size=2)
+    return pyarrow.ipc.open_file(pyarrow.memory_map(str(path))).read_all()
+
+
+FORMATS = ["arrow", "parquet", "feather"]
+
+
+@pytest.mark.parametrize("format", FORMATS)
+@pytest.mark.parametrize("columnar", [False, True])
+def test_int_column_widens_to_float_in_later_batch(format, columnar, tmp_path):
+    rows = [{"amount": 1}, {"amount": 2}, {"amount": 2.5}, {"amount": 3}]
+    table = read_back(make_query(rows, columnar=columnar), format, tmp_path)
+    assert table.schema.field("amount").type == pyarrow.float64()
+    assert table.column("amount").to_pylist() == [1.0, 2.0, 2.5, 3.0]
+
+
+@pytest.mark.parametrize("format", FORMATS)
+def test_null_first_batch_takes_later_type(format, tmp_path):
+    rows = [{"value": None}, {"value": None}, {"value": 7}, {"value": 8}]
+    table = read_back(make_query(rows), format, tmp_path)
+    assert pyarrow.types.is_integer(table.schema.field("value").type)
+    assert table.column("value").to_pylist() == [None, None, 7, 8]
+
+
+@pytest.mark.parametrize("format", FORMATS)
+def test_timestamps_followed_by_text_become_strings(format, tmp_path):
+    rows = [
+        {"when": "2021-06-01T00:00:00+00:00"},
+        {"when": "2021-06-02T00:00:00+00:00"},
+        {"when": "not a date"},
+    ]
+    table = read_back(make_query(rows), format, tmp_path)
+    assert table.schema.field("when").type == pyarrow.string()
+    values = table.column("when").to_pylist()
+    assert values[0].startswith("2021-06-01") and values[2] == "not a date"
+
+
+@pytest.mark.parametrize("format", FORMATS)
+@pytest.mark.parametrize("columnar", [False, True])
+def test_integers_beyond_int64_are_decimals(format, columnar, tmp_path):
+    rows = [{"wei": 10**30}, {"wei": None}, {"wei": 5}]
+    table = read_back(make_query(rows, columnar=columnar), format, tmp_path)
+    assert pyarrow.types.is_decimal(table.schema.field("wei").type)
+    assert table.column("wei").to_pylist() == [Decimal(10**30), None, Decimal(5)]
+
+
+@pytest.mark.parametrize("format", FORMATS)
+def test_integers_beyond_decimal256_are_strings(format, tmp_path):
+    rows = [{"wei": UINT256_MAX}, {"wei": 1}]
+    table = read_back(make_query(rows), format, tmp_path)
+    assert table.column("wei").to_pylist() == [str(UINT256_MAX), "1"]
+
+
+@pytest.mark.parametrize("format", FORMATS)
+def test_mixed_object_column_is_stored_as_strings(format, tmp_path):
+    rows = [{"mixed": 1}, {"mixed": "a"}, {"mixed": 2.5}]
+    table = read_back(make_query(rows), format, tmp_path)
+    assert table.column("mixed").to_pylist() == ["1", "a", "2.5"]
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+def test_csv_is_written_in_chunks_without_building_the_dataframe(columnar, tmp_path):
+    rows = [{"a": i, "b": f"\\x{i:02x}"} for i in range(5)]
+    query = make_query(rows, columnar=columnar)
+    path = tmp_path / "result.csv"
+    query.to_csv(path, batch_size=2)
+    assert query._df is None
+    df = pd.read_csv(path, index_col=0)
+    assert list(df.index) == list(range(5))
+    assert list(df["a"]) == list(range(5))
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+def test_empty_result_csv_has_a_header(columnar, tmp_path):
+    query = make_query([], columns=["a", "b"], columnar=columnar)
+    path = tmp_path / "result.csv"
+    query.to_csv(path, index=False)
+    assert path.read_text().strip() == "a,b"
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+@pytest.mark.parametrize("rows", [0, 3])
+def test_length_does_not_build_the_dataframe(columnar, rows):
+    query = make_query([{"a": i} for i in range(rows)], ["a"], columnar=columnar)
+    assert query.length == rows
+    assert query._df is None
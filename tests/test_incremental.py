@@ -0,0 +1,96 @@
+import pandas as pd
+import pytest
+
+from dunebuggy.core.exceptions import DuneError
+from dunebuggy.core.incremental import merge_frames, narrow_parameters
+from dunebuggy.models.constants import ParameterEnum
+from dunebuggy.models.query import QueryParameter
+
+PARAMETERS = [
+    QueryParameter(key="Start Date", type=ParameterEnum.DATETIME, value="2021-01-01"),
+    QueryParameter(key="Token", type=ParameterEnum.TEXT, value="WETH"),
+]
+
+
+def start_date(parameters):
+    return next(p.value for p in parameters if p.key == "Start Date")
+
+
+def test_narrows_on_a_timestamp_key():
+    df = pd.DataFrame(
+        {"day": ["2021-06-01T00:00:00+00:00", "2021-06-03T12:30:00+00:00"]}
+    )
+    narrowed = narrow_parameters(PARAMETERS, df, "day")
+    assert start_date(narrowed) == "2021-06-03 12:30:00"
+    assert narrowed[1] == PARAMETERS[1]
+
+
+def test_narrows_on_a_datetime_key():
+    df = pd.DataFrame({"day": pd.to_datetime(["2021-06-01", "2021-06-02"], utc=True)})
+    assert start_date(narrow_parameters(PARAMETERS, df, "day")) == "2021-06-02 00:00:00"
+
+
+@pytest.mark.parametrize(
+    "values", [[17_000_000, 17_000_001], ["\\x00ab", "\\x00cd"], [None, None]]
+)
+def test_keys_without_timestamps_are_not_narrowed(values):
+    df = pd.DataFrame({"key": values})
+    assert narrow_parameters(PARAMETERS, df, "key") is None
+
+
+def test_time_column_is_used_instead_of_the_key():
+    df = pd.DataFrame(
+        {
+            "block_number": [17_000_000, 17_000_001],
+            "block_time": ["2023-04-01 10:00:00", "2023-04-01 10:00:12"],
+        }
+    )
+    narrowed = narrow_parameters(
+        PARAMETERS, df, "block_number", time_column="block_time"
+    )
+    assert start_date(narrowed) == "2023-04-01 10:00:12"
+
+
+def test_time_column_without_timestamps_raises():
+    df = pd.DataFrame({"block_number": [17_000_000], "hash": ["\\x00ab"]})
+    with pytest.raises(DuneError):
+        narrow_parameters(PARAMETERS, df, "block_number", time_column="hash")
+    with pytest.raises(DuneError):
+        narrow_parameters(PARAMETERS, df, "block_number", time_column="missing")
+
+
+def test_queries_without_a_start_date_are_not_narrowed():
+    df = pd.DataFrame({"day": ["2021-06-01T00:00:00+00:00"]})
+    assert narrow_parameters(PARAMETERS[1:], df, "day") is None
+    assert narrow_parameters(PARAMETERS, df.iloc[0:0], "day") is None
+
+
+def test_merge_frames():
+    old = pd.DataFrame({"day": ["d1", "d2", "d3"], "value": [1.0, 2.0, None]})
+    new = pd.DataFrame({"day": ["d3", "d2", "d4"], "value": [None, 5.0, 4.0]})
+    merged, added, changed = merge_frames(old, new, "day")
+    expected = pd.DataFrame(
+        {"day": ["d1", "d2", "d3", "d4"], "value": [1.0, 5.0, None, 4.0]}
+    )
+    pd.testing.assert_frame_equal(merged, expected)
+    assert added.to_dict("list") == {"day": ["d4"], "value": [4.0]}
+    # Nulls on both sides aren't a change
+    assert changed.to_dict("list") == {"day": ["d2"], "value": [5.0]}
+
+
+def test_merge_frames_requires_a_unique_key():
+    old = pd.DataFrame({"day": ["d1"], "value": [1]})
+    with pytest.raises(DuneError):
+        merge_frames(old, pd.DataFrame({"day": ["d1", "d1"], "value": [1, 2]}), "day")
+    with pytest.raises(DuneError):
+        merge_frames(old, pd.DataFrame({"value": [1]}), "day")
+
+
+def test_merge_frames_requires_the_previous_columns():
+    old = pd.DataFrame({"day": ["d1"], "value": [1], "count": [2]})
+    with pytest.raises(DuneError, match=r"\['value', 'count'\]"):
+        merge_frames(old, pd.DataFrame({"day": ["d2"]}), "day")
+    # New columns are dropped, the merged result keeps the previous shape
+    new = pd.DataFrame({"day": ["d2"], "value": [3], "count": [4], "extra": [5]})
+    merged, _, _ = merge_frames(old, new, "day")
+    assert list(merged.columns) == ["day", "value", "count"]
@@ -0,0 +1,58 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Barrier, Lock
+
+import pytest
+
+from dunebuggy.core.memo import MISSING, SingleFlight, TTLCache
+
+
+def test_concurrent_calls_share_one_call():
+    single_flight = SingleFlight()
+    calls = list()
+    lock = Lock()
+    barrier = Barrier(8)
+
+    def fn():
+        with lock:
+            calls.append(1)
+        time.sleep(0.05)
+        return "value"
+
+    def call(_):
+        barrier.wait()
+        return single_flight.do("key", fn)
+
+    with ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(call, range(8)))
+    assert results == ["value"] * 8
+    assert len(calls) == 1
+
+
+def test_errors_are_shared_and_not_remembered():
+    single_flight = SingleFlight()
+
+    def fail():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        single_flight.do("key", fail)
+    assert single_flight.do("key", lambda: 1) == 1
+
+
+def test_distinct_keys_are_called_separately():
+    single_flight = SingleFlight()
+    assert single_flight.do("a", lambda: 1) == 1
+    assert single_flight.do("b", lambda: 2) == 2
+
+
+def test_ttl_cache_expires_and_evicts_entries():
+    cache = TTLCache(maxsize=2)
+    cache.set("stale", 1, ttl=-1)
+    assert cache.get("stale") is MISSING
+    cache.set("a", 1, ttl=60)
+    cache.set("b", 2, ttl=60)
+    cache.get("a")
+    cache.set("c", 3, ttl=60)
+    assert cache.get("b") is MISSING
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
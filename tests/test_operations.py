@@ -0,0 +1,104 @@
+import json
+
+import httpx
+import pytest
+
+from dunebuggy.core.dune import Dune
+from dunebuggy.core.exceptions import DuneError
+from dunebuggy.core.gqlquerier import GraphQLQuerier
+from dunebuggy.core.operations import Operations
+from dunebuggy.models.constants import DatasetId
+from dunebuggy.models.gqlqueries import QueryName
+
+EXTRA = {"is_private": False, "tags": ["dex"]}
+
+
+def body(operations: Operations, query_name: QueryName, variables: dict) -> dict:
+    return json.loads(operations[query_name].encode(variables))
+
+
+def upsert_variables() -> dict:
+    object, on_conflict = Dune.build_create_query(
+        1, "temp", "select 1", DatasetId.ETHEREUM, True
+    )
+    return GraphQLQuerier.upsert_variables(object, on_conflict, 1)
+
+
+def fields(query: str) -> list:
+    # The fields selected on the operation's root field, comments left out
+    lines = query.split("{", 2)[2].splitlines()
+    return [
+        line.strip()
+        for line in lines
+        if line.strip() not in ("", "}") and not line.strip().startswith("#")
+    ]
+
+
+def test_find_query_is_lean_by_default():
+    operations = Operations()
+    sent = body(operations, QueryName.FIND_QUERY, {"id": 3, "session_filter": {}})
+    assert sent["variables"] == {"id": 3}
+    assert "visualizations" not in sent["query"]
+    assert (
+        "visualizations"
+        in body(Operations(lean=False), QueryName.FIND_QUERY, {"id": 3})["query"]
+    )
+
+
+def test_upsert_query_keeps_the_full_selection_by_default():
+    variables = upsert_variables()
+    full = body(Operations(), QueryName.UPSERT_QUERY, variables)
+    assert full["query"] == QueryName.UPSERT_QUERY.get_query_string()
+    assert full["variables"]["session_id"] == 1
+
+    lean = body(Operations(lean_upsert=True), QueryName.UPSERT_QUERY, variables)
+    assert fields(lean["query"]) == ["id"]
+    assert set(lean["variables"]) == {"object", "on_conflict"}
+
+
+def test_lean_upsert_needs_lean_operations():
+    operations = Operations(lean=False, lean_upsert=True)
+    assert not operations.lean_upsert
+    assert operations[QueryName.UPSERT_QUERY].query == (
+        QueryName.UPSERT_QUERY.get_query_string()
+    )
+
+
+def test_extra_fields_are_selected():
+    operations = Operations(
+        extra_fields={
+            QueryName.FIND_QUERY: ["is_private", "tags"],
+            QueryName.UPSERT_QUERY: ["name"],
+        },
+        lean_upsert=True,
+    )
+    assert fields(operations[QueryName.FIND_QUERY].query)[-2:] == ["is_private", "tags"]
+    assert fields(operations[QueryName.UPSERT_QUERY].query) == ["id", "name"]
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {"lean": False, "extra_fields": {QueryName.FIND_QUERY: ["tags"]}},
+        {"extra_fields": {QueryName.UPSERT_QUERY: ["name"]}},
+        {"extra_fields": {QueryName.GET_RESULT: ["job_id"]}},
+    ],
+)
+def test_extra_fields_need_a_lean_selection(kwargs):
+    with pytest.raises(DuneError):
+        Operations(**kwargs)
+
+
+def test_extra_fields_end_up_in_metadata(make_dune, mock):
+    def handle(request: httpx.Request) -> httpx.Response:
+        response = mock.handle(request)
+        if b'"FindQuery"' in request.content and b"is_private" in request.content:
+            data = response.json()
+            data["data"]["queries"][0].update(EXTRA)
+            return httpx.Response(200, json=data)
+        return response
+
+    operations = Operations(extra_fields={QueryName.FIND_QUERY: list(EXTRA)})
+    dune = make_dune(mock, transport=httpx.MockTransport(handle), operations=operations)
+    assert dune.fetch_query(3).query.metadata.extra == EXTRA
+    assert make_dune(mock).fetch_query(3).query.metadata.extra == {}
@@ -0,0 +1,163 @@
+import asyncio
+import threading
+import time
+from typing import Optional
+
+import httpx
+import pytest
+
+from dunebuggy.core.exceptions import DuneError, DuneHTTPError
+from dunebuggy.core.provision import QuerySpec
+from dunebuggy.models.constants import DatasetId
+from dunebuggy.models.query import QueryResultData
+
+ROWS = [3, 1, 4, 2, 5]
+FAILING = 13
+
+
+def spec(rows: int) -> QuerySpec:
+    # MockDune numbers created queries by their limit, which is also their row count
+    return QuerySpec(
+        f"temp {rows}",
+        f"select * from synthetic limit {rows}",
+        DatasetId.ETHEREUM,
+        is_temp=True,
+    )
+
+
+def reject_upsert(request: httpx.Request) -> Optional[httpx.Response]:
+    if b"UpsertQuery" in request.content and f"limit {FAILING}".encode() in (
+        request.content
+    ):
+        return httpx.Response(503, text="unavailable")
+    return None
+
+
+@pytest.fixture
+def logged_in(make_dune, mock):
+    def make(**kwargs):
+        transport = httpx.MockTransport(
+            lambda request: reject_upsert(request) or mock.handle(request)
+        )
+        dune = make_dune(mock, transport=transport, **kwargs)
+        dune.user_id = 1
+        return dune
+
+    return make
+
+
+@pytest.fixture
+def logged_in_async(make_async_dune, mock):
+    def make(**kwargs):
+        async def handle(request: httpx.Request) -> httpx.Response:
+            return reject_upsert(request) or await mock.ahandle(request)
+
+        dune = make_async_dune(mock, transport=httpx.MockTransport(handle), **kwargs)
+        dune.user_id = 1
+        return dune
+
+    return make
+
+
+def wait_until(predicate, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def test_create_query(logged_in):
+    query = logged_in().create_query("temp", "select * from synthetic limit 4", 4)
+    assert query.query_id == 4
+    assert len(query.df) == 4
+
+
+def test_creating_needs_a_login(dune, mock):
+    with pytest.raises(DuneError):
+        dune.create_queries([spec(1)])
+    assert mock.requests == {}
+
+
+def test_create_queries_fetches_in_the_background(logged_in, mock):
+    threads = set(threading.enumerate())
+    handles = logged_in().create_queries(map(spec, ROWS), max_workers=2)
+    wait_until(lambda: all(handle.done() for handle in handles))
+    assert [handle.query_id for handle in handles] == ROWS
+    assert [handle.wait().length for handle in handles] == ROWS
+    assert mock.requests["UpsertQuery"] == mock.requests["ExecuteQuery"] == 5
+    # The pool shuts itself down once every query was created and downloaded
+    wait_until(lambda: set(threading.enumerate()) <= threads)
+
+
+def test_create_queries_without_fetch_downloads_on_wait(logged_in, mock):
+    handles = logged_in().create_queries(map(spec, ROWS), fetch=False)
+    created = [handle.created() for handle in handles]
+    assert [query_id for query_id, _ in created] == ROWS
+    assert "GetExecution" not in mock.requests
+    assert not any(handle.done() for handle in handles)
+    status = handles[0].status()
+    assert isinstance(status, QueryResultData) and status.data == []
+    assert handles[2].wait().length == 4
+    assert mock.requests["GetExecution"] == 1
+
+
+@pytest.mark.parametrize("fetch", [True, False])
+def test_failed_upsert_only_fails_its_handle(logged_in, mock, fetch):
+    handles = logged_in().create_queries(map(spec, [1, FAILING, 2]), fetch=fetch)
+    with pytest.raises(DuneHTTPError):
+        handles[1].created()
+    with pytest.raises(DuneHTTPError):
+        handles[1].wait()
+    assert [handles[0].wait().length, handles[2].wait().length] == [1, 2]
+    assert mock.requests["ExecuteQuery"] == 2
+
+
+def test_wait_queries(logged_in):
+    dune = logged_in()
+    handles = dune.create_queries(map(spec, [2, FAILING, 3]), fetch=False)
+    results = sorted(dune.wait_queries(handles), key=lambda result: result.key)
+    assert [result.key for result in results] == [0, 1, 2]
+    assert [result.ok for result in results] == [True, False, True]
+    assert isinstance(results[1].error, DuneHTTPError)
+    assert [results[0].value.length, results[2].value.length] == [2, 3]
+
+
+@pytest.mark.parametrize("fetch", [True, False])
+def test_async_create_queries(logged_in_async, mock, fetch):
+    async def run():
+        async with logged_in_async() as dune:
+            handles = dune.create_queries(
+                map(spec, ROWS), max_concurrency=2, fetch=fetch
+            )
+            created = [(await handle.created()).query_id for handle in handles]
+            downloads = mock.requests.get("GetExecution", 0)
+            queries = await asyncio.gather(*handles)
+            return created, downloads, [query.length for query in queries]
+
+    created, downloads, lengths = asyncio.run(run())
+    assert created == lengths == ROWS
+    if not fetch:
+        assert downloads == 0
+
+
+def test_async_failed_upsert_only_fails_its_handle(logged_in_async, mock):
+    async def run():
+        async with logged_in_async() as dune:
+            handles = dune.create_queries(map(spec, [1, FAILING, 2]))
+            return await asyncio.gather(*handles, return_exceptions=True)
+
+    first, failed, last = asyncio.run(run())
+    assert isinstance(failed, DuneHTTPError)
+    assert [first.length, last.length] == [1, 2]
+    assert mock.requests["ExecuteQuery"] == 2
+
+
+def test_async_wait_queries(logged_in_async):
+    async def run():
+        async with logged_in_async() as dune:
+            handles = dune.create_queries(map(spec, [2, FAILING, 3]), fetch=False)
+            return [result async for result in dune.wait_queries(handles)]
+
+    results = sorted(asyncio.run(run()), key=lambda result: result.key)
+    assert [result.ok for result in results] == [True, False, True]
+    assert [results[0].value.length, results[2].value.length] == [2, 3]
@@ -0,0 +1,55 @@
+import asyncio
+import time
+
+import pytest
+
+from dunebuggy.core.ratelimit import RateLimiter, TokenBucket
+from dunebuggy.models.constants import APP_API_URL, GRAPH_QL_URL
+
+
+def throttled(metrics, operation: str) -> float:
+    stats = metrics.spans.get(("graphql.request", operation))
+    return 0 if stats is None else stats.totals.get("throttled_seconds", 0)
+
+
+def test_bucket_allows_bursts_then_spaces_out_tokens():
+    bucket = TokenBucket(rate=10, burst=2)
+    delays = [bucket.reserve() for _ in range(4)]
+    assert delays[:2] == [0, 0]
+    assert delays[2] == pytest.approx(0.1, abs=0.01)
+    assert delays[3] == pytest.approx(0.2, abs=0.01)
+
+
+def test_limiter_keeps_hosts_apart():
+    limiter = RateLimiter.for_dune(graph_ql_rate=10, app_api_rate=10, burst=1)
+    assert limiter.reserve(GRAPH_QL_URL) == 0
+    assert limiter.reserve(APP_API_URL) == 0
+    assert limiter.reserve(GRAPH_QL_URL) > 0
+    assert limiter.reserve("https://example.com/") == 0
+
+
+def test_requests_are_throttled_per_host(make_dune, mock, metrics):
+    # FindQuery and GetResult share core-hsr's budget, GetExecution has app-api's
+    limiter = RateLimiter.for_dune(graph_ql_rate=5, app_api_rate=1000, burst=1)
+    dune = make_dune(mock, rate_limiter=limiter)
+    started = time.monotonic()
+    dune.fetch_query(1)
+    dune.fetch_query(2)
+    # Four core-hsr requests at 5 a second, the first one free
+    assert time.monotonic() - started >= 0.55
+    assert throttled(metrics, "FindQuery") + throttled(metrics, "GetResult") >= 0.55
+    assert throttled(metrics, "GetExecution") < 0.01
+
+
+def test_limiter_is_shared_between_clients(make_dune, make_async_dune, mock):
+    limiter = RateLimiter.for_dune(graph_ql_rate=5, app_api_rate=1000, burst=1)
+    dune = make_dune(mock, rate_limiter=limiter)
+
+    async def run():
+        async with make_async_dune(mock, rate_limiter=limiter) as async_dune:
+            await async_dune.fetch_query(1)
+
+    started = time.monotonic()
+    dune.fetch_query(1)
+    asyncio.run(run())
+    assert time.monotonic() - started >= 0.55
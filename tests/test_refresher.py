@@ -0,0 +1,134 @@
+import time
+from concurrent.futures import Future
+
+import pytest
+
+from dunebuggy.core.exceptions import DuneError
+from dunebuggy.core.refresher import Refresher, RefreshJob, load_manifest
+from dunebuggy.core.store import ResultStore
+
+pytest.importorskip("pyarrow")
+
+HOUR = 3600.0
+
+
+def wait_until(predicate, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def recording(refresher: Refresher) -> list:
+    # (key, time.monotonic()) of every refresh started
+    calls = list()
+    refresh = refresher.refresh
+
+    def record(job: RefreshJob) -> str:
+        calls.append((job.key, time.monotonic()))
+        return refresh(job)
+
+    refresher.refresh = record
+    return calls
+
+
+def queued_keys(refresher: Refresher) -> set:
+    return {entry[-1].key for entry in refresher._scheduled + refresher._ready}
+
+
+@pytest.fixture
+def store(tmp_path) -> ResultStore:
+    return ResultStore(str(tmp_path / "store"))
+
+
+def test_due_jobs_run_by_priority(dune, store):
+    jobs = [
+        RefreshJob(1, HOUR, priority=2),
+        RefreshJob(2, HOUR, priority=0),
+        RefreshJob(3, HOUR, priority=1),
+    ]
+    refresher = Refresher(dune, jobs, store, max_concurrency=1, stagger=0)
+    calls = recording(refresher)
+    with refresher:
+        wait_until(lambda: len(calls) == 3)
+    assert [key for key, _ in calls] == ["2", "3", "1"]
+    wait_until(lambda: all(s.refreshed_at for s in refresher.status.values()))
+    assert store.names() == ["1", "2", "3"]
+
+
+def test_rate_budget_spaces_out_refreshes(dune, store):
+    jobs = [RefreshJob(query_id, HOUR) for query_id in range(1, 5)]
+    refresher = Refresher(dune, jobs, store, rate=20, burst=1, stagger=0)
+    calls = recording(refresher)
+    with refresher:
+        wait_until(lambda: len(calls) == 4)
+    starts = sorted(started for _, started in calls)
+    gaps = [later - earlier for earlier, later in zip(starts, starts[1:])]
+    assert min(gaps) >= 0.04
+
+
+def test_failures_back_off_up_to_the_interval(dune, store):
+    job = RefreshJob(1, interval=10.0)
+    refresher = Refresher(dune, [job], store, jitter=0, retry_delay=1.0)
+    failed = Future()
+    failed.set_exception(RuntimeError("boom"))
+    delays = list()
+    for _ in range(6):
+        refresher._scheduled.clear()
+        refresher._running += 1
+        now = time.time()
+        refresher.finished(job, failed)
+        delays.append(round(refresher._scheduled[0][0] - now))
+    assert delays == [1, 2, 4, 8, 10, 10]
+    assert refresher.status[job.key].failures == 6
+    assert isinstance(refresher.status[job.key].error, RuntimeError)
+
+
+def test_failed_refresh_is_retried(dune, store):
+    job = RefreshJob(1, HOUR, parameters={"No Such Parameter": "1"})
+    refresher = Refresher(dune, [job], store, stagger=0, retry_delay=0.01)
+    with refresher:
+        wait_until(lambda: refresher.status[job.key].failures >= 3)
+    assert refresher.status[job.key].refreshed_at is None
+
+
+def test_cancelled_refresh_is_rescheduled(dune, store):
+    job = RefreshJob(1, HOUR)
+    refresher = Refresher(dune, [job], store)
+    refresher._scheduled.clear()
+    refresher._running = 1
+    cancelled = Future()
+    cancelled.cancel()
+    refresher.finished(job, cancelled)
+    assert refresher._running == 0
+    assert queued_keys(refresher) == {job.key}
+
+
+def test_stop_and_restart_keeps_every_job(dune, store):
+    # Stopped while the second job waits for rate budget
+    jobs = [RefreshJob(query_id, HOUR) for query_id in range(1, 5)]
+    refresher = Refresher(dune, jobs, store, rate=5, burst=1, stagger=0)
+    refresher.start()
+    wait_until(lambda: refresher.status["1"].refreshed_at is not None)
+    refresher.stop()
+    keys = {job.key for job in jobs}
+    assert queued_keys(refresher) == keys
+    assert refresher._running == 0
+
+    refresher.start()
+    try:
+        wait_until(lambda: all(s.refreshed_at for s in refresher.status.values()))
+    finally:
+        refresher.stop()
+    assert store.names() == sorted(keys)
+
+
+def test_jobs_need_distinct_keys(dune, store):
+    with pytest.raises(DuneError):
+        Refresher(dune, [RefreshJob(1, HOUR), RefreshJob(1, 60.0)], store)
+
+
+def test_load_manifest(tmp_path):
+    path = tmp_path / "manifest.json"
+    path.write_text('[{"query_id": 1, "interval": 60, "priority": -1}]')
+    assert load_manifest(str(path)) == [RefreshJob(1, 60, priority=-1)]
@@ -0,0 +1,180 @@
+import asyncio
+import time
+from email.utils import formatdate
+from typing import Optional
+
+import httpx
+import pytest
+
+from benchmarks.mockserver import MockDune
+from dunebuggy.core.dune import Dune
+from dunebuggy.core.exceptions import DuneHTTPError
+from dunebuggy.core.retry import RetryPolicy, retry_after
+from dunebuggy.models.constants import DatasetId
+
+CONNECT_ERROR = httpx.ConnectError("refused")
+READ_ERROR = httpx.ReadError("reset")
+
+
+class Failing:
+    # Answers the first times requests for operation with status (or raises error)
+    #   before letting them through to the MockDune
+    def __init__(
+        self,
+        mock: MockDune,
+        operation: str,
+        status: int = 503,
+        times: int = 1,
+        headers: Optional[dict] = None,
+        error: Optional[Exception] = None,
+    ):
+        self.mock = mock
+        self.operation = operation
+        self.status = status
+        self.times = times
+        self.headers = headers or dict()
+        self.error = error
+        self.failed = 0
+        self.sent = 0
+
+    def respond(self, request: httpx.Request) -> Optional[httpx.Response]:
+        if f'"{self.operation}"'.encode() not in request.content:
+            return None
+        self.sent += 1
+        if self.failed >= self.times:
+            return None
+        self.failed += 1
+        if self.error is not None:
+            raise self.error
+        return httpx.Response(self.status, headers=self.headers, text="unavailable")
+
+    def transport(self) -> httpx.MockTransport:
+        return httpx.MockTransport(
+            lambda request: self.respond(request) or self.mock.handle(request)
+        )
+
+    def async_transport(self) -> httpx.MockTransport:
+        async def handle(request: httpx.Request) -> httpx.Response:
+            return self.respond(request) or await self.mock.ahandle(request)
+
+        return httpx.MockTransport(handle)
+
+
+def upsert(dune: Dune) -> dict:
+    object, on_conflict = Dune.build_create_query(
+        1, "temp", "select 1", DatasetId.ETHEREUM, True
+    )
+    return dune.gqlquerier.upsert_query(object, on_conflict, 1)
+
+
+def execute(dune: Dune) -> str:
+    return dune.gqlquerier.execute_query([], 3)
+
+
+MUTATIONS = [("UpsertQuery", upsert), ("ExecuteQuery", execute)]
+
+
+@pytest.mark.parametrize("operation, send", MUTATIONS)
+@pytest.mark.parametrize("status", [500, 503])
+def test_mutations_are_not_retried_on_server_errors(
+    make_dune, mock, operation, send, status
+):
+    failing = Failing(mock, operation, status)
+    dune = make_dune(mock, transport=failing.transport())
+    with pytest.raises(DuneHTTPError) as error:
+        send(dune)
+    assert error.value.response.status_code == status
+    assert failing.sent == 1
+
+
+@pytest.mark.parametrize("operation, send", MUTATIONS)
+def test_mutations_are_retried_when_rate_limited(make_dune, mock, operation, send):
+    failing = Failing(mock, operation, 429, times=2)
+    dune = make_dune(mock, transport=failing.transport())
+    send(dune)
+    assert failing.sent == 3
+
+
+@pytest.mark.parametrize("operation, send", MUTATIONS)
+def test_mutations_are_retried_only_when_not_sent(make_dune, mock, operation, send):
+    failing = Failing(mock, operation, error=CONNECT_ERROR)
+    send(make_dune(mock, transport=failing.transport()))
+    assert failing.sent == 2
+
+    failing = Failing(mock, operation, error=READ_ERROR)
+    with pytest.raises(httpx.ReadError):
+        send(make_dune(mock, transport=failing.transport()))
+    assert failing.sent == 1
+
+
+@pytest.mark.parametrize("error", [None, READ_ERROR])
+def test_reads_are_retried(make_dune, mock, error):
+    failing = Failing(mock, "GetExecution", times=2, error=error)
+    dune = make_dune(mock, transport=failing.transport())
+    assert len(dune.fetch_query(5).df) == 5
+    assert failing.sent == 3
+
+
+def test_retries_stop_at_max_retries(make_dune, mock):
+    failing = Failing(mock, "ExecuteQuery", 429, times=10)
+    dune = make_dune(
+        mock,
+        transport=failing.transport(),
+        retry_policy=RetryPolicy(max_retries=2, initial_delay=0),
+    )
+    with pytest.raises(DuneHTTPError):
+        execute(dune)
+    assert failing.sent == 3
+
+
+@pytest.mark.parametrize("date", [False, True])
+def test_retry_after_is_honoured(make_dune, mock, date):
+    value = formatdate(time.time() + 1.2) if date else "0.2"
+    failing = Failing(mock, "FindQuery", 429, headers={"retry-after": value})
+    dune = make_dune(mock, transport=failing.transport())
+    started = time.monotonic()
+    dune.fetch_query(5)
+    # HTTP dates only have whole seconds
+    assert time.monotonic() - started >= 0.19
+    assert failing.sent == 2
+
+
+def test_retry_after_is_capped(make_dune, mock):
+    failing = Failing(mock, "FindQuery", 503, headers={"retry-after": "3600"})
+    policy = RetryPolicy(initial_delay=0, jitter=0, max_retry_after=0.01)
+    dune = make_dune(mock, transport=failing.transport(), retry_policy=policy)
+    started = time.monotonic()
+    dune.fetch_query(5)
+    assert time.monotonic() - started < 1
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        (None, None),
+        ("2", 2.0),
+        ("-1", 0.0),
+        ("soon", None),
+        ("Thu, 01 Jan 1970 00:00:00 GMT", 0.0),
+    ],
+)
+def test_retry_after(value, expected):
+    headers = {} if value is None else {"retry-after": value}
+    assert retry_after(httpx.Response(503, headers=headers)) == expected
+
+
+def test_async_mutations_are_retried_only_when_rate_limited(make_async_dune, mock):
+    async def execute(failing: Failing):
+        async with make_async_dune(mock, transport=failing.async_transport()) as dune:
+            return await dune.gqlquerier.execute_query([], 3)
+
+    failing = Failing(mock, "ExecuteQuery", 503)
+    with pytest.raises(DuneHTTPError):
+        asyncio.run(execute(failing))
+    assert failing.sent == 1
+
+    failing = Failing(mock, "ExecuteQuery", 429, headers={"retry-after": "0.2"})
+    started = time.monotonic()
+    asyncio.run(execute(failing))
+    assert time.monotonic() - started >= 0.19
+    assert failing.sent == 2
@@ -0,0 +1,208 @@
+import asyncio
+import base64
+import json
+import os
+import time
+from typing import Optional
+
+import httpx
+import pytest
+
+from benchmarks.mockserver import SESSION, MockDune
+from dunebuggy.core.session import SessionStore, token_expiry
+
+USERNAME = "alice"
+LOGIN = [
+    ("GET", "/auth/login"),
+    ("POST", "/api/auth"),
+    ("POST", "/api/auth/session"),
+]
+REFRESH = [("POST", "/api/auth/session")]
+
+
+def jwt(expires_at: float, serial: int) -> str:
+    claims = json.dumps({"exp": int(expires_at), "jti": serial}).encode()
+    payload = base64.urlsafe_b64encode(claims).decode().rstrip("=")
+    return f"header.{payload}.signature"
+
+
+class Auth:
+    # dune.com's auth endpoints in front of a MockDune. Session tokens last lifetime
+    #   seconds and are refreshed with the session cookie set by logging in, until
+    #   the cookie is revoked. With expire_next, the next GetExecution is rejected as
+    #   if its token had expired
+    def __init__(self, mock: MockDune, lifetime: float = 3600.0):
+        self.mock = mock
+        self.lifetime = lifetime
+        self.revoked = False
+        self.expire_next = False
+        self.issued = 0
+        self.requests = list()  # (method, path), CSRF requests left out
+        self.rejected = list()  # authorization headers of rejected requests
+
+    def respond(self, request: httpx.Request) -> Optional[httpx.Response]:
+        path = request.url.path
+        if not path.startswith(("/api", "/auth")):
+            if self.expire_next and b'"GetExecution"' in request.content:
+                self.expire_next = False
+                self.rejected.append(request.headers["authorization"])
+                return httpx.Response(200, json={"errors": [{"code": "invalid-jwt"}]})
+            return None
+        if path != "/api/auth/csrf":
+            self.requests.append((request.method, path))
+        if path == "/auth/login":
+            return httpx.Response(200, headers={"set-cookie": "csrf=c; Path=/"})
+        if path == "/api/auth":
+            self.revoked = False
+            return httpx.Response(200, headers={"set-cookie": "session=s; Path=/"})
+        if path == "/api/auth/session":
+            if self.revoked or "session=s" not in request.headers.get("cookie", ""):
+                return httpx.Response(401, json={"error": "unauthorized"})
+            self.issued += 1
+            token = jwt(time.time() + self.lifetime, self.issued)
+            return httpx.Response(200, json={**SESSION, "token": token})
+        return httpx.Response(200, json={})
+
+    def transport(self) -> httpx.MockTransport:
+        return httpx.MockTransport(
+            lambda request: self.respond(request) or self.mock.handle(request)
+        )
+
+    def async_transport(self) -> httpx.MockTransport:
+        async def handle(request: httpx.Request) -> httpx.Response:
+            return self.respond(request) or await self.mock.ahandle(request)
+
+        return httpx.MockTransport(handle)
+
+
+@pytest.fixture
+def auth(mock) -> Auth:
+    return Auth(mock)
+
+
+@pytest.fixture
+def store(tmp_path) -> SessionStore:
+    return SessionStore(str(tmp_path / "sessions.json"))
+
+
+@pytest.fixture
+def login(make_dune, mock, auth, store):
+    # Logs in once so the store holds a session, then forgets the requests made
+    def login(lifetime: float = 3600.0):
+        auth.lifetime = lifetime
+        dune = make_dune(
+            mock,
+            transport=auth.transport(),
+            username=USERNAME,
+            password="secret",
+            session_store=store,
+        )
+        auth.lifetime = 3600.0
+        auth.requests.clear()
+        return dune
+
+    return login
+
+
+def restore(make_dune, mock, auth, store, password: Optional[str] = None):
+    return make_dune(
+        mock,
+        transport=auth.transport(),
+        username=USERNAME,
+        password=password,
+        session_store=store,
+    )
+
+
+def test_store_round_trip(login, store):
+    dune = login()
+    session = store.load(USERNAME)
+    assert session.token == dune.session.token
+    assert session.user_id == 1
+    assert {cookie.name for cookie in session.cookies} == {"csrf", "session"}
+    assert os.stat(store.path).st_mode & 0o777 == 0o600
+    store.clear(USERNAME)
+    assert store.load(USERNAME) is None
+
+
+def test_expired_sessions_are_still_loaded(login, store):
+    login(lifetime=-120)
+    session = store.load(USERNAME)
+    assert session is not None and session.expired()
+    assert token_expiry(session.token) == session.expires_at
+
+
+def test_saved_session_needs_no_requests(login, make_dune, mock, auth, store):
+    token = login().session.token
+    dune = restore(make_dune, mock, auth, store)
+    assert auth.requests == []
+    assert dune.user_id == 1
+    assert dune.client.headers["authorization"] == f"Bearer {token}"
+    assert len(dune.fetch_query(3).df) == 3
+
+
+def test_expired_session_is_refreshed_with_its_cookies(
+    login, make_dune, mock, auth, store
+):
+    login(lifetime=-120)
+    dune = restore(make_dune, mock, auth, store)
+    assert auth.requests == REFRESH
+    assert dune.user_id == 1
+    assert not dune.session.expired()
+    assert not store.load(USERNAME).expired()
+
+
+def test_revoked_session_falls_back_to_logging_in(login, make_dune, mock, auth, store):
+    login(lifetime=-120)
+    auth.revoked = True
+    dune = restore(make_dune, mock, auth, store, password="secret")
+    assert auth.requests == REFRESH + LOGIN
+    assert dune.user_id == 1
+    assert not store.load(USERNAME).expired()
+
+
+def test_revoked_session_without_a_password_is_anonymous(
+    login, make_dune, mock, auth, store
+):
+    login(lifetime=-120)
+    auth.revoked = True
+    dune = restore(make_dune, mock, auth, store)
+    assert auth.requests == REFRESH
+    assert dune.user_id is None and dune.session is None
+    assert "authorization" not in dune.client.headers
+
+
+def test_rejected_token_is_refreshed_during_a_stream(login, auth):
+    dune = login()
+    stale = dune.client.headers["authorization"]
+    auth.expire_next = True
+    sizes = [len(df) for df in dune.stream_query(5).iter_dfs(batch_size=2)]
+    assert sizes == [2, 2, 1]
+    assert auth.rejected == [stale]
+    assert auth.requests == REFRESH
+    assert dune.client.headers["authorization"] != stale
+
+
+def test_rejected_token_falls_back_to_logging_in(login, auth):
+    dune = login()
+    auth.revoked = True
+    auth.expire_next = True
+    assert len(dune.fetch_query(5).df) == 5
+    assert auth.requests == REFRESH + LOGIN
+    assert dune.user_id == 1
+
+
+def test_async_expired_session_is_refreshed(login, make_async_dune, mock, auth, store):
+    login(lifetime=-120)
+
+    async def run():
+        async with make_async_dune(
+            mock,
+            transport=auth.async_transport(),
+            username=USERNAME,
+            session_store=store,
+        ) as dune:
+            return dune.user_id, dune.session.expired()
+
+    assert asyncio.run(run()) == (1, False)
+    assert auth.requests == REFRESH
@@ -0,0 +1,54 @@
+import pytest
+
+from dunebuggy.core.exceptions import DuneError
+from dunebuggy.core.store import ResultStore
+
+pyarrow = pytest.importorskip("pyarrow")
+
+
+@pytest.fixture
+def store(tmp_path) -> ResultStore:
+    return ResultStore(str(tmp_path / "store"))
+
+
+def test_publish_and_read(dune, store):
+    assert store.read("transfers") is None
+    assert store.published_at("transfers") is None
+    query = dune.fetch_query(5)
+    store.publish("transfers", query)
+    table = store.read("transfers")
+    assert table.num_rows == 5
+    assert table.column_names == query.columns
+    assert store.read_df("transfers")["block_number"].tolist() == list(
+        query.df["block_number"]
+    )
+    assert store.names() == ["transfers"]
+    assert store.age("transfers") >= 0
+    metadata = store.metadata("transfers")
+    assert metadata["query_id"] == "5"
+    assert metadata["execution_id"] == "result-5"
+
+
+def test_reads_are_memory_mapped(dune, store):
+    store.publish("transfers", dune.fetch_query(1_000))
+    allocated = pyarrow.total_allocated_bytes()
+    table = store.read("transfers")
+    # Buffers point into the mapped file rather than being copied into memory
+    assert pyarrow.total_allocated_bytes() == allocated
+    assert table.num_rows == 1_000
+
+
+def test_republishing_keeps_earlier_reads_valid(dune, store):
+    store.publish("transfers", dune.fetch_query(3))
+    before = store.read("transfers")
+    store.publish("transfers", dune.fetch_query(7))
+    assert store.read("transfers").num_rows == 7
+    assert before.num_rows == 3
+    assert before.column("block_number").to_pylist()[-1] == 12_000_002
+    # No temporary files are left behind
+    assert store.names() == ["transfers"]
+
+
+def test_invalid_names_are_rejected(store):
+    with pytest.raises(DuneError):
+        store.path("../escape")
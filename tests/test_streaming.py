@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+from benchmarks.mockserver import COLUMNS, MockDune
+from dunebuggy.core.exceptions import DuneError
+from dunebuggy.core.gqlquerier import GraphQLQuerier
+from dunebuggy.core.streaming import ExecutionStreamParser
+
+BODY = MockDune().result_body(5, rows=True, gzipped=False).decode()
+
+
+def feed(parser: ExecutionStreamParser, text: str, chunk_size: int) -> list:
+    rows = list()
+    for start in range(0, len(text), chunk_size):
+        rows.extend(parser.feed(text[start : start + chunk_size]))
+    parser.close()
+    return rows
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, len(BODY)])
+def test_rows_are_parsed_across_chunks(chunk_size):
+    parser = ExecutionStreamParser()
+    rows = feed(parser, BODY, chunk_size)
+    expected = json.loads(BODY)["data"]["get_execution"]["execution_succeeded"]
+    assert rows == expected["data"]
+    assert parser.columns == COLUMNS
+
+
+def test_raw_result_is_the_response_without_rows():
+    parser = ExecutionStreamParser()
+    feed(parser, BODY, 16)
+    expected = json.loads(BODY)
+    expected["data"]["get_execution"]["execution_succeeded"]["data"] = []
+    assert parser.raw_result() == expected
+    status = GraphQLQuerier.process_execution(parser.raw_result())
+    assert status.execution_id == "result-5" and status.columns == COLUMNS
+
+
+def test_rows_are_returned_as_soon_as_they_are_complete():
+    parser = ExecutionStreamParser()
+    first_row_end = BODY.index("}", BODY.index('"data": [')) + 1
+    assert parser.feed(BODY[:first_row_end]) == []
+    assert len(parser.feed(",")) == 1
+
+
+def test_responses_without_rows():
+    body = MockDune().result_body(5, rows=False, gzipped=False).decode()
+    parser = ExecutionStreamParser()
+    assert feed(parser, body, 5) == []
+    assert parser.columns == COLUMNS
+
+
+def test_truncated_response_raises():
+    parser = ExecutionStreamParser()
+    parser.feed(BODY[: len(BODY) // 2])
+    with pytest.raises(DuneError):
+        parser.close()
@@ -0,0 +1,97 @@
+import asyncio
+from typing import Optional
+
+import httpx
+import pytest
+
+from dunebuggy.core.exceptions import DuneError, DuneGraphQLError
+from dunebuggy.core.sweep import expand_overrides
+
+DATES = ["2021-01-01 00:00:00", "2021-02-01 00:00:00", "2021-03-01 00:00:00"]
+FAILING = DATES[1]
+
+
+def fail(request: httpx.Request) -> Optional[httpx.Response]:
+    # Executions of the query with FAILING as their start date are refused
+    if b'"ExecuteQuery"' in request.content and FAILING.encode() in request.content:
+        return httpx.Response(200, json={"errors": [{"message": "bad start date"}]})
+    return None
+
+
+@pytest.fixture
+def failing_dune(make_dune, mock):
+    def make(**kwargs):
+        transport = httpx.MockTransport(
+            lambda request: fail(request) or mock.handle(request)
+        )
+        return make_dune(mock, transport=transport, **kwargs)
+
+    return make
+
+
+@pytest.fixture
+def failing_async_dune(make_async_dune, mock):
+    async def handle(request: httpx.Request) -> httpx.Response:
+        return fail(request) or await mock.ahandle(request)
+
+    return make_async_dune(mock, transport=httpx.MockTransport(handle))
+
+
+def test_grids_expand_to_every_combination():
+    grid = {"a": ["1", "2"], "b": ["x", "y", "z"]}
+    overrides = expand_overrides(grid)
+    assert len(overrides) == 6
+    assert overrides[:3] == [
+        {"a": "1", "b": "x"},
+        {"a": "1", "b": "y"},
+        {"a": "1", "b": "z"},
+    ]
+    assert overrides[-1] == {"a": "2", "b": "z"}
+    assert expand_overrides([{"a": "1"}]) == [{"a": "1"}]
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+def test_rows_are_tagged_with_their_parameters(make_dune, mock, columnar):
+    dune = make_dune(mock, columnar=columnar)
+    result = dune.sweep_query(2, {"Start Date": DATES}, max_workers=2)
+    assert result.failures == []
+    assert list(result.df["Start Date"]) == [date for date in DATES for _ in range(2)]
+    assert len(result.df.columns) == 7
+    # Metadata is looked up once, every combination is its own execution
+    assert mock.requests["FindQuery"] == 1
+    assert mock.requests["ExecuteQuery"] == 3
+
+
+def test_failed_combinations_are_reported(failing_dune, mock):
+    result = failing_dune().sweep_query(3, [{"Start Date": date} for date in DATES])
+    assert list(result.df["Start Date"].unique()) == [DATES[0], DATES[2]]
+    assert len(result.df) == 6
+    [failure] = result.failures
+    assert failure.key == 1
+    assert [param.value for param in failure.parameters] == [FAILING]
+    assert isinstance(failure.error, DuneGraphQLError)
+
+
+def test_every_combination_failing_gives_an_empty_frame(failing_dune):
+    result = failing_dune().sweep_query(3, {"Start Date": [FAILING]})
+    assert result.df.empty
+    assert len(result.failures) == 1
+
+
+def test_unknown_parameters_fail_before_running(dune, mock):
+    with pytest.raises(DuneError):
+        dune.sweep_query(3, {"Start Date": DATES, "End Date": DATES})
+    assert "ExecuteQuery" not in mock.requests
+
+
+def test_async_sweep_query(failing_async_dune, mock):
+    async def run():
+        async with failing_async_dune as dune:
+            return await dune.sweep_query(2, {"Start Date": DATES}, max_concurrency=2)
+
+    result = asyncio.run(run())
+    assert list(result.df["Start Date"]) == [DATES[0]] * 2 + [DATES[2]] * 2
+    assert [failure.key for failure in result.failures] == [1]
+    assert isinstance(result.failures[0].error, DuneGraphQLError)
+    # The refused execution never reached the mock
+    assert mock.requests["ExecuteQuery"] == 2